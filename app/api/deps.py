@@ -1,17 +1,62 @@
 from __future__ import annotations
 
-from fastapi import Depends
+from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 
+from app.core.config import settings
 from app.core.security import decode_access_token
+from app.infra.async_store import AsyncStore
 from app.infra.json_store import JsonStore
+from app.infra.sqlite_store import SqliteStore
 
 auth_scheme = HTTPBearer(auto_error=True)
 
+Store = JsonStore | SqliteStore
 
-def get_store() -> JsonStore:
+
+def get_store() -> Store:
+    if settings.store_backend == "sqlite":
+        return SqliteStore(settings.sqlite_path)
     return JsonStore()
 
 
+def get_async_store() -> AsyncStore:
+    return AsyncStore(get_store())
+
+
 def get_current_user(creds: HTTPAuthorizationCredentials = Depends(auth_scheme)) -> dict:
     return decode_access_token(creds.credentials)
+
+
+def require_agent(store: Store, user: dict, agent_id: str) -> dict:
+    return _check_agent(store.get_agent(user["tenant_id"], agent_id), user)
+
+
+async def require_agent_async(store: AsyncStore, user: dict, agent_id: str) -> dict:
+    return _check_agent(await store.get_agent(user["tenant_id"], agent_id), user)
+
+
+def _check_agent(agent: dict | None, user: dict) -> dict:
+    if not agent:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Agente não encontrado.")
+    if user.get("role") != "admin" and agent["owner_user_id"] != user["user_id"]:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Sem acesso ao agente.")
+    return agent
+
+
+def require_conversation(store: Store, user: dict, conversation_id: str, agent_id: str | None = None) -> dict:
+    return _check_conversation(store.get_conversation(user["tenant_id"], conversation_id), user, agent_id)
+
+
+async def require_conversation_async(
+    store: AsyncStore, user: dict, conversation_id: str, agent_id: str | None = None
+) -> dict:
+    return _check_conversation(await store.get_conversation(user["tenant_id"], conversation_id), user, agent_id)
+
+
+def _check_conversation(conv: dict | None, user: dict, agent_id: str | None) -> dict:
+    if not conv or (agent_id is not None and conv["agent_id"] != agent_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Conversa não encontrada.")
+    if user.get("role") != "admin" and conv["user_id"] != user["user_id"]:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Sem acesso à conversa.")
+    return conv
@@ -1,7 +1,15 @@
 from __future__ import annotations
 
-from fastapi import APIRouter
-from app.domain.schemas import HealthResponse
+from fastapi import APIRouter, Depends, HTTPException, status
+from app.api.deps import get_current_user
+from app.core.concurrency import run_io
+from app.domain.schemas import HealthResponse, MetricsResponse
+from app.services.answer_cache import answer_cache
+from app.services.document_loader import text_cache
+from app.services.ingestion_service import partials_cache
+from app.services.matrix_index import index_cache
+from app.services.prompt_prefix import prefix_cache
+from app.services.url_fetcher import url_cache
 
 router = APIRouter(tags=["admin"])
 
@@ -9,3 +17,18 @@ router = APIRouter(tags=["admin"])
 @router.get("/health", response_model=HealthResponse)
 def health():
     return HealthResponse()
+
+
+@router.get("/admin/metrics", response_model=MetricsResponse)
+async def metrics(user=Depends(get_current_user)):
+    if user.get("role") != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Apenas admin pode ver métricas no PoC.")
+    caches = {
+        "extract": text_cache,
+        "partials": partials_cache,
+        "urls": url_cache,
+        "matrix_index": index_cache,
+        "prompt_prefix": prefix_cache,
+        "answers": answer_cache,
+    }
+    return MetricsResponse(caches={name: await run_io(c.stats) for name, c in caches.items()})
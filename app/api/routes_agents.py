@@ -1,79 +1,169 @@
 from __future__ import annotations
 
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form
-
-from app.api.deps import get_current_user, get_store
-from app.domain.schemas import AgentCreate, AgentOut, IngestRequest, IngestResponse
-from app.infra.json_store import JsonStore
-from app.services.groq_client import make_client
-from app.services.ingestion_service import synthesize_matrix
-from app.services.document_loader import extract_texts_from_uploads
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form, Query, Response
+
+from app.api.deps import Store, get_async_store, get_current_user, get_store, require_agent, require_agent_async
+from app.core.concurrency import run_io
+from app.core.governor import guard_payload_size
+from app.infra.async_store import AsyncStore
+from app.domain.schemas import (
+    AgentCreate,
+    AgentOut,
+    AgentUpdate,
+    ConversationOut,
+    IngestMode,
+    IngestRequest,
+    JobOut,
+    MatrixDiffOut,
+    MatrixOut,
+    MatrixSourcesOut,
+    MatrixVersionOut,
+)
+from app.services.ingest_jobs import job_store, runner
+from app.services.document_loader import save_uploads
+from app.services.prompt_prefix import prefix_cache
 
 router = APIRouter(prefix="/agents", tags=["agents"])
 
 
 @router.get("", response_model=list[AgentOut])
-def list_agents(user=Depends(get_current_user), store: JsonStore = Depends(get_store)):
+def list_agents(user=Depends(get_current_user), store: Store = Depends(get_store)):
     agents = store.list_agents(user["tenant_id"], user["user_id"], user.get("role", "user"))
     return [AgentOut(**a) for a in agents]
 
 
 @router.post("", response_model=AgentOut)
-def create_agent(body: AgentCreate, user=Depends(get_current_user), store: JsonStore = Depends(get_store)):
+def create_agent(body: AgentCreate, user=Depends(get_current_user), store: Store = Depends(get_store)):
     if user.get("role") != "admin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Apenas admin pode criar agentes no PoC.")
-    agent = store.create_agent(user["tenant_id"], user["user_id"], body.name, body.type, body.specialty)
+    agent = store.create_agent(
+        user["tenant_id"], user["user_id"], body.name, body.type, body.specialty, body.context_mode, body.context_tokens
+    )
     return AgentOut(**agent)
 
 
-@router.post("/{agent_id}/ingest", response_model=IngestResponse)
-def ingest(agent_id: str, body: IngestRequest, user=Depends(get_current_user), store: JsonStore = Depends(get_store)):
-    agent = store.get_agent(user["tenant_id"], agent_id)
-    if not agent:
+@router.patch("/{agent_id}", response_model=AgentOut)
+def update_agent(agent_id: str, body: AgentUpdate, user=Depends(get_current_user), store: Store = Depends(get_store)):
+    if user.get("role") != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Apenas admin pode alterar agentes no PoC.")
+    agent = require_agent(store, user, agent_id)
+    fields = {"context_mode": agent.get("context_mode"), "context_tokens": agent.get("context_tokens")}
+    fields.update(body.model_dump(include=body.model_fields_set))
+    updated = store.update_agent_context(user["tenant_id"], agent_id, **fields)
+    if updated is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Agente não encontrado.")
+    return AgentOut(**updated)
+
+
+@router.delete("/{agent_id}", status_code=status.HTTP_204_NO_CONTENT)
+def delete_agent(agent_id: str, user=Depends(get_current_user), store: Store = Depends(get_store)):
+    if user.get("role") != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Apenas admin pode remover agentes no PoC.")
+    if not store.delete_agent(user["tenant_id"], agent_id):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Agente não encontrado.")
-    if user.get("role") != "admin" and agent["owner_user_id"] != user["user_id"]:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Sem acesso ao agente.")
+    prefix_cache.drop_agent(agent_id)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+@router.get("/{agent_id}/conversations", response_model=list[ConversationOut])
+def list_agent_conversations(
+    agent_id: str,
+    offset: int = Query(default=0, ge=0),
+    limit: int = Query(default=50, ge=1, le=500),
+    user=Depends(get_current_user),
+    store: Store = Depends(get_store),
+):
+    require_agent(store, user, agent_id)
+    # admin vê todas as conversas do agente; usuário comum só as próprias
+    user_id = None if user.get("role") == "admin" else user["user_id"]
+    convs = store.list_conversations(user["tenant_id"], agent_id=agent_id, user_id=user_id, offset=offset, limit=limit)
+    return [ConversationOut(**c) for c in convs]
+
+
+@router.get("/{agent_id}/sources", response_model=list[MatrixSourcesOut])
+async def list_matrix_sources(agent_id: str, user=Depends(get_current_user), store: AsyncStore = Depends(get_async_store)):
+    await require_agent_async(store, user, agent_id)
+    return [MatrixSourcesOut(**r) for r in await store.list_matrix_sources(user["tenant_id"], agent_id)]
+
+
+@router.get("/{agent_id}/matrix", response_model=MatrixOut)
+async def get_matrix(
+    agent_id: str,
+    version: int | None = Query(default=None, ge=0),  # omitido: versão atual
+    user=Depends(get_current_user),
+    store: AsyncStore = Depends(get_async_store),
+):
+    agent = await require_agent_async(store, user, agent_id)
+    version = agent["matrix_version"] if version is None else version
+    matrix = await store.get_agent_matrix(user["tenant_id"], agent_id, version)
+    if matrix is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Versão da matriz não encontrada.")
+    return MatrixOut(agent_id=agent_id, version=version, matrix=matrix)
+
+
+@router.get("/{agent_id}/matrix/versions", response_model=list[MatrixVersionOut])
+async def list_matrix_versions(agent_id: str, user=Depends(get_current_user), store: AsyncStore = Depends(get_async_store)):
+    await require_agent_async(store, user, agent_id)
+    return [MatrixVersionOut(**r) for r in await store.list_matrix_versions(user["tenant_id"], agent_id)]
+
+
+@router.get("/{agent_id}/matrix/diff", response_model=MatrixDiffOut)
+async def diff_matrix(
+    agent_id: str,
+    from_version: int = Query(ge=0),
+    to_version: int | None = Query(default=None, ge=0),  # omitido: versão atual
+    user=Depends(get_current_user),
+    store: AsyncStore = Depends(get_async_store),
+):
+    agent = await require_agent_async(store, user, agent_id)
+    to_version = agent["matrix_version"] if to_version is None else to_version
+    diff = await store.diff_matrix_versions(user["tenant_id"], agent_id, from_version, to_version)
+    if diff is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Versão da matriz não encontrada.")
+    return MatrixDiffOut(agent_id=agent_id, from_version=from_version, to_version=to_version, diff=diff)
 
-    client = make_client()
-    matrix = synthesize_matrix(client, specialty=agent["specialty"], docs_text=body.docs_text, urls=body.urls)
 
-    updated = store.update_agent_matrix(user["tenant_id"], agent_id, matrix)
-    preview = (matrix[:800] + "…") if len(matrix) > 800 else matrix
-    return IngestResponse(agent_id=agent_id, matrix_version=int(updated["matrix_version"]), matrix_preview=preview)
+@router.post("/{agent_id}/ingest", response_model=JobOut, status_code=status.HTTP_202_ACCEPTED)
+async def ingest(
+    agent_id: str, body: IngestRequest, user=Depends(get_current_user), store: AsyncStore = Depends(get_async_store)
+):
+    await require_agent_async(store, user, agent_id)
+    # corpus grande demais falha já na submissão, não dentro do job
+    guard_payload_size(sum(len(d) for d in body.docs_text))
+
+    job_id = job_store.new_id()
+    job = await run_io(
+        job_store.create, job_id, user["tenant_id"], user["user_id"], agent_id,
+        {"docs_text": body.docs_text, "urls": body.urls, "files": [], "mode": body.mode},
+    )
+    runner.submit(job_id)
+    return JobOut(**job)
 
-@router.post("/{agent_id}/ingest/upload", response_model=IngestResponse)
+@router.post("/{agent_id}/ingest/upload", response_model=JobOut, status_code=status.HTTP_202_ACCEPTED)
 async def ingest_upload(
     agent_id: str,
     files: list[UploadFile] = File(default=[]),
     urls: str = Form(default=""),  # urls separadas por quebra de linha
+    mode: IngestMode = Form(default="replace"),
     user=Depends(get_current_user),
-    store: JsonStore = Depends(get_store),
+    store: AsyncStore = Depends(get_async_store),
 ):
-    agent = store.get_agent(user["tenant_id"], agent_id)
-    if not agent:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Agente não encontrado.")
-    if user.get("role") != "admin" and agent["owner_user_id"] != user["user_id"]:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Sem acesso ao agente.")
-
-    docs_text, warnings = await extract_texts_from_uploads(files)
+    await require_agent_async(store, user, agent_id)
 
     url_list = [u.strip() for u in (urls or "").splitlines() if u.strip()]
     # opcional: limitar qnt de urls no PoC
     url_list = url_list[:10]
 
-    client = make_client()
-    matrix = synthesize_matrix(
-        client,
-        specialty=agent["specialty"],
-        docs_text=docs_text,
-        urls=url_list,
+    # a extração roda no job; aqui só grava os arquivos na entrada dele
+    job_id = job_store.new_id()
+    try:
+        saved = await save_uploads(files, job_store.input_dir(job_id) / "files")
+    except HTTPException:
+        await run_io(job_store.drop_input, job_id)
+        raise
+    job = await run_io(
+        job_store.create, job_id, user["tenant_id"], user["user_id"], agent_id,
+        {"docs_text": [], "urls": url_list, "files": saved, "mode": mode},
     )
-
-    # cola avisos no começo da matriz (opcional)
-    if warnings:
-        prefix = "warnings:\n" + "\n".join([f"  - {w}" for w in warnings]) + "\n\n"
-        matrix = prefix + matrix
-
-    updated = store.update_agent_matrix(user["tenant_id"], agent_id, matrix)
-    preview = (matrix[:800] + "…") if len(matrix) > 800 else matrix
-    return IngestResponse(agent_id=agent_id, matrix_version=int(updated["matrix_version"]), matrix_preview=preview)
+    runner.submit(job_id)
+    return JobOut(**job)
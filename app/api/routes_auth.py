@@ -4,13 +4,13 @@ from fastapi import APIRouter, Depends, HTTPException, status
 
 from app.domain.schemas import LoginRequest, TokenResponse
 from app.core.security import create_access_token
-from app.infra.json_store import JsonStore
+from app.api.deps import Store, get_store
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
 
 @router.post("/login", response_model=TokenResponse)
-def login(body: LoginRequest, store: JsonStore = Depends(JsonStore)):
+def login(body: LoginRequest, store: Store = Depends(get_store)):
     user = store.authenticate(body.tenant_id, body.email, body.password)
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Credenciais inválidas")
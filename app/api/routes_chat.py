@@ -1,63 +1,200 @@
 from __future__ import annotations
 
 import json
-from fastapi import APIRouter, Depends, HTTPException, status
+import anyio
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status, Query, Response
 from fastapi.responses import StreamingResponse
-
-from app.api.deps import get_current_user, get_store
-from app.domain.schemas import ChatRequest, ChatResponse
-from app.infra.json_store import JsonStore
-from app.services.groq_client import make_client
-from app.services.chat_service import answer
+from starlette.background import BackgroundTask
+
+from app.api.deps import (
+    Store,
+    get_async_store,
+    get_current_user,
+    get_store,
+    require_agent_async,
+    require_conversation,
+    require_conversation_async,
+)
+from app.core.concurrency import run_blocking, run_io
+from app.infra.async_store import AsyncStore
+from app.domain.schemas import ChatRequest, ChatResponse, ConversationOut, MessagePage, MessageOut
+from app.services.answer_cache import answer_cache, answer_key
+from app.services.groq_client import get_async_client
+from app.services.chat_service import PromptPrefix, aanswer, aanswer_stream
+from app.services.history import fold_history, load_history
+from app.services.prompt_prefix import chat_prefix
 
 router = APIRouter(tags=["chat"])
 
 
+async def _prefix(store: AsyncStore, user: dict, agent: dict, prompt: str) -> PromptPrefix:
+    # o texto da matriz não vem no registro do agente: só é lido (na versão que o agente aponta)
+    # quando o prefixo do turno não está em cache ou o índice de seções ainda não existe
+    def load() -> str:
+        return store.sync.get_agent_matrix(user["tenant_id"], agent["id"], agent["matrix_version"]) or ""
+
+    return await run_blocking(chat_prefix, agent, _profile(user), load, prompt)
+
+
+def _profile(user: dict) -> str:
+    return user.get("role", "ADMIN").upper()
+
+
+async def _fold_history(store: AsyncStore, conv_id: str):
+    # depois da resposta: se o histórico passou do orçamento, as mensagens antigas vão para o resumo
+    try:
+        await run_blocking(fold_history, store.sync, conv_id)
+    except Exception:
+        pass  # sem resumo novo o próximo turno só leva menos histórico; tenta de novo depois
+
+
 @router.post("/chat", response_model=ChatResponse)
-def chat(body: ChatRequest, user=Depends(get_current_user), store: JsonStore = Depends(get_store)):
-    agent = store.get_agent(user["tenant_id"], body.agent_id)
-    if not agent:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Agente não encontrado.")
-    if user.get("role") != "admin" and agent["owner_user_id"] != user["user_id"]:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Sem acesso ao agente.")
+async def chat(
+    body: ChatRequest,
+    background: BackgroundTasks,
+    user=Depends(get_current_user),
+    store: AsyncStore = Depends(get_async_store),
+):
+    agent = await require_agent_async(store, user, body.agent_id)
+    prefix = await _prefix(store, user, agent, body.message)
 
     if body.conversation_id:
-        conv_id = body.conversation_id
+        conv_id = (await require_conversation_async(store, user, body.conversation_id, agent_id=body.agent_id))["id"]
     else:
-        conv_id = store.create_conversation(user["tenant_id"], user["user_id"], body.agent_id)["id"]
+        conv_id = (await store.create_conversation(user["tenant_id"], user["user_id"], body.agent_id))["id"]
+
+    # histórico lido antes de gravar a pergunta: ela vai no prompt uma vez só
+    history, summary = await run_io(load_history, store.sync, conv_id)
+    await store.append_message(conv_id, "user", body.message)
+
+    key = answer_key(user["tenant_id"], agent, prefix, history, summary, body.message)
+    reply = await run_io(answer_cache.get, key) if key else None
+    if reply is None:
+        reply = await aanswer(
+            get_async_client(),
+            agent,
+            history=history,
+            prompt=body.message,
+            profile=_profile(user),
+            summary=summary,
+            prefix=prefix,
+        )
+        if key and reply:
+            await run_io(answer_cache.set, key, reply)
+
+    await store.append_message(conv_id, "assistant", reply)
+    background.add_task(_fold_history, store, conv_id)
+    return ChatResponse(conversation_id=conv_id, agent_id=body.agent_id, answer=reply)
 
-    store.append_message(conv_id, "user", body.message)
-    history = store.load_last_messages(conv_id, limit=20)
 
-    client = make_client()
-    reply = answer(client, agent, history=history, prompt=body.message, profile=user.get("role", "ADMIN").upper())
+async def _replay(answer: str):
+    # acerto do cache de respostas: um único delta com a resposta inteira
+    yield answer
 
-    store.append_message(conv_id, "assistant", reply)
-    return ChatResponse(conversation_id=conv_id, agent_id=body.agent_id, answer=reply)
+
+def _sse(event: str, payload: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
 
 
 @router.post("/chat/stream")
-def chat_stream(body: ChatRequest, user=Depends(get_current_user), store: JsonStore = Depends(get_store)):
-    agent = store.get_agent(user["tenant_id"], body.agent_id)
-    if not agent:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Agente não encontrado.")
-    if user.get("role") != "admin" and agent["owner_user_id"] != user["user_id"]:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Sem acesso ao agente.")
+async def chat_stream(body: ChatRequest, user=Depends(get_current_user), store: AsyncStore = Depends(get_async_store)):
+    """SSE: um evento `delta` por trecho gerado e, ao final, `message` com a resposta completa."""
+    agent = await require_agent_async(store, user, body.agent_id)
+    prefix = await _prefix(store, user, agent, body.message)
 
     if body.conversation_id:
-        conv_id = body.conversation_id
+        conv_id = (await require_conversation_async(store, user, body.conversation_id, agent_id=body.agent_id))["id"]
     else:
-        conv_id = store.create_conversation(user["tenant_id"], user["user_id"], body.agent_id)["id"]
+        conv_id = (await store.create_conversation(user["tenant_id"], user["user_id"], body.agent_id))["id"]
 
-    store.append_message(conv_id, "user", body.message)
-    history = store.load_last_messages(conv_id, limit=20)
+    # histórico lido antes de gravar a pergunta: ela vai no prompt uma vez só
+    history, summary = await run_io(load_history, store.sync, conv_id)
+    await store.append_message(conv_id, "user", body.message)
 
-    client = make_client()
-    reply = answer(client, agent, history=history, prompt=body.message, profile=user.get("role", "ADMIN").upper())
-    store.append_message(conv_id, "assistant", reply)
-
-    def gen():
-        payload = {"conversation_id": conv_id, "agent_id": body.agent_id, "answer": reply}
-        yield f"event: message\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
-
-    return StreamingResponse(gen(), media_type="text/event-stream")
+    key = answer_key(user["tenant_id"], agent, prefix, history, summary, body.message)
+    cached = await run_io(answer_cache.get, key) if key else None
+    if cached is not None:
+        deltas = _replay(cached)
+    else:
+        deltas = aanswer_stream(
+            get_async_client(),
+            agent,
+            history=history,
+            prompt=body.message,
+            profile=_profile(user),
+            summary=summary,
+            prefix=prefix,
+        )
+
+    async def save(reply: str):
+        # shield: no disconnect a task do stream está sendo cancelada, mas a resposta parcial é gravada
+        with anyio.CancelScope(shield=True):
+            await store.append_message(conv_id, "assistant", reply)
+
+    async def gen():
+        parts: list[str] = []
+        saved = False
+        try:
+            try:
+                async for delta in deltas:
+                    parts.append(delta)
+                    yield _sse("delta", {"delta": delta})
+            except Exception as e:
+                # os headers já foram enviados: o erro vira evento
+                yield _sse("error", {"conversation_id": conv_id, "detail": str(e) or e.__class__.__name__})
+                return
+            reply = "".join(parts)
+            await save(reply)
+            saved = True
+            if key and cached is None and reply:
+                await run_io(answer_cache.set, key, reply)  # só resposta completa entra no cache
+            yield _sse("message", {"conversation_id": conv_id, "agent_id": body.agent_id, "answer": reply})
+        finally:
+            with anyio.CancelScope(shield=True):
+                await deltas.aclose()  # encerra a conexão com o provedor em caso de disconnect
+            if not saved and parts:
+                await save("".join(parts))
+
+    return StreamingResponse(
+        gen(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+        background=BackgroundTask(_fold_history, store, conv_id),
+    )
+
+
+@router.get("/conversations", response_model=list[ConversationOut])
+def list_my_conversations(
+    offset: int = Query(default=0, ge=0),
+    limit: int = Query(default=50, ge=1, le=500),
+    user=Depends(get_current_user),
+    store: Store = Depends(get_store),
+):
+    convs = store.list_conversations(user["tenant_id"], user_id=user["user_id"], offset=offset, limit=limit)
+    return [ConversationOut(**c) for c in convs]
+
+
+@router.get("/conversations/{conversation_id}/messages", response_model=MessagePage)
+def list_messages(
+    conversation_id: str,
+    offset: int = Query(default=0, ge=0, description="mensagens a pular a partir da mais recente"),
+    limit: int = Query(default=20, ge=1, le=500),
+    user=Depends(get_current_user),
+    store: Store = Depends(get_store),
+):
+    require_conversation(store, user, conversation_id)
+    messages = store.load_messages(conversation_id, offset=offset, limit=limit)
+    return MessagePage(
+        conversation_id=conversation_id,
+        total=store.count_messages(conversation_id),
+        offset=offset,
+        messages=[MessageOut(**m) for m in messages],
+    )
+
+
+@router.delete("/conversations/{conversation_id}", status_code=status.HTTP_204_NO_CONTENT)
+def delete_conversation(conversation_id: str, user=Depends(get_current_user), store: Store = Depends(get_store)):
+    require_conversation(store, user, conversation_id)
+    if not store.delete_conversation(user["tenant_id"], conversation_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Conversa não encontrada.")
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
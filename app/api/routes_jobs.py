@@ -0,0 +1,21 @@
+from __future__ import annotations
+
+from fastapi import APIRouter, Depends, HTTPException, status
+
+from app.api.deps import get_current_user
+from app.core.concurrency import run_io
+from app.domain.schemas import JobOut
+from app.services.ingest_jobs import job_store
+
+router = APIRouter(prefix="/jobs", tags=["jobs"])
+
+
+@router.get("/{job_id}", response_model=JobOut)
+async def get_job(job_id: str, user=Depends(get_current_user)):
+    job = await run_io(job_store.get, job_id)
+    # job de outro tenant (ou de outro usuário, para não-admin) é tratado como inexistente
+    if not job or job["tenant_id"] != user["tenant_id"] or (
+        user.get("role") != "admin" and job["user_id"] != user["user_id"]
+    ):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job não encontrado.")
+    return JobOut(**job)
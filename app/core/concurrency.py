@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+from app.core.config import settings
+
+T = TypeVar("T")
+
+# Pools separados: I/O de disco é curto e não pode esperar atrás de chamadas
+# de LLM/extração, que seguram uma thread por segundos.
+_executors: Dict[str, ThreadPoolExecutor] = {}
+_process_pool: Optional[ProcessPoolExecutor] = None
+_lock = threading.Lock()
+
+
+def _executor(name: str) -> ThreadPoolExecutor:
+    pool = _executors.get(name)
+    if pool is None:
+        with _lock:
+            pool = _executors.get(name)
+            if pool is None:
+                workers = settings.store_io_workers if name == "io" else settings.blocking_workers
+                pool = _executors[name] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+    return pool
+
+
+async def run_io(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Executa I/O de disco (store) no pool limitado, sem bloquear o event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor("io"), functools.partial(fn, *args, **kwargs))
+
+
+async def run_blocking(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Executa chamadas longas e síncronas (LLM, extração de documentos) no pool limitado."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor("blocking"), functools.partial(fn, *args, **kwargs))
+
+
+def process_pool() -> ProcessPoolExecutor:
+    """Pool de processos para trabalho de CPU (parsing de documentos), dimensionado por EXTRACT_WORKERS."""
+    global _process_pool
+    if _process_pool is None:
+        with _lock:
+            if _process_pool is None:
+                # forkserver: não herda threads/locks do processo da API; workers reciclados limitam vazamentos dos parsers
+                _process_pool = ProcessPoolExecutor(
+                    max_workers=max(1, settings.extract_workers),
+                    mp_context=multiprocessing.get_context("forkserver"),
+                    max_tasks_per_child=100,
+                )
+    return _process_pool
+
+
+def reset_process_pool(pool: ProcessPoolExecutor) -> None:
+    """Descarta um pool quebrado (worker morto); o próximo `process_pool()` cria outro."""
+    global _process_pool
+    with _lock:
+        if _process_pool is pool:
+            _process_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_executors() -> None:
+    global _process_pool
+    with _lock:
+        for pool in _executors.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+        _executors.clear()
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=False, cancel_futures=True)
+            _process_pool = None
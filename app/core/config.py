@@ -11,15 +11,108 @@ class Settings(BaseModel):
     groq_api_key: str = Field(default_factory=lambda: os.getenv("GROQ_API_KEY", ""))
     synth_model: str = Field(default_factory=lambda: os.getenv("SYNTH_MODEL", "llama-3.3-70b-versatile"))
     chat_model: str = Field(default_factory=lambda: os.getenv("CHAT_MODEL", "llama-3.3-70b-versatile"))
+    # "groq" ou "fake" (respostas determinísticas com latência simulada, para testes e benchmarks)
+    llm_backend: str = Field(default_factory=lambda: os.getenv("LLM_BACKEND", "groq").strip().lower())
+    fake_llm_first_token_ms: int = Field(default_factory=lambda: int(os.getenv("FAKE_LLM_FIRST_TOKEN_MS", "300")))
+    fake_llm_token_ms: int = Field(default_factory=lambda: int(os.getenv("FAKE_LLM_TOKEN_MS", "20")))
+    # custo simulado do prompt (prefill): soma-se à latência do primeiro token
+    fake_llm_prompt_token_us: int = Field(default_factory=lambda: int(os.getenv("FAKE_LLM_PROMPT_TOKEN_US", "0")))
+
+    # Clientes LLM compartilhados: pool HTTP, timeouts e retries (429/5xx) com backoff + jitter
+    llm_pool_size: int = Field(default_factory=lambda: int(os.getenv("LLM_POOL_SIZE", "64")))
+    llm_timeout_s: float = Field(default_factory=lambda: float(os.getenv("LLM_TIMEOUT_S", "120")))
+    llm_connect_timeout_s: float = Field(default_factory=lambda: float(os.getenv("LLM_CONNECT_TIMEOUT_S", "5")))
+    llm_max_retries: int = Field(default_factory=lambda: int(os.getenv("LLM_MAX_RETRIES", "3")))
+    llm_backoff_base_s: float = Field(default_factory=lambda: float(os.getenv("LLM_BACKOFF_BASE_S", "0.5")))
+    llm_backoff_max_s: float = Field(default_factory=lambda: float(os.getenv("LLM_BACKOFF_MAX_S", "20")))
 
     jwt_secret: str = Field(default_factory=lambda: os.getenv("JWT_SECRET", ""))
     jwt_issuer: str = Field(default_factory=lambda: os.getenv("JWT_ISSUER", "acid_agentia_hub"))
     jwt_expires_min: int = Field(default_factory=lambda: int(os.getenv("JWT_EXPIRES_MIN", "240")))
 
-    max_total_chars: int = Field(default_factory=lambda: int(os.getenv("MAX_TOTAL_CHARS", "120000")))
+    # corpus inteiro de uma ingestão (acima disso: 413, nada é truncado em silêncio); MAX_TOTAL_CHARS é o nome antigo
+    max_corpus_chars: int = Field(
+        default_factory=lambda: int(os.getenv("MAX_CORPUS_CHARS", os.getenv("MAX_TOTAL_CHARS", "12000000")))
+    )
     chunk_chars: int = Field(default_factory=lambda: int(os.getenv("CHUNK_CHARS", "12000")))
+    # reduce em árvore: máximo de parciais por grupo e orçamento de tokens da entrada de cada reduce
     max_partials: int = Field(default_factory=lambda: int(os.getenv("MAX_PARTIALS", "12")))
-    max_history_msgs: int = Field(default_factory=lambda: int(os.getenv("MAX_HISTORY_MSGS", "12")))
+    reduce_input_tokens: int = Field(default_factory=lambda: int(os.getenv("REDUCE_INPUT_TOKENS", "6000")))
+    # histórico do chat: orçamento de tokens (resumo + mensagens), mensagens candidatas e tamanho do resumo acumulado
+    history_tokens: int = Field(default_factory=lambda: int(os.getenv("HISTORY_TOKENS", "3000")))
+    # MAX_HISTORY_MSGS (limite antigo, em mensagens) ainda vale como janela se HISTORY_WINDOW_MSGS não estiver definido
+    history_window_msgs: int = Field(
+        default_factory=lambda: int(os.getenv("HISTORY_WINDOW_MSGS", os.getenv("MAX_HISTORY_MSGS", "200")))
+    )
+    history_summary_tokens: int = Field(default_factory=lambda: int(os.getenv("HISTORY_SUMMARY_TOKENS", "500")))
+    # lotes dobrados no resumo por turno (chamadas ao LLM); um atraso maior é alcançado nos turnos seguintes
+    history_fold_batches: int = Field(default_factory=lambda: int(os.getenv("HISTORY_FOLD_BATCHES", "2")))
+    # chamadas de map (síntese por trecho) em paralelo por ingestão
+    synth_map_concurrency: int = Field(default_factory=lambda: int(os.getenv("SYNTH_MAP_CONCURRENCY", "6")))
+    # cache em disco das sínteses por trecho (LRU por tamanho)
+    synth_cache_bytes: int = Field(default_factory=lambda: int(os.getenv("SYNTH_CACHE_BYTES", str(256 * 1024 * 1024))))
+    # uploads: total por requisição, bytes por arquivo e chars extraídos por documento (lidos em streaming)
+    upload_max_total_bytes: int = Field(default_factory=lambda: int(os.getenv("UPLOAD_MAX_TOTAL_BYTES", str(20 * 1024 * 1024))))
+    upload_max_file_bytes: int = Field(default_factory=lambda: int(os.getenv("UPLOAD_MAX_FILE_BYTES", str(8 * 1024 * 1024))))
+    upload_max_doc_chars: int = Field(default_factory=lambda: int(os.getenv("UPLOAD_MAX_DOC_CHARS", "120000")))
+    # extração em pool de processos (0 = serial no próprio processo), limites por arquivo e páginas de PDF por tarefa
+    extract_workers: int = Field(default_factory=lambda: int(os.getenv("EXTRACT_WORKERS") or os.cpu_count() or 1))
+    extract_cpu_s: int = Field(default_factory=lambda: int(os.getenv("EXTRACT_CPU_S", "30")))
+    extract_timeout_s: int = Field(default_factory=lambda: int(os.getenv("EXTRACT_TIMEOUT_S", "60")))
+    extract_pdf_pages_per_task: int = Field(default_factory=lambda: int(os.getenv("EXTRACT_PDF_PAGES_PER_TASK", "25")))
+    # cache em disco do texto extraído, por sha256 do arquivo (LRU por tamanho)
+    extract_cache_bytes: int = Field(default_factory=lambda: int(os.getenv("EXTRACT_CACHE_BYTES", str(512 * 1024 * 1024))))
+    # URLs da ingestão: downloads simultâneos, bytes lidos por URL, timeout e cache de revalidação (ETag/Last-Modified)
+    url_fetch_concurrency: int = Field(default_factory=lambda: int(os.getenv("URL_FETCH_CONCURRENCY", "10")))
+    url_max_bytes: int = Field(default_factory=lambda: int(os.getenv("URL_MAX_BYTES", str(1024 * 1024))))
+    url_timeout_s: float = Field(default_factory=lambda: float(os.getenv("URL_TIMEOUT_S", "10")))
+    url_cache_bytes: int = Field(default_factory=lambda: int(os.getenv("URL_CACHE_BYTES", str(64 * 1024 * 1024))))
+    # fila de ingestão em background: workers por processo, jobs simultâneos por tenant, varredura de jobs órfãos
+    ingest_workers: int = Field(default_factory=lambda: int(os.getenv("INGEST_WORKERS", "2")))
+    ingest_tenant_concurrency: int = Field(default_factory=lambda: int(os.getenv("INGEST_TENANT_CONCURRENCY", "1")))
+    job_sweep_s: int = Field(default_factory=lambda: int(os.getenv("JOB_SWEEP_S", "30")))
+    # jobs terminados (done/failed) são apagados depois de N dias; 0 mantém para sempre
+    job_retention_days: int = Field(default_factory=lambda: int(os.getenv("JOB_RETENTION_DAYS", "7")))
+    # histórico de matrizes: versões guardadas como delta da anterior, com um keyframe a cada N versões
+    matrix_keyframe_every: int = Field(default_factory=lambda: int(os.getenv("MATRIX_KEYFRAME_EVERY", "16")))
+    # contexto do chat: "full" (matriz inteira) ou "retrieval" (seções relevantes até o orçamento, opt-in); padrão dos agentes
+    matrix_context_mode: str = Field(default_factory=lambda: os.getenv("MATRIX_CONTEXT_MODE", "full").strip().lower())
+    matrix_context_tokens: int = Field(default_factory=lambda: int(os.getenv("MATRIX_CONTEXT_TOKENS", "2000")))
+    matrix_section_chars: int = Field(default_factory=lambda: int(os.getenv("MATRIX_SECTION_CHARS", "800")))
+    matrix_index_cache_bytes: int = Field(default_factory=lambda: int(os.getenv("MATRIX_INDEX_CACHE_BYTES", str(64 * 1024 * 1024))))
+    # prefixo compilado do prompt do chat (sistema + bloco da matriz) por agente e versão; LRU em memória por processo
+    prompt_prefix_cache_bytes: int = Field(default_factory=lambda: int(os.getenv("PROMPT_PREFIX_CACHE_BYTES", str(32 * 1024 * 1024))))
+    # cache de respostas idênticas (opt-in): mesma entrada normalizada, modelo e versão da matriz, por tenant
+    answer_cache: bool = Field(default_factory=lambda: os.getenv("ANSWER_CACHE", "0").strip().lower() not in ("0", "false", "no"))
+    answer_cache_ttl_s: int = Field(default_factory=lambda: int(os.getenv("ANSWER_CACHE_TTL_S", "3600")))
+    answer_cache_bytes: int = Field(default_factory=lambda: int(os.getenv("ANSWER_CACHE_BYTES", str(64 * 1024 * 1024))))
+    answer_cache_with_history: bool = Field(
+        default_factory=lambda: os.getenv("ANSWER_CACHE_WITH_HISTORY", "0").strip().lower() not in ("0", "false", "no")
+    )
+
+    # Backend de persistência: "json" (arquivos em data/) ou "sqlite"
+    store_backend: str = Field(default_factory=lambda: os.getenv("STORE_BACKEND", "json").strip().lower())
+    sqlite_path: str = Field(default_factory=lambda: os.getenv("SQLITE_PATH", "data/geoobcode.db"))
+
+    # Persistência JSON: "snapshot" (reescreve o arquivo a cada mutação) ou "log" (append-only + compactação)
+    json_store_mode: str = Field(default_factory=lambda: os.getenv("JSON_STORE_MODE", "snapshot").strip().lower())
+    json_store_compact_bytes: int = Field(
+        default_factory=lambda: int(os.getenv("JSON_STORE_COMPACT_BYTES", str(8 * 1024 * 1024)))
+    )
+    # Durabilidade do JSON store: fsync das escritas (agrupadas por group commit)
+    store_fsync: bool = Field(default_factory=lambda: os.getenv("STORE_FSYNC", "1").strip().lower() not in ("0", "false", "no"))
+    store_group_commit_ms: int = Field(default_factory=lambda: int(os.getenv("STORE_GROUP_COMMIT_MS", "0")))
+
+    # Rotas async: pools limitados para I/O do store e para chamadas bloqueantes (LLM, extração)
+    store_io_workers: int = Field(default_factory=lambda: int(os.getenv("STORE_IO_WORKERS", "8")))
+    blocking_workers: int = Field(default_factory=lambda: int(os.getenv("BLOCKING_WORKERS", "16")))
+
+    # Mensagens (JSON store): cauda quente selada em segmentos zlib dentro de pacotes compartilhados
+    msg_segment_messages: int = Field(default_factory=lambda: int(os.getenv("MSG_SEGMENT_MESSAGES", "500")))
+    msg_pack_bytes: int = Field(default_factory=lambda: int(os.getenv("MSG_PACK_BYTES", str(64 * 1024 * 1024))))
+    msg_cold_seconds: int = Field(default_factory=lambda: int(os.getenv("MSG_COLD_SECONDS", "86400")))
+    msg_retention_days: int = Field(default_factory=lambda: int(os.getenv("MSG_RETENTION_DAYS", "0")))
+    msg_compact_interval_s: int = Field(default_factory=lambda: int(os.getenv("MSG_COMPACT_INTERVAL_S", "600")))
 
     cors_origins: list[str] = Field(
         default_factory=lambda: [o.strip() for o in os.getenv("CORS_ORIGINS", "").split(",") if o.strip()]
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import re
 from dataclasses import dataclass
 from fastapi import HTTPException, status
 
@@ -8,21 +9,31 @@ from app.core.config import settings
 
 @dataclass
 class Budgets:
-    max_total_chars: int
+    max_corpus_chars: int
     chunk_chars: int
     max_partials: int
-    max_history_msgs: int
+    reduce_input_tokens: int
+    history_tokens: int
 
 
 def get_budgets() -> Budgets:
     return Budgets(
-        max_total_chars=settings.max_total_chars,
+        max_corpus_chars=settings.max_corpus_chars,
         chunk_chars=settings.chunk_chars,
         max_partials=settings.max_partials,
-        max_history_msgs=settings.max_history_msgs,
+        reduce_input_tokens=settings.reduce_input_tokens,
+        history_tokens=settings.history_tokens,
     )
 
 
+_TOKEN_PIECE = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text: str) -> int:
+    """Aproximação de BPE: ~1 token a cada 4 caracteres de palavra e 1 por sinal de pontuação."""
+    return sum((len(p) + 3) // 4 for p in _TOKEN_PIECE.findall(text))
+
+
 def enforce_max_chars(text: str, limit: int, name: str) -> str:
     if text is None:
         return ""
@@ -33,7 +44,7 @@ def enforce_max_chars(text: str, limit: int, name: str) -> str:
 
 
 def guard_payload_size(total_chars: int) -> None:
-    if total_chars > settings.max_total_chars * 2:
+    if total_chars > settings.max_corpus_chars:
         raise HTTPException(
             status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
             detail="Payload grande demais. Reduza documentos/URLs ou divida em lotes.",
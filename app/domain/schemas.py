@@ -5,6 +5,8 @@ from typing import Literal, Optional, List
 from pydantic import BaseModel, Field
 
 AgentType = Literal["Pessoal", "Corporativo"]
+# full: matriz inteira em cada turno; retrieval: só as seções relevantes, até context_tokens
+ContextMode = Literal["full", "retrieval"]
 
 
 class LoginRequest(BaseModel):
@@ -22,6 +24,15 @@ class AgentCreate(BaseModel):
     name: str
     type: AgentType
     specialty: str
+    # None: padrão do servidor (MATRIX_CONTEXT_MODE / MATRIX_CONTEXT_TOKENS)
+    context_mode: Optional[ContextMode] = None
+    context_tokens: Optional[int] = Field(default=None, ge=100)
+
+
+class AgentUpdate(BaseModel):
+    # só os campos enviados mudam; null volta ao padrão do servidor
+    context_mode: Optional[ContextMode] = None
+    context_tokens: Optional[int] = Field(default=None, ge=100)
 
 
 class AgentOut(BaseModel):
@@ -32,18 +43,84 @@ class AgentOut(BaseModel):
     type: AgentType
     specialty: str
     matrix_version: int = 0
+    context_mode: Optional[ContextMode] = None
+    context_tokens: Optional[int] = None
     created_at: datetime
 
 
+IngestMode = Literal["replace", "delta"]
+
+
 class IngestRequest(BaseModel):
     docs_text: List[str] = Field(default_factory=list)
     urls: List[str] = Field(default_factory=list)
+    # replace: reconstrói a matriz com estas fontes; delta: funde estas fontes na matriz atual
+    mode: IngestMode = "replace"
 
 
 class IngestResponse(BaseModel):
     agent_id: str
     matrix_version: int
     matrix_preview: str
+    mode: IngestMode = "replace"
+    cache_hits: int = 0
+    cache_misses: int = 0
+    chunks: int = 0
+    boilerplate_lines_removed: int = 0
+    duplicate_paragraphs_removed: int = 0
+
+
+class MatrixSource(BaseModel):
+    kind: Literal["text", "file", "url"]
+    name: str
+    sha256: Optional[str] = None
+    chars: Optional[int] = None
+
+
+class MatrixSourcesOut(BaseModel):
+    version: int
+    mode: IngestMode
+    job_id: Optional[str] = None
+    sources: List[MatrixSource]
+    created_at: datetime
+
+
+class MatrixVersionOut(BaseModel):
+    version: int
+    sha256: str
+    chars: int
+    created_at: datetime
+
+
+class MatrixOut(BaseModel):
+    agent_id: str
+    version: int
+    matrix: str
+
+
+class MatrixDiffOut(BaseModel):
+    agent_id: str
+    from_version: int
+    to_version: int
+    diff: str  # unified diff, vazio se as versões são iguais
+
+
+JobStatus = Literal["queued", "running", "done", "failed"]
+
+
+class JobOut(BaseModel):
+    id: str
+    agent_id: str
+    status: JobStatus
+    stage: str  # queued | extracting | fetching | mapping | reducing | saving | done | failed
+    chunks_done: int = 0
+    chunks_total: int = 0
+    matrix_version: Optional[int] = None
+    result: Optional[IngestResponse] = None
+    error: Optional[str] = None
+    warnings: List[str] = Field(default_factory=list)
+    created_at: datetime
+    updated_at: datetime
 
 
 class ChatRequest(BaseModel):
@@ -58,6 +135,40 @@ class ChatResponse(BaseModel):
     answer: str
 
 
+class ConversationOut(BaseModel):
+    id: str
+    tenant_id: str
+    user_id: str
+    agent_id: str
+    created_at: datetime
+
+
+class MessageOut(BaseModel):
+    role: str
+    content: str
+    created_at: datetime
+
+
+class MessagePage(BaseModel):
+    conversation_id: str
+    total: int
+    offset: int
+    messages: List[MessageOut]
+
+
+class CacheStats(BaseModel):
+    hits: int
+    misses: int
+    hit_rate: float
+    bytes: int
+    max_bytes: int
+
+
+class MetricsResponse(BaseModel):
+    # contadores por processo (desde o startup); bytes refletem o disco (prompt_prefix: memória do processo)
+    caches: dict[str, CacheStats]
+
+
 class HealthResponse(BaseModel):
     status: str = "ok"
     time_utc: datetime = Field(default_factory=datetime.utcnow)
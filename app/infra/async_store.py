@@ -0,0 +1,28 @@
+from __future__ import annotations
+
+from typing import Any
+
+from app.core.concurrency import run_io
+
+
+class AsyncStore:
+    """Fachada assíncrona sobre qualquer backend (JsonStore, SqliteStore).
+
+    Cada método público do store vira uma corrotina executada no pool de I/O
+    (STORE_IO_WORKERS): rotas `async def` aguardam o disco sem travar o event
+    loop. O store síncrono continua disponível em `.sync`.
+    """
+
+    def __init__(self, store: Any):
+        self.sync = store
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self.sync, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+
+        async def call(*args: Any, **kwargs: Any) -> Any:
+            return await run_io(attr, *args, **kwargs)
+
+        call.__name__ = name
+        return call
@@ -0,0 +1,314 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+from itertools import islice
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from app.core.config import settings
+from app.infra.file_lock import atomic_write_bytes, file_lock
+from app.infra.group_commit import committer
+
+
+def _load(path: Path, default: Any):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.exists():
+        return json.loads(path.read_text(encoding="utf-8"))
+    return default
+
+
+def _save(path: Path, data: Any):
+    atomic_write_bytes(path, json.dumps(data, ensure_ascii=False, indent=2, default=str).encode("utf-8"))
+
+
+# ---------------------------------------------------------------------------
+# Coleções em memória (por processo)
+#
+# Cada coleção é um snapshot JSON ({"agents": [...]}) mais, no modo "log", um
+# log append-only (<nome>.log.jsonl) com operações put/del. O estado é
+# snapshot + log; cada worker do uvicorn mantém o estado parseado e índices
+# secundários (hash -> bucket), mantidos incrementalmente: um put/del só
+# mexe nos buckets do registro afetado. Só se relê o que mudou:
+#   - snapshot (ou log em compactação) com assinatura nova -> recarga total;
+#   - log que apenas cresceu -> aplica só a cauda a partir do último offset.
+# Registros nunca são mutados no lugar (put substitui o dict), então as
+# referências devolvidas aos chamadores são estáveis.
+# ---------------------------------------------------------------------------
+
+FileSig = Tuple[int, int, int]
+Indexer = Callable[[Dict[str, Any]], Any]
+
+
+def _file_sig(path: Path) -> Optional[FileSig]:
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+class Collection:
+    def __init__(
+        self,
+        key: str,
+        path: Path,
+        unique: Dict[str, Indexer],
+        multi: Dict[str, Indexer],
+        mode: Optional[str] = None,
+    ):
+        self.key = key
+        # None segue JSON_STORE_MODE; coleções internas podem fixar "log"
+        self.mode = mode
+        self.path = path
+        self.log_path = path.with_name(f"{path.stem}.log.jsonl")
+        # log "congelado" durante a compactação; continua valendo até ser dobrado no snapshot
+        self.sealed_path = path.with_name(f"{path.stem}.log.sealed.jsonl")
+        # escritores de todos os processos se serializam por flock neste arquivo
+        self.lock_path = path.with_name(f"{path.stem}.lock")
+        self.compact_lock_path = path.with_name(f"{path.stem}.compact.lock")
+        self._unique_specs = unique
+        self._multi_specs = multi
+
+        self._lock = threading.RLock()
+        self._compacting = False
+        self._loaded = False
+        self._snap_sig: Optional[FileSig] = None
+        self._sealed_sig: Optional[FileSig] = None
+        self._log_ino: Optional[int] = None
+        self._log_offset = 0
+
+        self.records: Dict[str, Dict[str, Any]] = {}
+        self.unique: Dict[str, Dict[Any, Dict[str, Any]]] = {}
+        self.multi: Dict[str, Dict[Any, Dict[str, Dict[str, Any]]]] = {}
+
+    # -- leitura -----------------------------------------------------------
+
+    def log_mode(self) -> bool:
+        return (self.mode or settings.json_store_mode) == "log"
+
+    def _sigs(self) -> Tuple[Optional[FileSig], Optional[FileSig], Optional[int], int]:
+        """(snapshot, log congelado, inode do log, tamanho do log)."""
+        log_sig = _file_sig(self.log_path)
+        return (
+            _file_sig(self.path),
+            _file_sig(self.sealed_path),
+            log_sig[0] if log_sig else None,
+            log_sig[1] if log_sig else 0,
+        )
+
+    def refresh(self) -> "Collection":
+        with self._lock:
+            while True:
+                snap_sig, sealed_sig, log_ino, log_size = self._sigs()
+                if (
+                    not self._loaded
+                    or snap_sig != self._snap_sig
+                    or sealed_sig != self._sealed_sig
+                    or log_ino != self._log_ino
+                    or log_size < self._log_offset
+                ):
+                    self._reload(snap_sig, sealed_sig, log_ino)
+                    # uma compactação no meio da recarga (snapshot velho lido, log
+                    # congelado já removido) deixaria registros de fora: relê
+                    if self._sigs()[:3] != (snap_sig, sealed_sig, log_ino):
+                        continue
+                elif log_size > self._log_offset:
+                    self._log_offset = self._replay(self.log_path, self._log_offset)
+                return self
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded = False
+
+    def get(self, index: str, key: Any) -> Optional[Dict[str, Any]]:
+        return self.unique[index].get(key)
+
+    def bucket(
+        self,
+        index: str,
+        key: Any,
+        offset: int = 0,
+        limit: Optional[int] = None,
+        newest_first: bool = False,
+    ) -> List[Dict[str, Any]]:
+        # buckets preservam ordem de inserção; a janela custa O(offset + limit)
+        values = self.multi[index].get(key, {}).values()
+        it = reversed(values) if newest_first else iter(values)
+        stop = None if limit is None else offset + limit
+        return list(islice(it, offset, stop))
+
+    def _reload(self, snap_sig: Optional[FileSig], sealed_sig: Optional[FileSig], log_ino: Optional[int]):
+        # stat antes de ler; refresh confere as assinaturas de novo depois e
+        # recarrega se algo mudou no meio (nunca serve dado velho ou parcial)
+        self.records = {}
+        self.unique = {name: {} for name in self._unique_specs}
+        self.multi = {name: {} for name in self._multi_specs}
+        for rec in _load(self.path, {self.key: []})[self.key]:
+            self._put(rec)
+        self._replay(self.sealed_path, 0)
+        self._log_offset = self._replay(self.log_path, 0)
+        self._snap_sig = snap_sig
+        self._sealed_sig = sealed_sig
+        self._log_ino = log_ino
+        self._loaded = True
+
+    def _replay(self, path: Path, offset: int) -> int:
+        try:
+            f = path.open("rb")
+        except FileNotFoundError:
+            return offset
+        with f:
+            f.seek(offset)
+            data = f.read()
+        # só consome linhas completas; uma escrita em andamento fica para a próxima leitura
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            if line.strip():
+                try:
+                    self._apply(json.loads(line))
+                except ValueError:
+                    continue  # linha corrompida (crash no meio de um append)
+        return offset + end
+
+    def _apply(self, op: Dict[str, Any]):
+        if op.get("op") == "put":
+            self._put(op["rec"])
+        elif op.get("op") == "del":
+            self._del(op["id"])
+
+    def _put(self, rec: Dict[str, Any]):
+        old = self.records.get(rec["id"])
+        if old is not None:
+            self._unindex(old)
+        self.records[rec["id"]] = rec
+        for name, fn in self._unique_specs.items():
+            self.unique[name][fn(rec)] = rec
+        for name, fn in self._multi_specs.items():
+            self.multi[name].setdefault(fn(rec), {})[rec["id"]] = rec
+
+    def _del(self, rec_id: str):
+        old = self.records.pop(rec_id, None)
+        if old is not None:
+            self._unindex(old)
+
+    def _unindex(self, rec: Dict[str, Any]):
+        for name, fn in self._unique_specs.items():
+            self.unique[name].pop(fn(rec), None)
+        for name, fn in self._multi_specs.items():
+            bucket = self.multi[name].get(fn(rec))
+            if bucket is not None:
+                bucket.pop(rec["id"], None)
+                if not bucket:
+                    del self.multi[name][fn(rec)]
+
+    # -- escrita -----------------------------------------------------------
+
+    def put(self, rec: Dict[str, Any]) -> Dict[str, Any]:
+        self.write([{"op": "put", "rec": rec}])
+        return rec
+
+    def delete(self, rec_ids: Iterable[str]):
+        ops = [{"op": "del", "id": rec_id} for rec_id in rec_ids]
+        if ops:
+            self.write(ops)
+
+    def write(self, ops: List[Dict[str, Any]]):
+        self.mutate(lambda _: (ops, None))
+
+    def mutate(self, fn: Callable[["Collection"], Tuple[List[Dict[str, Any]], Any]]) -> Any:
+        """Read-modify-write atômico entre processos.
+
+        `fn` recebe a coleção já atualizada sob o lock exclusivo do arquivo e
+        devolve (ops, resultado). No modo "log" a escrita passa pelo group
+        commit (um fsync por lote); no modo "snapshot" o arquivo é regravado
+        de forma atômica (temp + rename).
+        """
+        if self.log_mode():
+            return committer.submit(lambda: self._mutate_log(fn))
+        with file_lock(self.lock_path):
+            with self._lock:
+                self.refresh()
+                ops, result = fn(self)
+                if not ops:
+                    return result
+                for op in ops:
+                    self._apply(op)
+                _save(self.path, {self.key: list(self.records.values())})
+                # o snapshot já contém o que houvesse de log (troca de modo log -> snapshot)
+                for p in (self.sealed_path, self.log_path):
+                    try:
+                        p.unlink()
+                    except FileNotFoundError:
+                        pass
+                # sob o lock ninguém mais escreveu: o estado em memória (índices
+                # atualizados incrementalmente) corresponde ao arquivo gravado
+                self._snap_sig = _file_sig(self.path)
+                self._sealed_sig = None
+                self._log_ino = None
+                self._log_offset = 0
+                return result
+
+    def _mutate_log(self, fn: Callable[["Collection"], Tuple[List[Dict[str, Any]], Any]]) -> Tuple[Any, List[Path]]:
+        with file_lock(self.lock_path):
+            with self._lock:
+                self.refresh()
+                ops, result = fn(self)
+            if not ops:
+                return result, []
+            self.log_path.parent.mkdir(parents=True, exist_ok=True)
+            payload = "".join(json.dumps(op, ensure_ascii=False, default=str) + "\n" for op in ops).encode("utf-8")
+            fd = os.open(self.log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, payload)
+                size = os.fstat(fd).st_size
+            finally:
+                os.close(fd)
+        if size >= settings.json_store_compact_bytes:
+            self.compact_async()
+        return result, [self.log_path]
+
+    # -- compactação -------------------------------------------------------
+
+    def compact_async(self):
+        with self._lock:
+            if self._compacting:
+                return
+            self._compacting = True
+        threading.Thread(target=self.compact, name=f"compact-{self.key}", daemon=True).start()
+
+    def _compact(self):
+        """Congela o log atual, dobra snapshot + log congelado em um novo snapshot e descarta o log.
+
+        As operações são idempotentes (put grava o registro inteiro), então
+        um leitor que veja o snapshot novo e ainda o log congelado chega ao
+        mesmo estado.
+        """
+        with file_lock(self.lock_path):
+            if not self.sealed_path.exists():
+                try:
+                    os.replace(self.log_path, self.sealed_path)
+                except FileNotFoundError:
+                    return
+        # o log congelado é imutável: o snapshot novo é montado fora do lock
+        state = Collection(self.key, self.path, {}, {})
+        for rec in _load(self.path, {self.key: []})[self.key]:
+            state._put(rec)
+        state._replay(self.sealed_path, 0)
+        data = json.dumps({self.key: list(state.records.values())}, ensure_ascii=False, default=str)
+        with file_lock(self.lock_path):
+            atomic_write_bytes(self.path, data.encode("utf-8"))
+            try:
+                self.sealed_path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def compact(self):
+        try:
+            with file_lock(self.compact_lock_path, blocking=False) as acquired:
+                if acquired:
+                    self._compact()
+        finally:
+            with self._lock:
+                self._compacting = False
@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+import zlib
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+# ---------------------------------------------------------------------------
+# Cache em disco endereçado por conteúdo
+#
+# Uma entrada por arquivo (<raiz>/<2 hex>/<sha256>.z, zlib), gravada por
+# temp + rename: leitores de qualquer processo nunca veem entrada parcial.
+# LRU pelo mtime: um acerto "toca" o arquivo; quando o total passa de
+# `max_bytes`, as entradas menos recentes são removidas até 90% do limite.
+# O total é mantido por processo e reconciliado com o disco a cada despejo.
+# Acertos/faltas são contados por processo (`stats()`), para monitoramento.
+# ---------------------------------------------------------------------------
+
+
+class DiskCache:
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(*parts: str) -> str:
+        h = hashlib.sha256()
+        for p in parts:
+            h.update(p.encode("utf-8"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.z"
+
+    def get(self, key: str) -> Optional[bytes]:
+        value = self._read(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def _read(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        try:
+            return zlib.decompress(data)
+        except zlib.error:
+            return None  # entrada corrompida: tratada como ausente e sobrescrita no próximo set
+
+    def set(self, key: str, value: bytes) -> None:
+        path = self._path(key)
+        data = zlib.compress(value, 6)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(data)
+        try:
+            replaced = path.stat().st_size  # sobrescrita: a entrada antiga sai do total
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(tmp, path)
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += len(data) - replaced
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def get_text(self, key: str) -> Optional[str]:
+        value = self.get(key)
+        return value.decode("utf-8") if value is not None else None
+
+    def set_text(self, key: str, value: str) -> None:
+        self.set(key, value.encode("utf-8"))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _entries(self):
+        if not self.root.exists():
+            return
+        for sub in os.scandir(self.root):
+            if sub.is_dir():
+                for e in os.scandir(sub.path):
+                    if e.name.endswith(".z"):
+                        try:
+                            yield e.path, e.stat()
+                        except FileNotFoundError:
+                            continue  # removida por outro processo
+
+    def _scan_size(self) -> int:
+        return sum(st.st_size for _, st in self._entries())
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda x: x[1].st_mtime_ns)
+        total = sum(st.st_size for _, st in entries)
+        target = int(self.max_bytes * 0.9)
+        for path, st in entries:
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= st.st_size
+        self._size = total
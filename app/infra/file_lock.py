@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem flock; vale só a exclusão entre threads do mesmo processo
+    fcntl = None
+
+from app.core.config import settings
+
+_thread_locks: Dict[str, threading.Lock] = {}
+_registry_lock = threading.Lock()
+
+
+def _thread_lock(path: Path) -> threading.Lock:
+    key = str(path)
+    with _registry_lock:
+        lock = _thread_locks.get(key)
+        if lock is None:
+            lock = _thread_locks[key] = threading.Lock()
+        return lock
+
+
+@contextmanager
+def file_lock(path: Path, blocking: bool = True) -> Iterator[bool]:
+    """Lock consultivo exclusivo entre processos (flock) sobre `path`.
+
+    Também exclui threads do mesmo processo. Com blocking=False devolve False
+    (sem bloquear) quando outro detentor já tem o lock.
+    """
+    tlock = _thread_lock(path)
+    if not tlock.acquire(blocking):
+        yield False
+        return
+    try:
+        if fcntl is None:
+            yield True
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+    finally:
+        tlock.release()
+
+
+def fsync_path(path: Path) -> None:
+    # fsync vale para o inode, não para o descritor: um fd novo basta
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_write_bytes(path: Path, data: bytes) -> None:
+    """Grava em arquivo temporário no mesmo diretório e troca por rename: leitores nunca veem arquivo truncado."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with tmp.open("wb") as f:
+        f.write(data)
+        if settings.store_fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def drop_lock_file(path: Path) -> None:
+    """Remove o arquivo de um lock que não será mais usado (ex.: job terminado) e seu lock de thread."""
+    with _registry_lock:
+        _thread_locks.pop(str(path), None)
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
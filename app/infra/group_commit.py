@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any, Callable, Iterable, List, Optional, Set, Tuple
+
+from app.core.config import settings
+from app.infra.file_lock import fsync_path
+
+# Uma escrita é uma função que grava (com seus próprios locks) e devolve
+# (resultado, arquivos tocados). O committer executa em lote tudo o que
+# estiver na fila e faz um único fsync por arquivo antes de liberar os
+# chamadores: N appends concorrentes no mesmo log custam um fsync.
+WriteFn = Callable[[], Tuple[Any, Iterable[Path]]]
+
+
+class GroupCommitter:
+    def __init__(self):
+        self._queue: "queue.Queue[Tuple[WriteFn, Future]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._pid = 0
+        self._start_lock = threading.Lock()
+        self._local = threading.local()
+        self.batches = 0
+        self.writes = 0
+
+    def submit(self, fn: WriteFn) -> Any:
+        if not settings.store_fsync:
+            return fn()[0]
+        batch: Optional[Set[Path]] = getattr(self._local, "batch", None)
+        if batch is not None:
+            # escrita aninhada (ex.: selar segmento dentro de um append): entra no lote corrente
+            result, paths = fn()
+            batch.update(paths)
+            return result
+        self._ensure_thread()
+        fut: Future = Future()
+        self._queue.put((fn, fut))
+        return fut.result()
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._queue = queue.Queue()
+                self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        linger = settings.store_group_commit_ms / 1000.0
+        while True:
+            items: List[Tuple[WriteFn, Future]] = [self._queue.get()]
+            if linger > 0:
+                time.sleep(linger)
+            while True:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            touched: Set[Path] = set()
+            self._local.batch = touched
+            done: List[Tuple[Future, Any]] = []
+            try:
+                for fn, fut in items:
+                    try:
+                        result, paths = fn()
+                        touched.update(paths)
+                        done.append((fut, result))
+                    except BaseException as e:
+                        fut.set_exception(e)
+            finally:
+                self._local.batch = None
+
+            try:
+                for path in touched:
+                    fsync_path(path)
+            except OSError as e:
+                for fut, _ in done:
+                    fut.set_exception(e)
+                continue
+            self.batches += 1
+            self.writes += len(done)
+            for fut, result in done:
+                fut.set_result(result)
+
+
+committer = GroupCommitter()
@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import shutil
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from app.infra.collection import Collection
+from app.infra.file_lock import atomic_write_bytes, drop_lock_file
+
+JOBS_DIR = Path("data") / "jobs"
+TERMINAL = {"done", "failed"}
+
+# ---------------------------------------------------------------------------
+# Jobs de ingestão
+#
+# Registros em uma Collection em modo log (data/jobs/jobs.*): cada checkpoint
+# de progresso é um append. A entrada do job (textos, URLs e arquivos
+# enviados) fica em data/jobs/<id>/ até o job terminar. Quem executa um job
+# segura data/jobs/locks/<id>.lock (flock): um worker que morreu libera o
+# lock e o job pode ser retomado por outro processo. O arquivo de lock é
+# removido quando o job termina; registros terminados há mais de
+# JOB_RETENTION_DAYS são apagados pela varredura.
+# ---------------------------------------------------------------------------
+
+
+class JobStore:
+    def __init__(self, jobs_dir: Path = JOBS_DIR):
+        self.dir = jobs_dir
+        self.lock_dir = jobs_dir / "locks"
+        self.jobs = Collection(
+            "jobs",
+            jobs_dir / "jobs.json",
+            unique={"by_id": lambda j: j["id"]},
+            multi={"by_tenant": lambda j: j["tenant_id"]},
+            mode="log",
+        )
+
+    @staticmethod
+    def new_id() -> str:
+        return str(uuid.uuid4())
+
+    def input_dir(self, job_id: str) -> Path:
+        return self.dir / job_id
+
+    def create(
+        self, job_id: str, tenant_id: str, user_id: str, agent_id: str, payload: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        atomic_write_bytes(self.input_dir(job_id) / "input.json", json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+        now = datetime.utcnow().isoformat()
+        job = {
+            "id": job_id,
+            "tenant_id": tenant_id,
+            "user_id": user_id,
+            "agent_id": agent_id,
+            "status": "queued",
+            "stage": "queued",
+            "chunks_done": 0,
+            "chunks_total": 0,
+            "matrix_version": None,
+            "result": None,
+            "error": None,
+            "warnings": [],
+            "created_at": now,
+            "updated_at": now,
+        }
+        return self.jobs.put(job)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self.jobs.refresh().get("by_id", job_id)
+
+    def update(self, job_id: str, **fields: Any) -> Optional[Dict[str, Any]]:
+        def apply(jobs: Collection):
+            current = jobs.get("by_id", job_id)
+            if current is None:
+                return [], None
+            job = {**current, **fields, "updated_at": datetime.utcnow().isoformat()}
+            return [{"op": "put", "rec": job}], job
+
+        return self.jobs.mutate(apply)
+
+    def unfinished(self) -> List[Dict[str, Any]]:
+        return [j for j in self.jobs.refresh().records.values() if j["status"] not in TERMINAL]
+
+    def load_input(self, job_id: str) -> Dict[str, Any]:
+        return json.loads((self.input_dir(job_id) / "input.json").read_text(encoding="utf-8"))
+
+    def drop_input(self, job_id: str) -> None:
+        shutil.rmtree(self.input_dir(job_id), ignore_errors=True)
+
+    def prune(self, retention_days: int) -> int:
+        """Apaga jobs terminados há mais de `retention_days` dias (com entrada e lock, se sobraram)."""
+        if retention_days <= 0:
+            return 0
+        cutoff = (datetime.utcnow() - timedelta(days=retention_days)).isoformat()
+
+        def apply(jobs: Collection):
+            old = [j["id"] for j in jobs.records.values() if j["status"] in TERMINAL and j["updated_at"] < cutoff]
+            return [{"op": "del", "id": job_id} for job_id in old], old
+
+        pruned = self.jobs.mutate(apply)
+        for job_id in pruned:
+            self.drop_input(job_id)
+            drop_lock_file(self.lock_path(job_id))
+        return len(pruned)
+
+    def lock_path(self, job_id: str) -> Path:
+        return self.lock_dir / f"{job_id}.lock"
+
+    def drop_lock(self, job_id: str) -> None:
+        # só com o lock do job em mãos e o job terminado: quem pegar o lock depois relê o status e sai
+        drop_lock_file(self.lock_path(job_id))
+
+    def tenant_slot_paths(self, tenant_id: str, slots: int) -> List[Path]:
+        # N locks por tenant: limite de concorrência válido entre processos
+        h = hashlib.sha1(tenant_id.encode("utf-8")).hexdigest()[:16]
+        return [self.lock_dir / f"tenant-{h}-{k}.lock" for k in range(slots)]
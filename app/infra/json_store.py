@@ -1,72 +1,116 @@
 from __future__ import annotations
 
-import json
 from pathlib import Path
 from typing import Any, Dict, List, Optional
 from datetime import datetime
 import uuid
 
+from app.core.governor import estimate_tokens
 from app.core.security import verify_password, hash_password
+from app.infra.collection import Collection
+from app.infra.matrix_store import FileMatrixBlobs, unified_diff
+from app.infra.message_log import MessageStore, start_compactor
 
 DATA_DIR = Path("data")
-INDEX_DIR = DATA_DIR / "index"
 MSG_DIR = DATA_DIR / "messages"
 
 USERS_PATH = DATA_DIR / "users.json"
 AGENTS_PATH = DATA_DIR / "agents.json"
 CONVS_PATH = DATA_DIR / "conversations.json"
-
-IDX_AGENTS_BY_TENANT = INDEX_DIR / "agents_by_tenant.json"
-IDX_AGENTS_BY_USER = INDEX_DIR / "agents_by_user.json"
-IDX_CONVS_BY_AGENT = INDEX_DIR / "conversations_by_agent.json"
-IDX_CONVS_BY_USER = INDEX_DIR / "conversations_by_user.json"
+SOURCES_PATH = DATA_DIR / "matrix_sources.json"
+VERSIONS_PATH = DATA_DIR / "matrix_versions.json"
+SUMMARIES_PATH = DATA_DIR / "conversation_summaries.json"
+MATRIX_DIR = DATA_DIR / "matrices"
 
 
 def _ensure_dirs():
-    for p in [DATA_DIR, INDEX_DIR, MSG_DIR]:
+    for p in [DATA_DIR, MSG_DIR]:
         p.mkdir(parents=True, exist_ok=True)
 
 
-def _load(path: Path, default: Any):
-    _ensure_dirs()
-    if path.exists():
-        return json.loads(path.read_text(encoding="utf-8"))
-    return default
+_USERS = Collection(
+    "users",
+    USERS_PATH,
+    unique={"by_email": lambda u: (u["tenant_id"], u["email"])},
+    multi={},
+)
+_AGENTS = Collection(
+    "agents",
+    AGENTS_PATH,
+    unique={"by_id": lambda a: (a["tenant_id"], a["id"])},
+    multi={
+        "by_tenant": lambda a: a["tenant_id"],
+        "by_owner": lambda a: (a["tenant_id"], a["owner_user_id"]),
+    },
+)
+_CONVS = Collection(
+    "conversations",
+    CONVS_PATH,
+    unique={"by_id": lambda c: (c["tenant_id"], c["id"])},
+    multi={
+        "by_agent": lambda c: (c["tenant_id"], c["agent_id"]),
+        "by_user": lambda c: (c["tenant_id"], c["user_id"]),
+        "by_agent_user": lambda c: (c["tenant_id"], c["agent_id"], c["user_id"]),
+    },
+)
+# fontes que contribuíram para cada versão da matriz (um registro por versão)
+_SOURCES = Collection(
+    "matrix_sources",
+    SOURCES_PATH,
+    unique={"by_id": lambda r: r["id"]},
+    multi={"by_agent": lambda r: (r["tenant_id"], r["agent_id"])},
+)
+# versão -> blob da matriz; o texto fica fora de agents.json, em MATRIX_DIR
+_VERSIONS = Collection(
+    "matrix_versions",
+    VERSIONS_PATH,
+    unique={"by_version": lambda r: (r["tenant_id"], r["agent_id"], r["version"])},
+    multi={"by_agent": lambda r: (r["tenant_id"], r["agent_id"])},
+)
+# resumo acumulado por conversa: `covered` = quantas mensagens (desde a primeira) já estão no resumo
+_SUMMARIES = Collection(
+    "conversation_summaries",
+    SUMMARIES_PATH,
+    unique={"by_id": lambda r: r["id"]},
+    multi={},
+)
 
+_MESSAGES = MessageStore(MSG_DIR)
+_MATRICES = FileMatrixBlobs(MATRIX_DIR)
 
-def _save(path: Path, data: Any):
-    _ensure_dirs()
-    path.write_text(json.dumps(data, ensure_ascii=False, indent=2, default=str), encoding="utf-8")
 
+class JsonStore:
+    def dump(self) -> Dict[str, List[Dict[str, Any]]]:
+        """Estado completo das coleções (snapshot + log), para migração/backup."""
+        return {c.key: list(c.refresh().records.values()) for c in (_USERS, _AGENTS, _CONVS, _SOURCES, _VERSIONS, _SUMMARIES)}
 
-def _save_index(path: Path, data: Dict[str, List[str]]):
-    _save(path, data)
+    def upsert_user(self, tenant_id: str, email: str, password: str, role: str = "user") -> Dict[str, Any]:
+        password_hash = hash_password(password)  # caro: fora do lock
 
+        def upsert(users: Collection):
+            current = users.get("by_email", (tenant_id, email))
+            if current:
+                user = {
+                    **current,
+                    "password_hash": password_hash,
+                    "role": role,
+                    "updated_at": datetime.utcnow().isoformat(),
+                }
+            else:
+                user = {
+                    "id": str(uuid.uuid4()),
+                    "tenant_id": tenant_id,
+                    "email": email,
+                    "password_hash": password_hash,
+                    "role": role,
+                    "created_at": datetime.utcnow().isoformat(),
+                }
+            return [{"op": "put", "rec": user}], user
 
-class JsonStore:
-    def upsert_user(self, tenant_id: str, email: str, password: str, role: str = "user") -> Dict[str, Any]:
-        users = _load(USERS_PATH, {"users": []})
-        user = next((u for u in users["users"] if u["tenant_id"] == tenant_id and u["email"] == email), None)
-        if user:
-            user["password_hash"] = hash_password(password)
-            user["role"] = role
-            user["updated_at"] = datetime.utcnow().isoformat()
-        else:
-            user = {
-                "id": str(uuid.uuid4()),
-                "tenant_id": tenant_id,
-                "email": email,
-                "password_hash": hash_password(password),
-                "role": role,
-                "created_at": datetime.utcnow().isoformat(),
-            }
-            users["users"].append(user)
-        _save(USERS_PATH, users)
-        return user
+        return _USERS.mutate(upsert)
 
     def authenticate(self, tenant_id: str, email: str, password: str) -> Optional[Dict[str, Any]]:
-        users = _load(USERS_PATH, {"users": []})
-        user = next((u for u in users["users"] if u["tenant_id"] == tenant_id and u["email"] == email), None)
+        user = _USERS.refresh().get("by_email", (tenant_id, email))
         if not user:
             return None
         if not verify_password(password, user["password_hash"]):
@@ -74,13 +118,21 @@ class JsonStore:
         return user
 
     def list_agents(self, tenant_id: str, user_id: str, role: str) -> List[Dict[str, Any]]:
-        agents = _load(AGENTS_PATH, {"agents": []})["agents"]
+        agents = _AGENTS.refresh()
         if role == "admin":
-            return [a for a in agents if a["tenant_id"] == tenant_id]
-        return [a for a in agents if a["tenant_id"] == tenant_id and a["owner_user_id"] == user_id]
+            return agents.bucket("by_tenant", tenant_id)
+        return agents.bucket("by_owner", (tenant_id, user_id))
 
-    def create_agent(self, tenant_id: str, owner_user_id: str, name: str, a_type: str, specialty: str) -> Dict[str, Any]:
-        db = _load(AGENTS_PATH, {"agents": []})
+    def create_agent(
+        self,
+        tenant_id: str,
+        owner_user_id: str,
+        name: str,
+        a_type: str,
+        specialty: str,
+        context_mode: Optional[str] = None,
+        context_tokens: Optional[int] = None,
+    ) -> Dict[str, Any]:
         agent = {
             "id": str(uuid.uuid4()),
             "tenant_id": tenant_id,
@@ -88,42 +140,144 @@ class JsonStore:
             "name": name,
             "type": a_type,
             "specialty": specialty,
-            "matrix": "",
             "matrix_version": 0,
+            "matrix_sha": None,
+            "context_mode": context_mode,
+            "context_tokens": context_tokens,
             "created_at": datetime.utcnow().isoformat(),
         }
-        db["agents"].append(agent)
-        _save(AGENTS_PATH, db)
-        self._reindex_agents()
-        return agent
+        return _AGENTS.put(agent)
 
     def get_agent(self, tenant_id: str, agent_id: str) -> Optional[Dict[str, Any]]:
-        agents = _load(AGENTS_PATH, {"agents": []})["agents"]
-        return next((a for a in agents if a["tenant_id"] == tenant_id and a["id"] == agent_id), None)
+        return _AGENTS.refresh().get("by_id", (tenant_id, agent_id))
 
-    def update_agent_matrix(self, tenant_id: str, agent_id: str, matrix: str) -> Dict[str, Any]:
-        db = _load(AGENTS_PATH, {"agents": []})
-        agent = next((a for a in db["agents"] if a["tenant_id"] == tenant_id and a["id"] == agent_id), None)
-        if not agent:
-            raise KeyError("agent_not_found")
-        agent["matrix"] = matrix
-        agent["matrix_version"] = int(agent.get("matrix_version", 0)) + 1
-        agent["updated_at"] = datetime.utcnow().isoformat()
-        _save(AGENTS_PATH, db)
+    def update_agent_context(
+        self, tenant_id: str, agent_id: str, context_mode: Optional[str], context_tokens: Optional[int]
+    ) -> Optional[Dict[str, Any]]:
+        def update(agents: Collection):
+            current = agents.get("by_id", (tenant_id, agent_id))
+            if not current:
+                return [], None
+            agent = {
+                **current,
+                "context_mode": context_mode,
+                "context_tokens": context_tokens,
+                "updated_at": datetime.utcnow().isoformat(),
+            }
+            return [{"op": "put", "rec": agent}], agent
+
+        return _AGENTS.mutate(update)
+
+    def update_agent_matrix(
+        self,
+        tenant_id: str,
+        agent_id: str,
+        matrix: str,
+        sources: Optional[Dict[str, Any]] = None,
+        expected_version: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """Grava a nova matriz (versão + 1). `sources` (mode, job_id, sources) fica registrado
+        para a nova versão; com `expected_version`, falha se outra ingestão gravou antes."""
+        # blob gravado fora do lock, como delta da matriz atual; se a versão mudar no meio, só a base do delta é outra
+        current = self.get_agent(tenant_id, agent_id)
+        base_sha = (current or {}).get("matrix_sha")
+        if current and not base_sha and current.get("matrix"):
+            base_sha = self._record_version(current, current["matrix"])  # texto legado entra no histórico
+        sha = _MATRICES.put(matrix, base_sha=base_sha)
+
+        def bump(agents: Collection):
+            # lido e gravado sob o mesmo lock: duas ingestões concorrentes não perdem versão
+            current = agents.get("by_id", (tenant_id, agent_id))
+            if not current:
+                raise KeyError("agent_not_found")
+            if expected_version is not None and int(current.get("matrix_version", 0)) != expected_version:
+                raise KeyError("matrix_version_conflict")
+            agent = {
+                **{k: v for k, v in current.items() if k != "matrix"},  # registros antigos traziam o texto
+                "matrix_sha": sha,
+                "matrix_version": int(current.get("matrix_version", 0)) + 1,
+                "updated_at": datetime.utcnow().isoformat(),
+            }
+            return [{"op": "put", "rec": agent}], agent
+
+        agent = _AGENTS.mutate(bump)
+        self._record_version(agent, matrix)
+        if sources is not None:
+            _SOURCES.put(
+                {
+                    "id": str(uuid.uuid4()),
+                    "tenant_id": tenant_id,
+                    "agent_id": agent_id,
+                    "version": agent["matrix_version"],
+                    "mode": sources.get("mode", "replace"),
+                    "job_id": sources.get("job_id"),
+                    "sources": sources.get("sources", []),
+                    "created_at": agent["updated_at"],
+                }
+            )
         return agent
 
-    def _reindex_agents(self):
-        db = _load(AGENTS_PATH, {"agents": []})
-        by_tenant: Dict[str, List[str]] = {}
-        by_user: Dict[str, List[str]] = {}
-        for a in db["agents"]:
-            by_tenant.setdefault(a["tenant_id"], []).append(a["id"])
-            by_user.setdefault(a["owner_user_id"], []).append(a["id"])
-        _save_index(IDX_AGENTS_BY_TENANT, by_tenant)
-        _save_index(IDX_AGENTS_BY_USER, by_user)
+    def _record_version(self, agent: Dict[str, Any], matrix: str) -> str:
+        sha = _MATRICES.put(matrix)  # idempotente: se já gravado, só calcula o sha
+        _VERSIONS.put(
+            {
+                "id": f"{agent['id']}@{agent['matrix_version']}",
+                "tenant_id": agent["tenant_id"],
+                "agent_id": agent["id"],
+                "version": int(agent["matrix_version"]),
+                "sha256": sha,
+                "chars": len(matrix),
+                "created_at": agent.get("updated_at") or agent["created_at"],
+            }
+        )
+        return sha
+
+    def get_agent_matrix(self, tenant_id: str, agent_id: str, version: Optional[int] = None) -> Optional[str]:
+        """Texto da matriz na versão pedida (atual por padrão); None se o agente ou a versão não existem."""
+        agent = self.get_agent(tenant_id, agent_id)
+        if not agent:
+            return None
+        if version is None or version == int(agent.get("matrix_version", 0)):
+            # a versão atual sai do próprio agente (vale mesmo se o índice de versões não foi gravado)
+            if agent.get("matrix_sha"):
+                return _MATRICES.get(agent["matrix_sha"])
+            return agent.get("matrix", "")  # agente de antes do histórico (ou sem ingestão)
+        rec = _VERSIONS.refresh().get("by_version", (tenant_id, agent_id, version))
+        return _MATRICES.get(rec["sha256"]) if rec else None
+
+    def list_matrix_versions(self, tenant_id: str, agent_id: str) -> List[Dict[str, Any]]:
+        recs = _VERSIONS.refresh().bucket("by_agent", (tenant_id, agent_id))
+        return sorted(recs, key=lambda r: r["version"])
+
+    def diff_matrix_versions(self, tenant_id: str, agent_id: str, from_version: int, to_version: int) -> Optional[str]:
+        old = self.get_agent_matrix(tenant_id, agent_id, from_version)
+        new = self.get_agent_matrix(tenant_id, agent_id, to_version)
+        if old is None or new is None:
+            return None
+        return unified_diff(old, new, f"v{from_version}", f"v{to_version}")
+
+    def list_matrix_sources(self, tenant_id: str, agent_id: str) -> List[Dict[str, Any]]:
+        recs = _SOURCES.refresh().bucket("by_agent", (tenant_id, agent_id))
+        return sorted(recs, key=lambda r: r["version"])
+
+    def delete_agent(self, tenant_id: str, agent_id: str) -> bool:
+        def remove(agents: Collection):
+            if not agents.get("by_id", (tenant_id, agent_id)):
+                return [], False
+            return [{"op": "del", "id": agent_id}], True
+
+        if not _AGENTS.mutate(remove):
+            return False
+        _SOURCES.delete(r["id"] for r in _SOURCES.refresh().bucket("by_agent", (tenant_id, agent_id)))
+        _VERSIONS.delete(r["id"] for r in _VERSIONS.refresh().bucket("by_agent", (tenant_id, agent_id)))
+        convs = _CONVS.refresh().bucket("by_agent", (tenant_id, agent_id))
+        _CONVS.delete(c["id"] for c in convs)
+        for c in convs:
+            self._delete_messages(c["id"])
+        self._delete_summaries([c["id"] for c in convs])
+        return True
 
     def create_conversation(self, tenant_id: str, user_id: str, agent_id: str) -> Dict[str, Any]:
-        db = _load(CONVS_PATH, {"conversations": []})
         conv = {
             "id": str(uuid.uuid4()),
             "tenant_id": tenant_id,
@@ -131,32 +285,85 @@ class JsonStore:
             "agent_id": agent_id,
             "created_at": datetime.utcnow().isoformat(),
         }
-        db["conversations"].append(conv)
-        _save(CONVS_PATH, db)
-        self._reindex_conversations()
-        return conv
-
-    def _reindex_conversations(self):
-        db = _load(CONVS_PATH, {"conversations": []})
-        by_agent: Dict[str, List[str]] = {}
-        by_user: Dict[str, List[str]] = {}
-        for c in db["conversations"]:
-            by_agent.setdefault(c["agent_id"], []).append(c["id"])
-            by_user.setdefault(c["user_id"], []).append(c["id"])
-        _save_index(IDX_CONVS_BY_AGENT, by_agent)
-        _save_index(IDX_CONVS_BY_USER, by_user)
+        # no modo "log" isto é um único append, independente do tamanho do store
+        return _CONVS.put(conv)
+
+    def get_conversation(self, tenant_id: str, conversation_id: str) -> Optional[Dict[str, Any]]:
+        return _CONVS.refresh().get("by_id", (tenant_id, conversation_id))
+
+    def list_conversations(
+        self,
+        tenant_id: str,
+        agent_id: Optional[str] = None,
+        user_id: Optional[str] = None,
+        offset: int = 0,
+        limit: int = 50,
+    ) -> List[Dict[str, Any]]:
+        """Conversas mais recentes primeiro, resolvidas direto pelo bucket do índice."""
+        convs = _CONVS.refresh()
+        if agent_id is not None and user_id is not None:
+            return convs.bucket("by_agent_user", (tenant_id, agent_id, user_id), offset, limit, newest_first=True)
+        if agent_id is not None:
+            return convs.bucket("by_agent", (tenant_id, agent_id), offset, limit, newest_first=True)
+        if user_id is not None:
+            return convs.bucket("by_user", (tenant_id, user_id), offset, limit, newest_first=True)
+        return []
+
+    def delete_conversation(self, tenant_id: str, conversation_id: str) -> bool:
+        if not self.get_conversation(tenant_id, conversation_id):
+            return False
+        _CONVS.delete([conversation_id])
+        self._delete_messages(conversation_id)
+        self._delete_summaries([conversation_id])
+        return True
 
     def append_message(self, conversation_id: str, role: str, content: str) -> None:
         _ensure_dirs()
-        path = MSG_DIR / f"conv_{conversation_id}.jsonl"
-        record = {"role": role, "content": content, "created_at": datetime.utcnow().isoformat()}
-        with path.open("a", encoding="utf-8") as f:
-            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        record = {
+            "role": role,
+            "content": content,
+            "tokens": estimate_tokens(content),  # estimativa gravada uma vez: o empacotador do histórico não recalcula
+            "created_at": datetime.utcnow().isoformat(),
+        }
+        _MESSAGES.append(conversation_id, record)
+
+    def _delete_messages(self, conversation_id: str):
+        _MESSAGES.delete(conversation_id)
+
+    def get_conversation_summary(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        return _SUMMARIES.refresh().get("by_id", conversation_id)
+
+    def save_conversation_summary(self, conversation_id: str, summary: str, covered: int, expected_covered: int) -> bool:
+        """Grava o resumo só se ninguém o avançou desde `expected_covered` (False: outro worker já gravou)."""
+
+        def save(summaries: Collection):
+            current = summaries.get("by_id", conversation_id)
+            if (current["covered"] if current else 0) != expected_covered:
+                return [], False
+            rec = {"id": conversation_id, "summary": summary, "covered": covered, "updated_at": datetime.utcnow().isoformat()}
+            return [{"op": "put", "rec": rec}], True
+
+        return _SUMMARIES.mutate(save)
+
+    def _delete_summaries(self, conversation_ids: List[str]):
+        summaries = _SUMMARIES.refresh()
+        _SUMMARIES.delete([cid for cid in conversation_ids if summaries.get("by_id", cid)])
+
+    def count_messages(self, conversation_id: str) -> int:
+        return _MESSAGES.count(conversation_id)
+
+    def load_messages(self, conversation_id: str, offset: int = 0, limit: int = 20) -> List[Dict[str, Any]]:
+        return _MESSAGES.read(conversation_id, offset=offset, limit=limit)
 
     def load_last_messages(self, conversation_id: str, limit: int = 12) -> List[Dict[str, Any]]:
-        path = MSG_DIR / f"conv_{conversation_id}.jsonl"
-        if not path.exists():
-            return []
-        lines = path.read_text(encoding="utf-8").splitlines()
-        tail = lines[-limit:]
-        return [json.loads(x) for x in tail if x.strip()]
+        return self.load_messages(conversation_id, offset=0, limit=limit)
+
+    def conversation_ids_with_messages(self) -> List[str]:
+        return sorted(_MESSAGES.conversation_ids())
+
+    def compact_messages(self) -> Dict[str, int]:
+        return _MESSAGES.compact()
+
+
+def start_message_compactor():
+    start_compactor(_MESSAGES)
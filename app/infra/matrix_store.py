@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import abc
+import difflib
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from app.core.config import settings
+
+# ---------------------------------------------------------------------------
+# Blobs das matrizes, endereçados por conteúdo
+#
+# Cada texto de matriz vira um blob imutável identificado pelo sha256 do
+# texto. Um blob é um keyframe (texto inteiro) ou um delta de linhas contra
+# o blob da versão anterior (trechos copiados da base + linhas novas), ambos
+# em JSON comprimido com zlib. A cadeia de deltas tem no máximo
+# MATRIX_KEYFRAME_EVERY elos: reconstruir qualquer versão custa no máximo
+# esse número de descompressões, e o delta só é usado quando sai menor que
+# o keyframe. Textos decodificados ficam num LRU por processo (blobs nunca
+# mudam, então o cache não precisa de invalidação).
+#
+# O índice versão -> sha fica em cada store (coleção JSON ou tabela SQLite);
+# aqui só se guardam os blobs. Blobs não são apagados junto com o agente:
+# podem ser base de outros deltas.
+# ---------------------------------------------------------------------------
+
+_CACHE_ENTRIES = 32
+
+Op = Union[List[int], str]
+
+
+def matrix_sha(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _delta_ops(base: str, text: str) -> List[Op]:
+    """[i1, i2] copia as linhas i1:i2 da base; str insere o texto literalmente."""
+    a, b = base.splitlines(keepends=True), text.splitlines(keepends=True)
+    ops: List[Op] = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, a, b, autojunk=False).get_opcodes():
+        if tag == "equal":
+            ops.append([i1, i2])
+        elif j2 > j1:
+            ops.append("".join(b[j1:j2]))
+    return ops
+
+
+def _apply_ops(base: str, ops: List[Op]) -> str:
+    lines = base.splitlines(keepends=True)
+    return "".join("".join(lines[op[0] : op[1]]) if isinstance(op, list) else op for op in ops)
+
+
+def unified_diff(old: str, new: str, old_label: str, new_label: str) -> str:
+    return "".join(
+        difflib.unified_diff(
+            old.splitlines(keepends=True), new.splitlines(keepends=True), fromfile=old_label, tofile=new_label
+        )
+    )
+
+
+class MatrixBlobs(abc.ABC):
+    """Base dos backends: subclasses implementam `_load`/`_save` de bytes por sha."""
+
+    def __init__(self):
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @abc.abstractmethod
+    def _load(self, sha: str) -> Optional[bytes]:
+        """Bytes gravados para `sha`, ou None se o blob não existe."""
+
+    @abc.abstractmethod
+    def _save(self, sha: str, data: bytes) -> None:
+        """Grava os bytes do blob `sha` (idempotente: o conteúdo de um sha nunca muda)."""
+
+    def _record(self, sha: str) -> Dict[str, Any]:
+        data = self._load(sha)
+        if data is None:
+            raise KeyError(f"matrix_blob_not_found:{sha}")
+        return json.loads(zlib.decompress(data))
+
+    def put(self, text: str, base_sha: Optional[str] = None) -> str:
+        """Grava o texto (delta contra `base_sha` quando compensa) e devolve o sha."""
+        sha = matrix_sha(text)
+        if self._load(sha) is not None:
+            return sha  # mesmo conteúdo já gravado (ex.: reingestão idêntica)
+
+        data = zlib.compress(json.dumps({"depth": 0, "text": text}, ensure_ascii=False).encode("utf-8"), 6)
+        if base_sha:
+            try:
+                depth = int(self._record(base_sha)["depth"]) + 1
+                base = self.get(base_sha)
+            except KeyError:
+                depth = 0
+            if 0 < depth < max(1, settings.matrix_keyframe_every):
+                delta = {"depth": depth, "base": base_sha, "ops": _delta_ops(base, text)}
+                packed = zlib.compress(json.dumps(delta, ensure_ascii=False).encode("utf-8"), 6)
+                if len(packed) < len(data):
+                    data = packed
+        self._save(sha, data)
+        self._remember(sha, text)
+        return sha
+
+    def get(self, sha: str) -> str:
+        with self._lock:
+            text = self._cache.get(sha)
+            if text is not None:
+                self._cache.move_to_end(sha)
+                return text
+
+        # desce a cadeia até o keyframe e reaplica os deltas na volta
+        chain: List[Dict[str, Any]] = []
+        cur = sha
+        while True:
+            rec = self._record(cur)
+            if "text" in rec:
+                text = rec["text"]
+                break
+            chain.append(rec)
+            cur = rec["base"]
+        for rec in reversed(chain):
+            text = _apply_ops(text, rec["ops"])
+        self._remember(sha, text)
+        return text
+
+    def _remember(self, sha: str, text: str):
+        with self._lock:
+            self._cache[sha] = text
+            self._cache.move_to_end(sha)
+            while len(self._cache) > _CACHE_ENTRIES:
+                self._cache.popitem(last=False)
+
+
+class FileMatrixBlobs(MatrixBlobs):
+    """<raiz>/<2 hex>/<sha>.z, gravado por temp + rename (como o DiskCache, mas sem despejo)."""
+
+    def __init__(self, root: Path):
+        super().__init__()
+        self.root = root
+
+    def _path(self, sha: str) -> Path:
+        return self.root / sha[:2] / f"{sha}.z"
+
+    def _load(self, sha: str) -> Optional[bytes]:
+        try:
+            return self._path(sha).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def _save(self, sha: str, data: bytes) -> None:
+        path = self._path(sha)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+            if settings.store_fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+
+class SqliteMatrixBlobs(MatrixBlobs):
+    """Tabela matrix_blobs (sha256, data) do próprio banco do SqliteStore."""
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection]):
+        super().__init__()
+        self._connect = connect
+
+    def _load(self, sha: str) -> Optional[bytes]:
+        row = self._connect().execute("SELECT data FROM matrix_blobs WHERE sha256 = ?", (sha,)).fetchone()
+        return bytes(row[0]) if row is not None else None
+
+    def _save(self, sha: str, data: bytes) -> None:
+        with self._connect() as c:
+            c.execute("INSERT OR IGNORE INTO matrix_blobs (sha256, data) VALUES (?, ?)", (sha, data))
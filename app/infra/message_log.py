@@ -0,0 +1,513 @@
+from __future__ import annotations
+
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from app.core.config import settings
+from app.infra.collection import Collection
+from app.infra.file_lock import file_lock, fsync_path
+from app.infra.group_commit import committer
+
+# Sidecar de offsets: um uint64 little-endian por mensagem, com a posição do
+# início da linha correspondente no .jsonl. Ler as últimas N mensagens custa
+# dois seeks + N linhas, independente do tamanho da conversa.
+_OFF = struct.Struct("<Q")
+_REVERSE_BLOCK = 64 * 1024
+
+
+class MessageLog:
+    def __init__(self, msg_dir: Path, conversation_id: str):
+        self.path = msg_dir / f"conv_{conversation_id}.jsonl"
+        self.idx_path = msg_dir / f"conv_{conversation_id}.idx"
+
+    # -- escrita -----------------------------------------------------------
+
+    def append(self, record: Dict[str, Any]) -> None:
+        self.append_many([record])
+
+    def append_many(self, records: Iterable[Dict[str, Any]]) -> None:
+        lines = [(json.dumps(r, ensure_ascii=False) + "\n").encode("utf-8") for r in records]
+        if not lines:
+            return
+        self._ensure_index()
+        with self.path.open("ab") as f:
+            pos = f.seek(0, os.SEEK_END)
+            offsets = []
+            for line in lines:
+                offsets.append(_OFF.pack(pos))
+                pos += len(line)
+            f.write(b"".join(lines))
+        with self.idx_path.open("ab") as f:
+            f.write(b"".join(offsets))
+
+    def _ensure_index(self):
+        """Cria/repara o sidecar: arquivos legados (sem .idx) ou linhas gravadas sem offset (crash)."""
+        size = self.path.stat().st_size if self.path.exists() else 0
+        if size == 0:
+            if self.idx_path.exists():
+                self.idx_path.unlink()
+            return
+        count = self._indexed_count()
+        start = self._offset_at(count - 1) if count else 0
+        missing = [start + rel for rel in self._line_starts(start, size)][1 if count else 0:]
+        if missing:
+            with self.idx_path.open("ab") as f:
+                f.write(b"".join(_OFF.pack(o) for o in missing))
+
+    def _line_starts(self, start: int, end: int) -> List[int]:
+        # inícios de linhas completas em [start, end), relativos a start
+        with self.path.open("rb") as f:
+            f.seek(start)
+            data = f.read(end - start)
+        starts = [0]
+        pos = data.find(b"\n")
+        while pos != -1 and pos + 1 < len(data):
+            starts.append(pos + 1)
+            pos = data.find(b"\n", pos + 1)
+        if not data.endswith(b"\n"):
+            starts.pop()  # última linha incompleta
+        return starts
+
+    def raw_lines(self) -> Tuple[bytes, int]:
+        """Todas as linhas completas (bytes) e a quantidade, para selar a cauda num segmento."""
+        try:
+            data = self.path.read_bytes()
+        except FileNotFoundError:
+            return b"", 0
+        data = data[: data.rfind(b"\n") + 1]
+        return data, sum(1 for x in data.split(b"\n") if x.strip())
+
+    def delete(self) -> None:
+        for p in (self.path, self.idx_path):
+            try:
+                p.unlink()
+            except FileNotFoundError:
+                pass
+
+    # -- leitura -----------------------------------------------------------
+
+    def _indexed_count(self) -> int:
+        try:
+            return self.idx_path.stat().st_size // _OFF.size
+        except FileNotFoundError:
+            return 0
+
+    def _offset_at(self, i: int) -> int:
+        with self.idx_path.open("rb") as f:
+            f.seek(i * _OFF.size)
+            return _OFF.unpack(f.read(_OFF.size))[0]
+
+    def count(self) -> int:
+        if not self.path.exists():
+            return 0
+        count = self._indexed_count()
+        if not count:
+            return len(self._reverse_lines(None))
+        # linhas gravadas após o último offset conhecido (append interrompido)
+        return count + len(self._line_starts(self._offset_at(count - 1), self.path.stat().st_size)) - 1
+
+    def read(self, offset: int = 0, limit: int = 20) -> List[Dict[str, Any]]:
+        """Janela de `limit` mensagens terminando `offset` mensagens antes da mais recente (ordem cronológica)."""
+        if limit <= 0 or not self.path.exists():
+            return []
+        indexed = self._indexed_count()
+        if not indexed:
+            lines = self._reverse_lines(offset + limit)
+            lines = lines[: max(0, len(lines) - offset)]
+            return [json.loads(x) for x in lines[-limit:]]
+
+        total = self.count()
+        end = max(0, total - offset)
+        start = max(0, end - limit)
+        if start >= end:
+            return []
+
+        if start < indexed:
+            begin, skip = self._offset_at(start), 0
+        else:
+            # janela só com linhas sem offset: parte da última linha indexada
+            begin, skip = self._offset_at(indexed - 1), 1 + start - indexed
+        stop = self._offset_at(end) if end < indexed else None
+        with self.path.open("rb") as f:
+            f.seek(begin)
+            data = f.read(stop - begin) if stop is not None else f.read()
+        lines = [x for x in data.split(b"\n") if x.strip()][skip:]
+        return [json.loads(x) for x in lines[: end - start]]
+
+    def _reverse_lines(self, want: int | None) -> List[bytes]:
+        # legado sem sidecar: lê blocos de trás para frente até ter `want` linhas
+        with self.path.open("rb") as f:
+            pos = f.seek(0, os.SEEK_END)
+            buf = b""
+            if pos:
+                # descarta uma última linha incompleta (append em andamento)
+                f.seek(pos - 1)
+                if f.read(1) != b"\n":
+                    f.seek(0)
+                    pos = f.read().rfind(b"\n") + 1
+            while pos > 0:
+                step = min(_REVERSE_BLOCK, pos)
+                pos -= step
+                f.seek(pos)
+                buf = f.read(step) + buf
+                if want is not None and buf.count(b"\n") > want:
+                    break
+        lines = [x for x in buf.split(b"\n") if x.strip()]
+        if pos > 0:
+            lines = lines[1:]  # primeira linha do buffer pode estar cortada
+        return lines if want is None else lines[-want:]
+
+
+# ---------------------------------------------------------------------------
+# Arquivo segmentado
+#
+# A cauda quente de cada conversa (conv_<id>.jsonl + .idx) é selada quando
+# atinge MSG_SEGMENT_MESSAGES mensagens, ou quando fica ociosa por
+# MSG_COLD_SECONDS: as linhas viram um frame zlib anexado a um pacote
+# compartilhado (packs/pack-<ns>-<pid>.zpk, um por processo, rotacionado em
+# MSG_PACK_BYTES) e os arquivos quentes são removidos. O catálogo
+# (packs/catalog.*) é uma Collection em modo log com um registro por frame,
+# indexado por sequência ("<conv>:<seq>"), e um marcador "<conv>:end" com o
+# total já selado. Conversas frias passam a ocupar zero inodes próprios.
+# ---------------------------------------------------------------------------
+
+_PACK_IDLE_SECONDS = 3600
+
+
+class _Packs:
+    def __init__(self, pack_dir: Path):
+        self.dir = pack_dir
+        self._lock = threading.Lock()
+        self._current: Optional[str] = None
+        self._pid = 0
+
+    @property
+    def current(self) -> Optional[str]:
+        return self._current
+
+    def write(self, blob: bytes) -> Tuple[str, int]:
+        with self._lock:
+            path = self.dir / self._current if self._current else None
+            if (
+                path is None
+                or self._pid != os.getpid()
+                or not path.exists()
+                or path.stat().st_size >= settings.msg_pack_bytes
+            ):
+                # pacotes não são compartilhados entre processos: não há corrida de offset
+                self._pid = os.getpid()
+                self._current = f"pack-{time.time_ns()}-{self._pid}.zpk"
+                path = self.dir / self._current
+            self.dir.mkdir(parents=True, exist_ok=True)
+            with path.open("ab") as f:
+                off = f.seek(0, os.SEEK_END)
+                f.write(blob)
+                if settings.store_fsync:
+                    # o frame precisa estar no disco antes de o catálogo apontar para ele
+                    f.flush()
+                    os.fsync(f.fileno())
+            return self._current, off
+
+    def read(self, name: str, off: int, length: int) -> bytes:
+        with (self.dir / name).open("rb") as f:
+            f.seek(off)
+            return f.read(length)
+
+
+class MessageStore:
+    def __init__(self, msg_dir: Path):
+        self.dir = msg_dir
+        self.pack_dir = msg_dir / "packs"
+        self.catalog = Collection(
+            "segments",
+            self.pack_dir / "catalog.json",
+            unique={},
+            multi={"by_conv": lambda r: r["c"]},
+            mode="log",
+        )
+        self.packs = _Packs(self.pack_dir)
+        self.lock_dir = msg_dir / "locks"
+
+    @contextmanager
+    def _lock(self, conversation_id: str) -> Iterator[bool]:
+        # 256 listras por flock, estáveis entre processos (hash() muda a cada processo)
+        stripe = zlib.crc32(conversation_id.encode("utf-8")) % 256
+        with file_lock(self.lock_dir / f"{stripe}.lock") as acquired:
+            yield acquired
+
+    # -- catálogo ----------------------------------------------------------
+
+    def _segments(self, conversation_id: str) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        frames: List[Dict[str, Any]] = []
+        end: Optional[Dict[str, Any]] = None
+        for r in self.catalog.refresh().bucket("by_conv", conversation_id):
+            if "end" in r:
+                end = r
+            else:
+                frames.append(r)
+        frames.sort(key=lambda r: r["s"])
+        return frames, end
+
+    @staticmethod
+    def _stale(hot: MessageLog, end: Optional[Dict[str, Any]]) -> bool:
+        """Cauda já selada, mas o processo caiu antes de removê-la."""
+        if not (end and end.get("h")):
+            return False
+        try:
+            st = hot.path.stat()
+        except FileNotFoundError:
+            return False
+        # inode pode ser reaproveitado por uma cauda nova: confirma pelo conteúdo
+        return [st.st_ino, st.st_size] == end["h"][:2] and zlib.crc32(hot.raw_lines()[0]) == end["h"][2]
+
+    def _hot(self, conversation_id: str, end: Optional[Dict[str, Any]]) -> MessageLog:
+        """Cauda para escrita: só com o lock da listra, que permite remover a cauda órfã."""
+        hot = MessageLog(self.dir, conversation_id)
+        if self._stale(hot, end):
+            hot.delete()
+        return hot
+
+    def _hot_count(self, conversation_id: str, end: Optional[Dict[str, Any]]) -> Tuple[MessageLog, int]:
+        """Cauda para leitura (sem lock e sem efeitos colaterais): órfã conta como vazia."""
+        hot = MessageLog(self.dir, conversation_id)
+        return hot, 0 if self._stale(hot, end) else hot.count()
+
+    # -- escrita -----------------------------------------------------------
+
+    # Toda mutação é uma função submetida ao group commit; os locks são
+    # tomados dentro dela (quem segura um lock nunca espera pelo committer).
+
+    def append(self, conversation_id: str, record: Dict[str, Any]) -> None:
+        committer.submit(lambda: self._append(conversation_id, record))
+
+    def _append(self, conversation_id: str, record: Dict[str, Any]):
+        with self._lock(conversation_id):
+            _, end = self._segments(conversation_id)
+            hot = self._hot(conversation_id, end)
+            hot.append(record)
+            if hot.count() >= settings.msg_segment_messages:
+                self._seal(conversation_id, hot, end)
+        return None, [hot.path, hot.idx_path]
+
+    def _seal(self, conversation_id: str, hot: MessageLog, end: Optional[Dict[str, Any]]) -> None:
+        try:
+            st = hot.path.stat()
+        except FileNotFoundError:
+            return
+        raw, n = hot.raw_lines()
+        if not n:
+            return
+        base = int(end["end"]) if end else 0
+        last = json.loads(raw.rstrip(b"\n").rsplit(b"\n", 1)[-1])
+        blob = zlib.compress(raw, 6)
+        pack, off = self.packs.write(blob)
+        self.catalog.write(
+            [
+                {"op": "put", "rec": self._frame(conversation_id, base, n, pack, off, len(blob), last)},
+                {"op": "put", "rec": {
+                    "id": f"{conversation_id}:end", "c": conversation_id, "end": base + n,
+                    "h": [st.st_ino, st.st_size, zlib.crc32(raw)],
+                }},
+            ]
+        )
+        if settings.store_fsync:
+            # a cauda só some depois que o catálogo que a substitui está no disco
+            fsync_path(self.catalog.log_path)
+        hot.delete()
+
+    @staticmethod
+    def _frame(conversation_id: str, s: int, n: int, pack: str, off: int, length: int, last: Dict[str, Any]):
+        return {
+            "id": f"{conversation_id}:{s}", "c": conversation_id, "s": s, "n": n,
+            "p": pack, "o": off, "l": length, "t": last.get("created_at", ""),
+        }
+
+    def delete(self, conversation_id: str) -> None:
+        committer.submit(lambda: self._delete(conversation_id))
+
+    def _delete(self, conversation_id: str):
+        with self._lock(conversation_id):
+            frames, end = self._segments(conversation_id)
+            self.catalog.delete([r["id"] for r in frames] + ([end["id"]] if end else []))
+            MessageLog(self.dir, conversation_id).delete()
+        return None, []
+
+    # -- leitura -----------------------------------------------------------
+
+    # A numeração das mensagens é estável: mensagens removidas pela retenção
+    # continuam contadas em count() (o resumo do histórico guarda quantas já
+    # cobriu), e read() sobre um trecho expirado devolve só as que restam.
+
+    def count(self, conversation_id: str) -> int:
+        _, end = self._segments(conversation_id)
+        return (int(end["end"]) if end else 0) + self._hot_count(conversation_id, end)[1]
+
+    def read(self, conversation_id: str, offset: int = 0, limit: int = 20) -> List[Dict[str, Any]]:
+        frames, end = self._segments(conversation_id)
+        hot, hot_n = self._hot_count(conversation_id, end)
+        base = int(end["end"]) if end else 0
+        if not frames and not base:
+            return hot.read(offset=offset, limit=limit)
+
+        total = base + hot_n
+        stop = max(0, total - offset)
+        start = max(0, stop - limit)
+        out: List[Dict[str, Any]] = []
+        if start < base:
+            for fr in frames:
+                lo, hi = fr["s"], fr["s"] + fr["n"]
+                if hi <= start or lo >= min(stop, base):
+                    continue
+                lines = [x for x in self._frame_bytes(fr).split(b"\n") if x.strip()]
+                out.extend(json.loads(x) for x in lines[max(start, lo) - lo: min(stop, hi) - lo])
+        if stop > base and hot_n:
+            out.extend(hot.read(offset=total - stop, limit=stop - max(start, base)))
+        return out
+
+    def _frame_bytes(self, fr: Dict[str, Any]) -> bytes:
+        try:
+            blob = self.packs.read(fr["p"], fr["o"], fr["l"])
+        except FileNotFoundError:
+            # frame realocado pela compactação depois que o catálogo foi lido
+            fresh = self.catalog.refresh().records.get(fr["id"])
+            if not fresh:
+                return b""
+            blob = self.packs.read(fresh["p"], fresh["o"], fresh["l"])
+        return zlib.decompress(blob)
+
+    def conversation_ids(self) -> Set[str]:
+        ids = set(self.catalog.refresh().multi["by_conv"].keys())
+        if self.dir.exists():
+            ids.update(p.stem[len("conv_"):] for p in self.dir.glob("conv_*.jsonl"))
+        return ids
+
+    # -- compactação -------------------------------------------------------
+
+    def compact(self) -> Dict[str, int]:
+        """Sela caudas ociosas, funde frames pequenos, aplica retenção e recicla pacotes."""
+        stats = {"sealed": 0, "merged": 0, "expired": 0, "packs_rewritten": 0, "packs_removed": 0}
+        with file_lock(self.lock_dir / "compact.lock", blocking=False) as acquired:
+            if not acquired:
+                return stats  # outro processo/thread já está compactando
+            self._seal_cold(stats)
+            self._merge_small(stats)
+            self._expire(stats)
+            self._recycle_packs(stats)
+        return stats
+
+    def _seal_cold(self, stats: Dict[str, int]):
+        if not self.dir.exists():
+            return
+        cutoff = time.time() - settings.msg_cold_seconds
+        with os.scandir(self.dir) as it:
+            names = [e.name for e in it if e.name.startswith("conv_") and e.name.endswith(".jsonl")
+                     and e.stat().st_mtime < cutoff]
+        for name in names:
+            conversation_id = name[len("conv_"):-len(".jsonl")]
+            if committer.submit(lambda: (self._seal_one(conversation_id), [])):
+                stats["sealed"] += 1
+
+    def _seal_one(self, conversation_id: str) -> bool:
+        with self._lock(conversation_id):
+            _, end = self._segments(conversation_id)
+            hot = self._hot(conversation_id, end)
+            if not hot.path.exists():
+                return False
+            self._seal(conversation_id, hot, end)
+            return True
+
+    def _merge_small(self, stats: Dict[str, int]):
+        target = settings.msg_segment_messages
+        for conversation_id in list(self.catalog.refresh().multi["by_conv"].keys()):
+            stats["merged"] += committer.submit(lambda: (self._merge_conversation(conversation_id, target), []))
+
+    def _merge_conversation(self, conversation_id: str, target: int) -> int:
+        merged = 0
+        with self._lock(conversation_id):
+            frames, _ = self._segments(conversation_id)
+            group: List[Dict[str, Any]] = []
+            for fr in frames + [None]:
+                contiguous = fr is not None and group and group[-1]["s"] + group[-1]["n"] == fr["s"]
+                if fr is not None and (not group or contiguous) and sum(g["n"] for g in group) + fr["n"] <= target:
+                    group.append(fr)
+                    continue
+                if len(group) > 1:
+                    self._merge(conversation_id, group)
+                    merged += len(group)
+                group = [fr] if fr is not None else []
+        return merged
+
+    def _merge(self, conversation_id: str, group: List[Dict[str, Any]]):
+        raw = b"".join(self._frame_bytes(fr) for fr in group)
+        blob = zlib.compress(raw, 6)
+        pack, off = self.packs.write(blob)
+        n = sum(fr["n"] for fr in group)
+        merged = self._frame(conversation_id, group[0]["s"], n, pack, off, len(blob), {"created_at": group[-1]["t"]})
+        self.catalog.write(
+            [{"op": "del", "id": fr["id"]} for fr in group[1:]] + [{"op": "put", "rec": merged}]
+        )
+
+    def _expire(self, stats: Dict[str, int]):
+        if settings.msg_retention_days <= 0:
+            return
+        cutoff = (datetime.utcnow() - timedelta(days=settings.msg_retention_days)).isoformat()
+        # o marcador "end" permanece: a numeração das mensagens seguintes não muda (ver count/read)
+        expired = [r["id"] for r in self.catalog.refresh().records.values() if "end" not in r and r["t"] < cutoff]
+        self.catalog.delete(expired)
+        stats["expired"] += len(expired)
+
+    def _recycle_packs(self, stats: Dict[str, int]):
+        if not self.pack_dir.exists():
+            return
+        live: Dict[str, List[Dict[str, Any]]] = {}
+        for r in self.catalog.refresh().records.values():
+            if "p" in r:
+                live.setdefault(r["p"], []).append(r)
+        idle = time.time() - _PACK_IDLE_SECONDS
+        for path in self.pack_dir.glob("pack-*.zpk"):
+            st = path.stat()
+            if path.name == self.packs.current or st.st_mtime > idle:
+                continue  # pacote possivelmente ainda em escrita (deste ou de outro processo)
+            frames = live.get(path.name, [])
+            if not frames:
+                path.unlink()
+                stats["packs_removed"] += 1
+            elif sum(fr["l"] for fr in frames) < st.st_size // 2:
+                # realoca os frames vivos; o pacote antigo é removido na próxima passada
+                for fr in frames:
+                    committer.submit(lambda: (self._relocate(fr, path.name), []))
+                stats["packs_rewritten"] += 1
+
+    def _relocate(self, fr: Dict[str, Any], pack_name: str) -> None:
+        with self._lock(fr["c"]):
+            current = self.catalog.refresh().records.get(fr["id"])
+            if current is None or current["p"] != pack_name:
+                return  # removido/fundido enquanto isso
+            pack, off = self.packs.write(self.packs.read(current["p"], current["o"], current["l"]))
+            self.catalog.put({**current, "p": pack, "o": off})
+
+
+def start_compactor(store: MessageStore) -> Optional[threading.Thread]:
+    interval = settings.msg_compact_interval_s
+    if interval <= 0:
+        return None
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                store.compact()
+            except Exception:
+                continue  # compactação é oportunista; tenta de novo no próximo ciclo
+
+    t = threading.Thread(target=loop, name="messages-compactor", daemon=True)
+    t.start()
+    return t
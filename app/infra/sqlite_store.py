@@ -0,0 +1,521 @@
+from __future__ import annotations
+
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import uuid
+
+from app.core.governor import estimate_tokens
+from app.core.security import verify_password, hash_password
+from app.infra.matrix_store import SqliteMatrixBlobs, unified_diff
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    tenant_id TEXT NOT NULL,
+    email TEXT NOT NULL,
+    password_hash TEXT NOT NULL,
+    role TEXT NOT NULL DEFAULT 'user',
+    created_at TEXT NOT NULL,
+    updated_at TEXT,
+    UNIQUE (tenant_id, email)
+);
+
+CREATE TABLE IF NOT EXISTS agents (
+    id TEXT PRIMARY KEY,
+    tenant_id TEXT NOT NULL,
+    owner_user_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    type TEXT NOT NULL,
+    specialty TEXT NOT NULL,
+    matrix TEXT NOT NULL DEFAULT '',  -- legado: o texto agora fica em matrix_blobs
+    matrix_version INTEGER NOT NULL DEFAULT 0,
+    matrix_sha TEXT,
+    context_mode TEXT,
+    context_tokens INTEGER,
+    created_at TEXT NOT NULL,
+    updated_at TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_agents_tenant ON agents (tenant_id, created_at);
+CREATE INDEX IF NOT EXISTS ix_agents_owner ON agents (tenant_id, owner_user_id, created_at);
+
+CREATE TABLE IF NOT EXISTS matrix_sources (
+    id TEXT PRIMARY KEY,
+    tenant_id TEXT NOT NULL,
+    agent_id TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    mode TEXT NOT NULL,
+    job_id TEXT,
+    sources TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_matrix_sources_agent ON matrix_sources (tenant_id, agent_id, version);
+
+CREATE TABLE IF NOT EXISTS matrix_versions (
+    tenant_id TEXT NOT NULL,
+    agent_id TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    chars INTEGER NOT NULL,
+    created_at TEXT NOT NULL,
+    PRIMARY KEY (tenant_id, agent_id, version)
+);
+
+CREATE TABLE IF NOT EXISTS matrix_blobs (
+    sha256 TEXT PRIMARY KEY,
+    data BLOB NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS conversations (
+    id TEXT PRIMARY KEY,
+    tenant_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    agent_id TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_conversations_agent ON conversations (tenant_id, agent_id, created_at);
+CREATE INDEX IF NOT EXISTS ix_conversations_user ON conversations (tenant_id, user_id, created_at);
+CREATE INDEX IF NOT EXISTS ix_conversations_agent_user ON conversations (tenant_id, agent_id, user_id, created_at);
+
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    conversation_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    tokens INTEGER,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_messages_conversation ON messages (conversation_id, id);
+
+CREATE TABLE IF NOT EXISTS conversation_summaries (
+    conversation_id TEXT PRIMARY KEY,
+    summary TEXT NOT NULL,
+    covered INTEGER NOT NULL,
+    updated_at TEXT NOT NULL
+);
+"""
+
+AGENT_COLS = (
+    "id, tenant_id, owner_user_id, name, type, specialty, matrix_version, matrix_sha, context_mode, context_tokens, "
+    "created_at, updated_at"
+)
+
+# Pool por thread: cada thread do threadpool do FastAPI reaproveita a sua conexão
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready: set[str] = set()
+# blobs das matrizes por banco (o LRU de textos decodificados vale para todas as requisições)
+_blobs: Dict[str, SqliteMatrixBlobs] = {}
+
+
+def _connect(db_path: str) -> sqlite3.Connection:
+    conns: Dict[str, sqlite3.Connection] = getattr(_local, "conns", None) or {}
+    _local.conns = conns
+    conn = conns.get(db_path)
+    if conn is not None:
+        return conn
+
+    Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    with _schema_lock:
+        if db_path not in _schema_ready:
+            conn.executescript(SCHEMA)
+            _migrate(conn)
+            _schema_ready.add(db_path)
+    conns[db_path] = conn
+    return conn
+
+
+def _migrate(conn: sqlite3.Connection):
+    # bancos criados antes do histórico de matrizes / do contexto por agente / da contagem de tokens
+    for table, name, decl in (
+        ("agents", "matrix_sha", "TEXT"),
+        ("agents", "context_mode", "TEXT"),
+        ("agents", "context_tokens", "INTEGER"),
+        ("messages", "tokens", "INTEGER"),
+    ):
+        if name not in {r["name"] for r in conn.execute(f"PRAGMA table_info({table})")}:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {decl}")
+    conn.commit()
+
+
+def _row(row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+    return dict(row) if row is not None else None
+
+
+class SqliteStore:
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        return _connect(self.db_path)
+
+    @property
+    def matrices(self) -> SqliteMatrixBlobs:
+        blobs = _blobs.get(self.db_path)
+        if blobs is None:
+            db_path = self.db_path
+            blobs = _blobs.setdefault(db_path, SqliteMatrixBlobs(lambda: _connect(db_path)))
+        return blobs
+
+    def upsert_user(self, tenant_id: str, email: str, password: str, role: str = "user") -> Dict[str, Any]:
+        now = datetime.utcnow().isoformat()
+        with self.conn as c:
+            c.execute(
+                """
+                INSERT INTO users (id, tenant_id, email, password_hash, role, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (tenant_id, email) DO UPDATE SET
+                    password_hash = excluded.password_hash,
+                    role = excluded.role,
+                    updated_at = ?
+                """,
+                (str(uuid.uuid4()), tenant_id, email, hash_password(password), role, now, now),
+            )
+        return self._user(tenant_id, email)
+
+    def _user(self, tenant_id: str, email: str) -> Optional[Dict[str, Any]]:
+        return _row(
+            self.conn.execute("SELECT * FROM users WHERE tenant_id = ? AND email = ?", (tenant_id, email)).fetchone()
+        )
+
+    def authenticate(self, tenant_id: str, email: str, password: str) -> Optional[Dict[str, Any]]:
+        user = self._user(tenant_id, email)
+        if not user:
+            return None
+        if not verify_password(password, user["password_hash"]):
+            return None
+        return user
+
+    def list_agents(self, tenant_id: str, user_id: str, role: str) -> List[Dict[str, Any]]:
+        if role == "admin":
+            rows = self.conn.execute(
+                f"SELECT {AGENT_COLS} FROM agents WHERE tenant_id = ? ORDER BY created_at", (tenant_id,)
+            )
+        else:
+            rows = self.conn.execute(
+                f"SELECT {AGENT_COLS} FROM agents WHERE tenant_id = ? AND owner_user_id = ? ORDER BY created_at",
+                (tenant_id, user_id),
+            )
+        return [dict(r) for r in rows]
+
+    def create_agent(
+        self,
+        tenant_id: str,
+        owner_user_id: str,
+        name: str,
+        a_type: str,
+        specialty: str,
+        context_mode: Optional[str] = None,
+        context_tokens: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        agent = {
+            "id": str(uuid.uuid4()),
+            "tenant_id": tenant_id,
+            "owner_user_id": owner_user_id,
+            "name": name,
+            "type": a_type,
+            "specialty": specialty,
+            "matrix_version": 0,
+            "matrix_sha": None,
+            "context_mode": context_mode,
+            "context_tokens": context_tokens,
+            "created_at": datetime.utcnow().isoformat(),
+        }
+        with self.conn as c:
+            c.execute(
+                """
+                INSERT INTO agents
+                    (id, tenant_id, owner_user_id, name, type, specialty, matrix_version, matrix_sha,
+                     context_mode, context_tokens, created_at)
+                VALUES
+                    (:id, :tenant_id, :owner_user_id, :name, :type, :specialty, :matrix_version, :matrix_sha,
+                     :context_mode, :context_tokens, :created_at)
+                """,
+                agent,
+            )
+        return agent
+
+    def get_agent(self, tenant_id: str, agent_id: str) -> Optional[Dict[str, Any]]:
+        return _row(
+            self.conn.execute(
+                f"SELECT {AGENT_COLS} FROM agents WHERE id = ? AND tenant_id = ?", (agent_id, tenant_id)
+            ).fetchone()
+        )
+
+    def update_agent_context(
+        self, tenant_id: str, agent_id: str, context_mode: Optional[str], context_tokens: Optional[int]
+    ) -> Optional[Dict[str, Any]]:
+        with self.conn as c:
+            cur = c.execute(
+                "UPDATE agents SET context_mode = ?, context_tokens = ?, updated_at = ? WHERE id = ? AND tenant_id = ?",
+                (context_mode, context_tokens, datetime.utcnow().isoformat(), agent_id, tenant_id),
+            )
+        return self.get_agent(tenant_id, agent_id) if cur.rowcount else None
+
+    def update_agent_matrix(
+        self,
+        tenant_id: str,
+        agent_id: str,
+        matrix: str,
+        sources: Optional[Dict[str, Any]] = None,
+        expected_version: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        now = datetime.utcnow().isoformat()
+        # blob gravado antes, como delta da matriz atual (idempotente: endereçado pelo conteúdo)
+        current = self.get_agent(tenant_id, agent_id)
+        base_sha = (current or {}).get("matrix_sha")
+        if current and not base_sha:
+            base_sha = self._record_legacy_matrix(current)
+        sha = self.matrices.put(matrix, base_sha=base_sha)
+        with self.conn as c:
+            cur = c.execute(
+                """
+                UPDATE agents SET matrix = '', matrix_sha = ?, matrix_version = matrix_version + 1, updated_at = ?
+                WHERE id = ? AND tenant_id = ? AND (? IS NULL OR matrix_version = ?)
+                """,
+                (sha, now, agent_id, tenant_id, expected_version, expected_version),
+            )
+            if cur.rowcount == 0:
+                exists = c.execute("SELECT 1 FROM agents WHERE id = ? AND tenant_id = ?", (agent_id, tenant_id)).fetchone()
+                raise KeyError("matrix_version_conflict" if exists else "agent_not_found")
+            c.execute(
+                """
+                INSERT INTO matrix_versions (tenant_id, agent_id, version, sha256, chars, created_at)
+                SELECT tenant_id, id, matrix_version, ?, ?, ? FROM agents WHERE id = ? AND tenant_id = ?
+                """,
+                (sha, len(matrix), now, agent_id, tenant_id),
+            )
+            if sources is not None:
+                # mesma transação do UPDATE: a versão registrada é a que acabou de ser gravada
+                c.execute(
+                    """
+                    INSERT INTO matrix_sources (id, tenant_id, agent_id, version, mode, job_id, sources, created_at)
+                    SELECT ?, tenant_id, id, matrix_version, ?, ?, ?, ? FROM agents WHERE id = ? AND tenant_id = ?
+                    """,
+                    (
+                        str(uuid.uuid4()),
+                        sources.get("mode", "replace"),
+                        sources.get("job_id"),
+                        json.dumps(sources.get("sources", []), ensure_ascii=False),
+                        now,
+                        agent_id,
+                        tenant_id,
+                    ),
+                )
+        return self.get_agent(tenant_id, agent_id)
+
+    def _record_legacy_matrix(self, agent: Dict[str, Any]) -> Optional[str]:
+        # agente de antes do histórico: o texto da coluna legada vira a versão atual no histórico
+        legacy = self.conn.execute(
+            "SELECT matrix FROM agents WHERE id = ? AND tenant_id = ?", (agent["id"], agent["tenant_id"])
+        ).fetchone()
+        if legacy is None or not legacy["matrix"]:
+            return None
+        sha = self.matrices.put(legacy["matrix"])
+        with self.conn as c:
+            c.execute(
+                """
+                INSERT OR IGNORE INTO matrix_versions (tenant_id, agent_id, version, sha256, chars, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    agent["tenant_id"],
+                    agent["id"],
+                    agent["matrix_version"],
+                    sha,
+                    len(legacy["matrix"]),
+                    agent.get("updated_at") or agent["created_at"],
+                ),
+            )
+        return sha
+
+    def get_agent_matrix(self, tenant_id: str, agent_id: str, version: Optional[int] = None) -> Optional[str]:
+        """Texto da matriz na versão pedida (atual por padrão); None se o agente ou a versão não existem."""
+        if version is None:
+            row = self.conn.execute(
+                "SELECT matrix, matrix_sha FROM agents WHERE id = ? AND tenant_id = ?", (agent_id, tenant_id)
+            ).fetchone()
+        else:
+            row = self.conn.execute(
+                "SELECT '' AS matrix, sha256 AS matrix_sha FROM matrix_versions WHERE tenant_id = ? AND agent_id = ? AND version = ?",
+                (tenant_id, agent_id, version),
+            ).fetchone()
+            if row is None:
+                # agente de antes do histórico: só a versão atual existe, ainda na coluna legada
+                row = self.conn.execute(
+                    "SELECT matrix, matrix_sha FROM agents WHERE id = ? AND tenant_id = ? AND matrix_version = ?",
+                    (agent_id, tenant_id, version),
+                ).fetchone()
+        if row is None:
+            return None
+        return self.matrices.get(row["matrix_sha"]) if row["matrix_sha"] else row["matrix"]
+
+    def list_matrix_versions(self, tenant_id: str, agent_id: str) -> List[Dict[str, Any]]:
+        rows = self.conn.execute(
+            """
+            SELECT tenant_id, agent_id, version, sha256, chars, created_at FROM matrix_versions
+            WHERE tenant_id = ? AND agent_id = ? ORDER BY version
+            """,
+            (tenant_id, agent_id),
+        )
+        return [dict(r) for r in rows]
+
+    def diff_matrix_versions(self, tenant_id: str, agent_id: str, from_version: int, to_version: int) -> Optional[str]:
+        old = self.get_agent_matrix(tenant_id, agent_id, from_version)
+        new = self.get_agent_matrix(tenant_id, agent_id, to_version)
+        if old is None or new is None:
+            return None
+        return unified_diff(old, new, f"v{from_version}", f"v{to_version}")
+
+    def list_matrix_sources(self, tenant_id: str, agent_id: str) -> List[Dict[str, Any]]:
+        rows = self.conn.execute(
+            """
+            SELECT id, tenant_id, agent_id, version, mode, job_id, sources, created_at FROM matrix_sources
+            WHERE tenant_id = ? AND agent_id = ? ORDER BY version
+            """,
+            (tenant_id, agent_id),
+        ).fetchall()
+        return [{**dict(r), "sources": json.loads(r["sources"])} for r in rows]
+
+    def delete_agent(self, tenant_id: str, agent_id: str) -> bool:
+        with self.conn as c:
+            cur = c.execute("DELETE FROM agents WHERE id = ? AND tenant_id = ?", (agent_id, tenant_id))
+            if cur.rowcount == 0:
+                return False
+            c.execute(
+                """
+                DELETE FROM messages WHERE conversation_id IN
+                    (SELECT id FROM conversations WHERE tenant_id = ? AND agent_id = ?)
+                """,
+                (tenant_id, agent_id),
+            )
+            c.execute(
+                """
+                DELETE FROM conversation_summaries WHERE conversation_id IN
+                    (SELECT id FROM conversations WHERE tenant_id = ? AND agent_id = ?)
+                """,
+                (tenant_id, agent_id),
+            )
+            c.execute("DELETE FROM conversations WHERE tenant_id = ? AND agent_id = ?", (tenant_id, agent_id))
+            c.execute("DELETE FROM matrix_sources WHERE tenant_id = ? AND agent_id = ?", (tenant_id, agent_id))
+            c.execute("DELETE FROM matrix_versions WHERE tenant_id = ? AND agent_id = ?", (tenant_id, agent_id))
+        return True
+
+    def create_conversation(self, tenant_id: str, user_id: str, agent_id: str) -> Dict[str, Any]:
+        conv = {
+            "id": str(uuid.uuid4()),
+            "tenant_id": tenant_id,
+            "user_id": user_id,
+            "agent_id": agent_id,
+            "created_at": datetime.utcnow().isoformat(),
+        }
+        with self.conn as c:
+            c.execute(
+                """
+                INSERT INTO conversations (id, tenant_id, user_id, agent_id, created_at)
+                VALUES (:id, :tenant_id, :user_id, :agent_id, :created_at)
+                """,
+                conv,
+            )
+        return conv
+
+    def get_conversation(self, tenant_id: str, conversation_id: str) -> Optional[Dict[str, Any]]:
+        return _row(
+            self.conn.execute(
+                "SELECT * FROM conversations WHERE id = ? AND tenant_id = ?", (conversation_id, tenant_id)
+            ).fetchone()
+        )
+
+    def list_conversations(
+        self,
+        tenant_id: str,
+        agent_id: Optional[str] = None,
+        user_id: Optional[str] = None,
+        offset: int = 0,
+        limit: int = 50,
+    ) -> List[Dict[str, Any]]:
+        where = ["tenant_id = ?"]
+        params: List[Any] = [tenant_id]
+        if agent_id is not None:
+            where.append("agent_id = ?")
+            params.append(agent_id)
+        if user_id is not None:
+            where.append("user_id = ?")
+            params.append(user_id)
+        if len(where) == 1:
+            return []
+        rows = self.conn.execute(
+            f"SELECT * FROM conversations WHERE {' AND '.join(where)} ORDER BY created_at DESC LIMIT ? OFFSET ?",
+            (*params, limit, offset),
+        )
+        return [dict(r) for r in rows]
+
+    def delete_conversation(self, tenant_id: str, conversation_id: str) -> bool:
+        with self.conn as c:
+            cur = c.execute("DELETE FROM conversations WHERE id = ? AND tenant_id = ?", (conversation_id, tenant_id))
+            if cur.rowcount == 0:
+                return False
+            c.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+            c.execute("DELETE FROM conversation_summaries WHERE conversation_id = ?", (conversation_id,))
+        return True
+
+    def append_message(self, conversation_id: str, role: str, content: str) -> None:
+        with self.conn as c:
+            c.execute(
+                "INSERT INTO messages (conversation_id, role, content, tokens, created_at) VALUES (?, ?, ?, ?, ?)",
+                (conversation_id, role, content, estimate_tokens(content), datetime.utcnow().isoformat()),
+            )
+
+    def get_conversation_summary(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        return _row(
+            self.conn.execute(
+                "SELECT conversation_id AS id, summary, covered, updated_at FROM conversation_summaries WHERE conversation_id = ?",
+                (conversation_id,),
+            ).fetchone()
+        )
+
+    def save_conversation_summary(self, conversation_id: str, summary: str, covered: int, expected_covered: int) -> bool:
+        """Grava o resumo só se ninguém o avançou desde `expected_covered` (False: outro worker já gravou)."""
+        now = datetime.utcnow().isoformat()
+        with self.conn as c:
+            if expected_covered == 0:
+                cur = c.execute(
+                    """
+                    INSERT INTO conversation_summaries (conversation_id, summary, covered, updated_at) VALUES (?, ?, ?, ?)
+                    ON CONFLICT (conversation_id) DO UPDATE SET
+                        summary = excluded.summary, covered = excluded.covered, updated_at = excluded.updated_at
+                    WHERE conversation_summaries.covered = 0
+                    """,
+                    (conversation_id, summary, covered, now),
+                )
+            else:
+                cur = c.execute(
+                    "UPDATE conversation_summaries SET summary = ?, covered = ?, updated_at = ? WHERE conversation_id = ? AND covered = ?",
+                    (summary, covered, now, conversation_id, expected_covered),
+                )
+        return cur.rowcount > 0
+
+    def count_messages(self, conversation_id: str) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM messages WHERE conversation_id = ?", (conversation_id,)).fetchone()[0]
+
+    def load_messages(self, conversation_id: str, offset: int = 0, limit: int = 20) -> List[Dict[str, Any]]:
+        rows = self.conn.execute(
+            """
+            SELECT role, content, tokens, created_at FROM messages
+            WHERE conversation_id = ? ORDER BY id DESC LIMIT ? OFFSET ?
+            """,
+            (conversation_id, limit, offset),
+        ).fetchall()
+        return [dict(r) for r in reversed(rows)]
+
+    def load_last_messages(self, conversation_id: str, limit: int = 12) -> List[Dict[str, Any]]:
+        return self.load_messages(conversation_id, offset=0, limit=limit)
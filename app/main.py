@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+from contextlib import asynccontextmanager
 from pathlib import Path
 
 from fastapi import FastAPI
@@ -14,11 +15,31 @@ from app.api.routes_auth import router as auth_router
 from app.api.routes_agents import router as agents_router
 from app.api.routes_chat import router as chat_router
 from app.api.routes_admin import router as admin_router
+from app.api.routes_jobs import router as jobs_router
+from app.api.deps import get_store
+from app.core.concurrency import shutdown_executors
+from app.infra.json_store import start_message_compactor
+from app.services.ingest_jobs import start_job_workers
+from app.services.url_fetcher import close_fetcher
+from app.services.groq_client import close_clients, init_clients
 
 # Paths
 ROOT_DIR = Path(__file__).resolve().parents[1]  # geoobcode_core_api/
 ASSETS_DIR = ROOT_DIR / "assets"
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if settings.store_backend == "json":
+        start_message_compactor()
+    init_clients()
+    start_job_workers(get_store)  # também retoma jobs interrompidos
+    yield
+    await close_clients()
+    close_fetcher()
+    shutdown_executors()
+
+
 # 1) cria o app PRIMEIRO
 app = FastAPI(
     title="Blue Identy Agents AI — GeoOBCode Core API",
@@ -33,6 +54,7 @@ com foco em ambientes corporativos e regulados.
 """,
     docs_url=None,   # desliga /docs padrão
     redoc_url=None,  # opcional: desliga /redoc padrão
+    lifespan=lifespan,
 )
 
 # 2) assets (monta uma vez só, e só se existir)
@@ -109,3 +131,4 @@ app.include_router(auth_router)
 app.include_router(agents_router)
 app.include_router(chat_router)
 app.include_router(admin_router)
+app.include_router(jobs_router)
@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+from app.infra.disk_cache import DiskCache
+from app.services.chat_service import TEMPLATE_VERSION, PromptPrefix, sampling
+
+# ---------------------------------------------------------------------------
+# Cache de respostas idênticas (opt-in, ANSWER_CACHE=1)
+#
+# Perguntas de FAQ chegam iguais várias vezes: mesmo sistema, mesma matriz,
+# sem histórico, mesma pergunta e temperatura. A chave é o hash da entrada
+# do LLM + modelo/amostragem + tenant, agente e versão da matriz: outro
+# tenant nunca acerta, e uma ingestão nova muda a chave. Só a pergunta é
+# normalizada (espaços e caixa); prefixo, resumo e histórico entram byte a
+# byte (YAML, código e siglas dependem deles). Entradas vivem
+# ANSWER_CACHE_TTL_S; o disco é limitado por ANSWER_CACHE_BYTES (LRU do
+# DiskCache). Turnos com histórico ou resumo não usam o cache, a menos que
+# ANSWER_CACHE_WITH_HISTORY=1.
+# ---------------------------------------------------------------------------
+
+
+def normalize_question(text: str) -> str:
+    # "Qual o prazo?" == "qual  o prazo?"
+    return " ".join(text.split()).casefold()
+
+
+class AnswerCache:
+    def __init__(self, root: Path, max_bytes: int):
+        self._disk = DiskCache(root, max_bytes)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0  # inclui entradas vencidas
+
+    def get(self, key: str) -> Optional[str]:
+        raw = self._disk.get_text(key)
+        entry = json.loads(raw) if raw is not None else None
+        fresh = entry is not None and time.time() - float(entry["created"]) <= settings.answer_cache_ttl_s
+        with self._lock:
+            if fresh:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return entry["answer"] if fresh else None
+
+    def set(self, key: str, answer: str) -> None:
+        self._disk.set_text(key, json.dumps({"answer": answer, "created": time.time()}, ensure_ascii=False))
+
+    def stats(self) -> Dict[str, Any]:
+        # bytes/limite do disco, acertos/faltas contando o TTL
+        stats = self._disk.stats()
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats.update(
+                hits=self.hits, misses=self.misses, hit_rate=round(self.hits / lookups, 4) if lookups else 0.0
+            )
+        return stats
+
+
+answer_cache = AnswerCache(Path("data") / "cache" / "answers", settings.answer_cache_bytes)
+
+
+def answer_key(
+    tenant_id: str,
+    agent: Dict[str, Any],
+    prefix: PromptPrefix,
+    history: List[Dict[str, Any]],
+    summary: str,
+    prompt: str,
+) -> Optional[str]:
+    """Chave do turno no cache de respostas, ou None quando o turno não deve usar o cache."""
+    if not settings.answer_cache:
+        return None
+    if (history or summary) and not settings.answer_cache_with_history:
+        return None
+    history_txt = "\n".join(f"{m.get('role', '')}: {m.get('content', '')}" for m in history)
+    return DiskCache.key(
+        tenant_id,
+        agent["id"],
+        str(agent.get("matrix_version") or 0),
+        TEMPLATE_VERSION,
+        json.dumps(sampling(agent), sort_keys=True),
+        prefix.digest,
+        summary,
+        history_txt,
+        normalize_question(prompt),
+    )
@@ -1,10 +1,16 @@
 from __future__ import annotations
 
-from typing import Dict, Any, List
+import hashlib
+from dataclasses import dataclass
+from functools import cached_property
+from typing import Dict, Any, AsyncIterator, List, Optional
 
 from app.core.config import settings
-from app.core.governor import get_budgets, enforce_max_chars
-from app.services.groq_client import chat_completion
+from app.core.governor import get_budgets, enforce_max_chars, estimate_tokens
+from app.services.groq_client import achat_completion, achat_completion_stream
+from app.services.history import pack_history
+
+TEMPLATE_VERSION = "1"  # mudou build_system ou matrix_block? incremente (invalida os prefixos em cache)
 
 
 def build_system(agent: Dict[str, Any], profile: str) -> str:
@@ -20,34 +26,88 @@ Regras:
 """.strip()
 
 
-def build_user_payload(agent: Dict[str, Any], history: List[Dict[str, Any]], prompt: str) -> str:
+def matrix_block(matrix: str) -> str:
+    return f"[MATRIZ_DE_CONHECIMENTO]\n{matrix}\n"
+
+
+@dataclass(frozen=True)
+class PromptPrefix:
+    """Parte fixa do prompt de um agente: mensagem de sistema e começo da mensagem do usuário."""
+
+    system: str
+    matrix_block: str
+    tokens: int  # estimativa de sistema + bloco da matriz
+
+    @cached_property
+    def digest(self) -> str:
+        """sha256 do prefixo, byte a byte (chave do cache de respostas); calculado uma vez por prefixo."""
+        return hashlib.sha256((self.system + "\0" + self.matrix_block).encode("utf-8")).hexdigest()
+
+
+def compile_prefix(agent: Dict[str, Any], profile: str, matrix: str) -> PromptPrefix:
+    system = build_system(agent, profile)
+    block = matrix_block(matrix)
+    return PromptPrefix(system=system, matrix_block=block, tokens=estimate_tokens(system) + estimate_tokens(block))
+
+
+def build_user_payload(
+    agent: Dict[str, Any], history: List[Dict[str, Any]], prompt: str, summary: str = "", block: Optional[str] = None
+) -> str:
+    # o bloco da matriz abre a mensagem; tudo que muda a cada turno vem depois dele
+    if block is None:
+        block = matrix_block(agent.get("matrix", ""))
     history_txt = "\n".join([f"{m.get('role','').upper()}: {m.get('content','')}" for m in history])
-    return f"""
-[MATRIZ_DE_CONHECIMENTO]
-{agent.get('matrix','')}
+    summary_txt = f"\n[RESUMO_DA_CONVERSA]\n{summary}\n" if summary else ""
+    return f"{block}{summary_txt}\n[HISTÓRICO]\n{history_txt}\n\n[PERGUNTA_ATUAL]\n{prompt}".rstrip()
 
-[HISTÓRICO]
-{history_txt}
 
-[PERGUNTA_ATUAL]
-{prompt}
-""".strip()
+def sampling(agent: Dict[str, Any]) -> Dict[str, Any]:
+    return {"model": settings.chat_model, "temperature": 0.2 if agent.get("type") == "Corporativo" else 0.4, "max_tokens": 1800}
 
 
-def answer(client, agent: Dict[str, Any], history: List[Dict[str, Any]], prompt: str, profile: str = "ADMIN") -> str:
+def _completion_args(
+    agent: Dict[str, Any],
+    history: List[Dict[str, Any]],
+    prompt: str,
+    profile: str,
+    summary: str = "",
+    prefix: Optional[PromptPrefix] = None,
+) -> Dict[str, Any]:
     budgets = get_budgets()
     prompt = enforce_max_chars(prompt, 8000, "prompt")
-    history = history[-budgets.max_history_msgs:]
+    # histórico já vem empacotado de history.load_history; aqui só garante o teto
+    history = pack_history(history, max(0, budgets.history_tokens - estimate_tokens(summary)))
 
-    system = build_system(agent, profile)
-    user_payload = build_user_payload(agent, history, prompt)
+    # sem prefixo compilado (chamadas fora da rota de chat): monta a partir de agent["matrix"]
+    if prefix is None:
+        prefix = compile_prefix(agent, profile, agent.get("matrix", ""))
+    user_payload = build_user_payload(agent, history, prompt, summary, prefix.matrix_block)
+
+    return {
+        "messages": [{"role": "system", "content": prefix.system}, {"role": "user", "content": user_payload}],
+        **sampling(agent),
+    }
+
+
+async def aanswer(
+    client,
+    agent: Dict[str, Any],
+    history: List[Dict[str, Any]],
+    prompt: str,
+    profile: str = "ADMIN",
+    summary: str = "",
+    prefix: Optional[PromptPrefix] = None,
+) -> str:
+    return await achat_completion(client=client, **_completion_args(agent, history, prompt, profile, summary, prefix))
 
-    temperature = 0.2 if agent.get("type") == "Corporativo" else 0.4
 
-    return chat_completion(
-        client=client,
-        model=settings.chat_model,
-        messages=[{"role": "system", "content": system}, {"role": "user", "content": user_payload}],
-        temperature=temperature,
-        max_tokens=1800,
-    )
+def aanswer_stream(
+    client,
+    agent: Dict[str, Any],
+    history: List[Dict[str, Any]],
+    prompt: str,
+    profile: str = "ADMIN",
+    summary: str = "",
+    prefix: Optional[PromptPrefix] = None,
+) -> AsyncIterator[str]:
+    return achat_completion_stream(client=client, **_completion_args(agent, history, prompt, profile, summary, prefix))
@@ -0,0 +1,304 @@
+from __future__ import annotations
+
+import re
+import zlib
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+# ---------------------------------------------------------------------------
+# Chunker estrutural
+#
+# Corta o corpus só em fronteiras: documento ([DOC_TXT]/[URL_TXT]/[FILE:…]),
+# página/planilha ([PDF:page=…]/[XLSX:sheet=…]) e parágrafo; parágrafos maiores
+# que o alvo caem para linha, frase e palavra. Os segmentos são empacotados
+# até `target_chars` sem atravessar documentos (a inclusão de um arquivo não
+# desloca os trechos dos demais, o que preserva o cache de parciais), e cada
+# trecho recomeça com os marcadores ativos, para o modelo saber de onde veio.
+#
+# Antes do empacotamento sai o que é repetido:
+# - linhas curtas que se repetem, idênticas e na mesma borda (topo/rodapé),
+#   em várias páginas do mesmo PDF (cabeçalho, rodapé): fica a primeira
+#   ocorrência; só a numeração ("Página N de M", "- N -") ignora os dígitos;
+# - parágrafos idênticos (após normalizar espaços/caixa) em qualquer documento;
+# - parágrafos quase idênticos, por MinHash (one-permutation hashing sobre
+#   shingles de palavras) com LSH em bandas e confirmação pela similaridade
+#   estimada. Parágrafos que diferem em números ou negações ("prazo de 30
+#   dias" x "60 dias", "é permitido" x "não é permitido") nunca são
+#   quase-duplicatas: são justamente as regras que a síntese precisa ver.
+# Tudo é determinístico: o mesmo corpus gera os mesmos trechos (cache).
+# ---------------------------------------------------------------------------
+
+_MARKER = re.compile(r"^\[(DOC_TXT|URL_TXT|FILE:[^\]\n]*|PDF:page=\d+|XLSX:sheet=[^\]\n]*)\]$")
+_DOC_MARKERS = ("[DOC_TXT]", "[URL_TXT]", "[FILE:")
+_PARA_SPLIT = re.compile(r"\n\s*\n")
+_SENTENCE_END = re.compile(r"(?<=[.!?;:])\s+")
+_WS = re.compile(r"\s+")
+_DIGITS = re.compile(r"\d+")
+_WORD = re.compile(r"\w+")
+_PAGE_NUMBER = re.compile(r"^(?:(?:p[áa]g(?:ina)?\.?|page)\s*\d+(?:\s*(?:de|of|/)\s*\d+)?|-?\s*\d+\s*-?|\d+\s*/\s*\d+)$")
+_NEGATIONS = frozenset(
+    "não nao nem nunca jamais nenhum nenhuma nada sem exceto salvo vedado proibido "
+    "not no never none nor without except".split()
+)
+
+SHINGLE_WORDS = 3
+MINHASH_BINS = 64
+LSH_BANDS = 16  # 16 bandas x 4 linhas: par com similaridade 0,8 vira candidato com prob. > 0,99
+NEAR_DUP_THRESHOLD = 0.8
+EXACT_DUP_MIN_CHARS = 40  # títulos curtos ("Exemplo:", "N/A") podem se repetir legitimamente
+NEAR_DUP_MIN_WORDS = 12  # parágrafos curtos só passam pela deduplicação exata
+BOILERPLATE_MAX_CHARS = 160
+BOILERPLATE_MIN_PAGES = 3
+BOILERPLATE_EDGE_LINES = 3  # linhas do topo e do rodapé de cada página consideradas
+
+
+@dataclass
+class _Unit:
+    text: str
+    context: Tuple[str, ...]  # marcadores ativos (documento, página/planilha)
+    marker: bool = False
+
+
+def _norm(text: str) -> str:
+    return _WS.sub(" ", text).strip().lower()
+
+
+def _context_after(context: Tuple[str, ...], marker: str) -> Tuple[str, ...]:
+    if marker.startswith(_DOC_MARKERS):
+        # [DOC_TXT] seguido de [FILE:…] formam juntos o cabeçalho do documento
+        if context and all(m.startswith(_DOC_MARKERS) for m in context):
+            return context + (marker,)
+        return (marker,)
+    base = tuple(m for m in context if m.startswith(_DOC_MARKERS))
+    return base + (marker,)
+
+
+def _units(doc: str) -> List[_Unit]:
+    units: List[_Unit] = []
+    context: Tuple[str, ...] = ()
+    for block in _PARA_SPLIT.split(doc.strip()):
+        lines: List[str] = []
+        for line in block.split("\n"):
+            if _MARKER.match(line.strip()):
+                if lines:
+                    units.append(_Unit("\n".join(lines).strip(), context))
+                    lines = []
+                context = _context_after(context, line.strip())
+                units.append(_Unit(line.strip(), context, marker=True))
+            else:
+                lines.append(line)
+        if "\n".join(lines).strip():
+            units.append(_Unit("\n".join(lines).strip(), context))
+    return units
+
+
+def _boilerplate_key(line: str) -> str:
+    # só numeração de página tem os dígitos ignorados; qualquer outra linha
+    # precisa repetir o texto inteiro ("Multa: 2%" x "Multa: 5%" são cláusulas)
+    norm = _norm(line)
+    return _DIGITS.sub("0", norm) if _PAGE_NUMBER.match(norm) else norm
+
+
+def _strip_page_boilerplate(units: List[_Unit]) -> int:
+    """Remove linhas curtas repetidas no topo/rodapé de várias páginas de PDF; retorna quantas saíram."""
+    lines_by_page: Dict[str, List[Tuple[int, int]]] = {}
+    for ui, u in enumerate(units):
+        page = next((m for m in u.context if m.startswith("[PDF:")), None)
+        if u.marker or page is None:
+            continue
+        for li, line in enumerate(u.text.split("\n")):
+            if line.strip():
+                lines_by_page.setdefault(page, []).append((ui, li))
+
+    # chave = (topo/rodapé, texto): só as bordas da página são candidatas
+    keys: Dict[Tuple[int, int], Tuple[str, str]] = {}
+    pages_by_key: Dict[Tuple[str, str], Set[str]] = {}
+    for page, positions in lines_by_page.items():
+        for i, (ui, li) in enumerate(positions):
+            if i < BOILERPLATE_EDGE_LINES:
+                edge = "top"
+            elif i >= len(positions) - BOILERPLATE_EDGE_LINES:
+                edge = "bottom"
+            else:
+                continue
+            line = units[ui].text.split("\n")[li]
+            if len(line.strip()) <= BOILERPLATE_MAX_CHARS:
+                key = (edge, _boilerplate_key(line))
+                keys[(ui, li)] = key
+                pages_by_key.setdefault(key, set()).add(page)
+    repeated = {k for k, pages in pages_by_key.items() if len(pages) >= BOILERPLATE_MIN_PAGES}
+    if not repeated:
+        return 0
+
+    removed = 0
+    seen: Set[Tuple[str, str]] = set()
+    for ui, u in enumerate(units):
+        if u.marker:
+            continue
+        kept = []
+        for li, line in enumerate(u.text.split("\n")):
+            key = keys.get((ui, li))
+            if key in repeated:
+                if key in seen:
+                    removed += 1
+                    continue
+                seen.add(key)
+            kept.append(line)
+        u.text = "\n".join(kept).strip()
+    return removed
+
+
+def _minhash(words: List[str]) -> List[int]:
+    """Assinatura por one-permutation hashing (um hash por shingle) com densificação por rotação."""
+    bins: List[Optional[int]] = [None] * MINHASH_BINS
+    for i in range(max(1, len(words) - SHINGLE_WORDS + 1)):
+        h = zlib.crc32(" ".join(words[i : i + SHINGLE_WORDS]).encode("utf-8"))
+        b, v = h % MINHASH_BINS, h // MINHASH_BINS
+        if bins[b] is None or v < bins[b]:
+            bins[b] = v
+    sig: List[int] = []
+    for b in range(MINHASH_BINS):
+        # bin vazio herda o próximo bin preenchido (circular), deslocado pela distância
+        for step in range(MINHASH_BINS):
+            v = bins[(b + step) % MINHASH_BINS]
+            if v is not None:
+                sig.append(v + step * (1 << 32))
+                break
+    return sig
+
+
+def _similarity(a: List[int], b: List[int]) -> float:
+    return sum(1 for x, y in zip(a, b) if x == y) / MINHASH_BINS
+
+
+def _critical_tokens(norm: str) -> Tuple[str, ...]:
+    """Números e negações do parágrafo, em ordem: mudar qualquer um muda a regra."""
+    return tuple(w for w in _WORD.findall(norm) if w in _NEGATIONS or _DIGITS.search(w))
+
+
+class _Deduper:
+    def __init__(self):
+        self.exact: Set[str] = set()
+        self.sigs: List[List[int]] = []
+        self.critical: List[Tuple[str, ...]] = []
+        self.buckets: Dict[Tuple[int, Tuple[int, ...]], List[int]] = {}
+
+    def is_duplicate(self, text: str) -> bool:
+        norm = _norm(text)
+        if len(norm) >= EXACT_DUP_MIN_CHARS:
+            if norm in self.exact:
+                return True
+            self.exact.add(norm)
+
+        words = norm.split(" ")
+        if len(words) < NEAR_DUP_MIN_WORDS:
+            return False
+        sig = _minhash(words)
+        rows = MINHASH_BINS // LSH_BANDS
+        keys = [(band, tuple(sig[band * rows : (band + 1) * rows])) for band in range(LSH_BANDS)]
+        candidates = {i for k in keys for i in self.buckets.get(k, ())}
+        critical = _critical_tokens(norm)
+        if any(
+            _similarity(sig, self.sigs[i]) >= NEAR_DUP_THRESHOLD and self.critical[i] == critical for i in candidates
+        ):
+            return True
+        idx = len(self.sigs)
+        self.sigs.append(sig)
+        self.critical.append(critical)
+        for k in keys:
+            self.buckets.setdefault(k, []).append(idx)
+        return False
+
+
+def _split_oversized(text: str, limit: int) -> Iterator[str]:
+    """Quebra um parágrafo maior que `limit` em linhas, depois frases, depois palavras."""
+    for splitter in ("\n", _SENTENCE_END, " "):
+        pieces = text.split(splitter) if isinstance(splitter, str) else splitter.split(text)
+        if len(pieces) > 1:
+            sep = splitter if isinstance(splitter, str) else " "
+            buf = ""
+            for piece in pieces:
+                if len(piece) > limit:
+                    if buf:
+                        yield buf
+                        buf = ""
+                    yield from _split_oversized(piece, limit)
+                elif buf and len(buf) + len(sep) + len(piece) > limit:
+                    yield buf
+                    buf = piece
+                else:
+                    buf = buf + sep + piece if buf else piece
+            if buf:
+                yield buf
+            return
+    # uma "palavra" maior que o alvo (base64, tabela sem espaços): corte seco
+    for i in range(0, len(text), limit):
+        yield text[i : i + limit]
+
+
+def _pack(units: List[_Unit], target: int) -> List[str]:
+    chunks: List[str] = []
+    buf: List[str] = []
+    size = 0
+    context: Tuple[str, ...] = ()
+
+    def flush():
+        nonlocal buf, size
+        while buf and _MARKER.match(buf[-1]):
+            buf.pop()  # marcador sem conteúdo no fim: o próximo trecho o repete no cabeçalho
+        if buf:
+            # marcadores colados ao que vem depois; blocos de conteúdo separados por linha em branco
+            text = buf[0]
+            for prev, cur in zip(buf, buf[1:]):
+                text += ("\n" if _MARKER.match(prev.rsplit("\n", 1)[-1]) else "\n\n") + cur
+            chunks.append(text)
+        buf, size = [], 0
+
+    def add(text: str, prefix: Tuple[str, ...]):
+        nonlocal size
+        if size and size + len(text) + 2 > target:
+            flush()
+        if not buf and prefix:
+            # trecho que começa no meio do documento: repete os marcadores ativos
+            buf.append("\n".join(prefix))
+            size = len(buf[0]) + 2
+        buf.append(text)
+        size += len(text) + 2
+
+    for u in units:
+        if u.marker:
+            add(u.text, u.context[:-1])
+            context = u.context
+            continue
+        if not u.text:
+            continue
+        room = max(1, target - len("\n".join(context)) - 4)
+        for piece in [u.text] if len(u.text) <= room else list(_split_oversized(u.text, room)):
+            add(piece, context)
+    flush()
+    return chunks
+
+
+def chunk_documents(docs: List[str], target_chars: int, stats: Optional[Dict[str, int]] = None) -> List[str]:
+    """Trechos de até ~`target_chars`, por documento, sem conteúdo repetido.
+
+    `stats`, se informado, recebe chunks, boilerplate_lines_removed e duplicate_paragraphs_removed.
+    """
+    dedup = _Deduper()
+    chunks: List[str] = []
+    boilerplate = duplicates = 0
+    for doc in docs:
+        units = _units(doc)
+        boilerplate += _strip_page_boilerplate(units)
+        kept: List[_Unit] = []
+        for u in units:
+            if not u.marker and u.text and dedup.is_duplicate(u.text):
+                duplicates += 1
+                continue
+            kept.append(u)
+        chunks.extend(_pack(kept, target_chars))
+    if stats is not None:
+        stats["chunks"] = len(chunks)
+        stats["boilerplate_lines_removed"] = boilerplate
+        stats["duplicate_paragraphs_removed"] = duplicates
+    return chunks
@@ -1,7 +1,13 @@
 from __future__ import annotations
 
-from io import BytesIO
-from typing import List, Tuple
+import codecs
+import hashlib
+import json
+import resource
+import signal
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Iterator, List, Optional, Tuple
 
 from fastapi import UploadFile, HTTPException, status
 
@@ -14,8 +20,18 @@ from docx import Document
 # XLSX
 from openpyxl import load_workbook
 
+from app.core.concurrency import process_pool, reset_process_pool, run_blocking
+from app.core.config import settings
+from app.infra.disk_cache import DiskCache
+
 
 SUPPORTED_EXT = {"txt", "md", "pdf", "docx", "xlsx", "csv"}
+_TEXT_EXT = {"txt", "md", "csv"}
+
+# muda quando a saída de algum extrator muda: invalida o cache de texto extraído
+EXTRACT_VERSION = "1"
+# texto extraído por conteúdo do arquivo: o mesmo manual enviado a vários agentes/tenants é lido uma vez
+text_cache = DiskCache(Path("data") / "cache" / "extract", settings.extract_cache_bytes)
 
 
 def _get_ext(filename: str) -> str:
@@ -24,59 +40,64 @@ def _get_ext(filename: str) -> str:
     return filename.rsplit(".", 1)[-1].lower().strip()
 
 
-def _safe_decode(data: bytes) -> str:
-    # utf-8 como default; com fallback tolerante
-    try:
-        return data.decode("utf-8")
-    except Exception:
-        return data.decode("utf-8", errors="replace")
-
-
-def _extract_pdf(data: bytes) -> str:
-    reader = PdfReader(BytesIO(data))
-    parts: List[str] = []
-    for i, page in enumerate(reader.pages):
-        t = page.extract_text() or ""
-        if t.strip():
-            parts.append(f"[PDF:page={i+1}]\n{t.strip()}")
-    return "\n\n".join(parts).strip()
-
-
-def _extract_docx(data: bytes) -> str:
-    doc = Document(BytesIO(data))
-    parts = [p.text.strip() for p in doc.paragraphs if (p.text or "").strip()]
-    return "\n".join(parts).strip()
-
+_READ_CHUNK = 1024 * 1024  # leitura/cópia em blocos de 1 MB: nenhum arquivo inteiro em memória
 
-def _extract_xlsx(data: bytes, max_sheets: int = 10, max_rows: int = 500, max_cols: int = 40) -> str:
-    wb = load_workbook(BytesIO(data), read_only=True, data_only=True)
-    sheet_names = wb.sheetnames[:max_sheets]
 
-    out: List[str] = []
-    for name in sheet_names:
-        ws = wb[name]
-        out.append(f"[XLSX:sheet={name}]")
+def _iter_text(fh: BinaryIO, max_bytes: int) -> Iterator[str]:
+    # utf-8 incremental (um caractere partido entre blocos não vira lixo); inválidos viram U+FFFD
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    remaining = max_bytes
+    while remaining > 0:
+        block = fh.read(min(_READ_CHUNK, remaining))
+        if not block:
+            break
+        remaining -= len(block)
+        yield decoder.decode(block)
+    yield decoder.decode(b"", final=True)
 
-        rcount = 0
-        for row in ws.iter_rows(values_only=True):
-            rcount += 1
-            if rcount > max_rows:
-                out.append("[... linhas truncadas ...]")
-                break
 
-            # limita colunas
-            cells = row[:max_cols]
-            # normaliza
-            line = "\t".join("" if c is None else str(c) for c in cells).strip()
-            if line:
-                out.append(line)
+def _iter_pdf(fh: BinaryIO, pages: Optional[range] = None) -> Iterator[str]:
+    reader = PdfReader(fh)  # páginas são lidas sob demanda a partir do arquivo
+    for i in pages if pages is not None else range(len(reader.pages)):
+        t = reader.pages[i].extract_text() or ""
+        if t.strip():
+            yield f"[PDF:page={i+1}]\n{t.strip()}\n\n"
 
-        out.append("")  # separador
 
-    return "\n".join(out).strip()
+def _iter_docx(fh: BinaryIO) -> Iterator[str]:
+    doc = Document(fh)
+    for p in doc.paragraphs:
+        if (p.text or "").strip():
+            yield p.text.strip() + "\n"
 
 
-def extract_text_from_bytes(filename: str, data: bytes) -> str:
+def _iter_xlsx(fh: BinaryIO, max_sheets: int = 10, max_rows: int = 500, max_cols: int = 40) -> Iterator[str]:
+    wb = load_workbook(fh, read_only=True, data_only=True)
+    try:
+        for name in wb.sheetnames[:max_sheets]:
+            ws = wb[name]
+            yield f"[XLSX:sheet={name}]\n"
+
+            rcount = 0
+            for row in ws.iter_rows(values_only=True):
+                rcount += 1
+                if rcount > max_rows:
+                    yield "[... linhas truncadas ...]\n"
+                    break
+
+                # limita colunas
+                cells = row[:max_cols]
+                # normaliza
+                line = "\t".join("" if c is None else str(c) for c in cells).strip()
+                if line:
+                    yield line + "\n"
+
+            yield "\n"  # separador
+    finally:
+        wb.close()
+
+
+def check_supported(filename: str) -> None:
     ext = _get_ext(filename)
     if ext not in SUPPORTED_EXT:
         raise HTTPException(
@@ -84,60 +105,269 @@ def extract_text_from_bytes(filename: str, data: bytes) -> str:
             detail=f"Formato não suportado: .{ext or '?'} (suportados: {sorted(SUPPORTED_EXT)})",
         )
 
-    if ext in {"txt", "md", "csv"}:
-        return _safe_decode(data).strip()
+
+def iter_text(filename: str, fh: BinaryIO, *, max_bytes: int) -> Iterator[str]:
+    """Texto do arquivo em pedaços (página, parágrafo, linha ou bloco), na ordem do documento."""
+    check_supported(filename)
+    ext = _get_ext(filename)
+
+    if ext in _TEXT_EXT:
+        return _iter_text(fh, max_bytes)
 
     if ext == "pdf":
-        return _extract_pdf(data)
+        return _iter_pdf(fh)
 
     if ext == "docx":
-        return _extract_docx(data)
+        return _iter_docx(fh)
 
     if ext == "xlsx":
-        return _extract_xlsx(data)
+        return _iter_xlsx(fh)
 
     # fallback (não deve chegar aqui)
-    return _safe_decode(data).strip()
+    return _iter_text(fh, max_bytes)
 
 
-async def extract_texts_from_uploads(
+def _take(pieces: Iterator[str], max_chars: int) -> Tuple[str, bool]:
+    """Consome `pieces` até `max_chars`; retorna (texto, truncado). Nada além do limite é lido."""
+    parts: List[str] = []
+    total = 0
+    try:
+        for piece in pieces:
+            if total + len(piece) > max_chars:
+                parts.append(piece[: max_chars - total])
+                return "".join(parts).strip(), True
+            parts.append(piece)
+            total += len(piece)
+        return "".join(parts).strip(), False
+    finally:
+        close = getattr(pieces, "close", None)
+        if close is not None:
+            close()
+
+
+async def save_uploads(
     files: List[UploadFile] | None,
+    dest: Path,
+    *,
+    max_total_bytes: int | None = None,
+) -> List[Tuple[str, str]]:
+    """
+    Copia os uploads para `dest` (entrada de um job de ingestão) em blocos, sem extrair nada.
+    O limite total é verificado durante a cópia. Retorna [(nome original, nome do arquivo em dest)].
+    """
+    max_total_bytes = settings.upload_max_total_bytes if max_total_bytes is None else max_total_bytes
+    saved: List[Tuple[str, str]] = []
+    total = 0
+    for i, f in enumerate(files or []):
+        check_supported(f.filename or "")
+        stored = f"{i:04d}.{_get_ext(f.filename or '')}"
+        dest.mkdir(parents=True, exist_ok=True)
+        out = await run_blocking(open, dest / stored, "wb")
+        try:
+            while block := await f.read(_READ_CHUNK):
+                total += len(block)
+                if total > max_total_bytes:
+                    raise HTTPException(
+                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                        detail="Total de arquivos excede limite do PoC. Envie menos arquivos ou divida em lotes.",
+                    )
+                await run_blocking(out.write, block)
+        finally:
+            await run_blocking(out.close)
+        saved.append((f.filename or stored, stored))
+    return saved
+
+
+# ---------------------------------------------------------------------------
+# Extração em pool de processos
+#
+# Os parsers (pypdf, python-docx, openpyxl) são Python puro e presos à CPU:
+# cada arquivo (e cada faixa de EXTRACT_PDF_PAGES_PER_TASK páginas de um PDF)
+# vira uma tarefa no pool de processos. Cada tarefa tem limite de CPU
+# (EXTRACT_CPU_S) e de tempo (EXTRACT_TIMEOUT_S) aplicados dentro do worker;
+# um parser preso em código C que ignore os sinais é morto pelo RLIMIT_CPU e
+# o pool é recriado. Os resultados são montados na ordem do upload.
+# Antes de qualquer parser, o texto é procurado no cache por sha256 do arquivo.
+# ---------------------------------------------------------------------------
+
+
+class ExtractionTimeout(Exception):
+    pass
+
+
+def _on_limit(signum, frame):
+    raise ExtractionTimeout("limite de CPU/tempo excedido")
+
+
+def _limited(fn: Callable[..., Any], cpu_s: int, wall_s: int, *args: Any) -> Any:
+    """Roda `fn` no worker com limites de CPU e de tempo (sinais na thread principal do worker)."""
+    signal.signal(signal.SIGPROF, _on_limit)
+    signal.signal(signal.SIGALRM, _on_limit)
+    soft, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    # rede de segurança: RLIMIT_CPU é cumulativo no processo, então é rearmado a cada tarefa
+    backstop = int(usage.ru_utime + usage.ru_stime + cpu_s) + 5
+    if hard != resource.RLIM_INFINITY:
+        backstop = min(backstop, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (backstop, hard))
+    signal.setitimer(signal.ITIMER_PROF, cpu_s)
+    signal.setitimer(signal.ITIMER_REAL, wall_s)
+    try:
+        return fn(*args)
+    finally:
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def _pdf_page_count(path: Path) -> int:
+    with path.open("rb") as fh:
+        return len(PdfReader(fh).pages)
+
+
+def _extract_file(filename: str, path: Path, max_bytes: int, max_chars: int, pages: Optional[range]) -> Tuple[str, bool]:
+    with path.open("rb") as fh:
+        pieces = _iter_pdf(fh, pages) if pages is not None else iter_text(filename, fh, max_bytes=max_bytes)
+        return _take(pieces, max_chars)
+
+
+def _file_digest(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as fh:
+        while block := fh.read(_READ_CHUNK):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _run_tasks(calls: List[Tuple[Callable[..., Any], tuple]]) -> List[Any]:
+    """Executa as chamadas (no pool, se habilitado); retorna resultado ou exceção, na ordem das chamadas."""
+    if settings.extract_workers <= 0:
+        results: List[Any] = []
+        for fn, args in calls:
+            try:
+                results.append(fn(*args))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    limits = (settings.extract_cpu_s, settings.extract_timeout_s)
+    results = [None] * len(calls)
+    pool = process_pool()
+    futures = [pool.submit(_limited, fn, *limits, *args) for fn, args in calls]
+    broken: List[int] = []
+    for i, fut in enumerate(futures):
+        try:
+            results[i] = fut.result()
+        except BrokenProcessPool:
+            broken.append(i)
+        except Exception as e:
+            results[i] = e
+    if broken:
+        reset_process_pool(pool)
+        # um worker morreu (RLIMIT_CPU, memória): repete uma a uma para isolar o culpado
+        for i in broken:
+            pool = process_pool()
+            fn, args = calls[i]
+            try:
+                results[i] = pool.submit(_limited, fn, *limits, *args).result()
+            except BrokenProcessPool:
+                reset_process_pool(pool)
+                results[i] = ExtractionTimeout("worker de extração encerrado")
+            except Exception as e:
+                results[i] = e
+    return results
+
+
+def extract_texts_from_files(
+    files: List[Tuple[str, Path]],
     *,
-    max_file_bytes: int = 8 * 1024 * 1024,   # 8 MB por arquivo (PoC)
-    max_total_bytes: int = 20 * 1024 * 1024, # 20 MB total (PoC)
-    max_chars_per_doc: int = 120_000,        # alinhado ao seu enforce_max_chars
+    max_file_bytes: int | None = None,
+    max_chars_per_doc: int | None = None,
 ) -> Tuple[List[str], List[str]]:
     """
     Retorna: (docs_text, warnings)
-    - docs_text: lista de textos prontos para synthesize_matrix
+    - docs_text: lista de textos prontos para synthesize_matrix, na ordem de `files`
     - warnings: avisos de truncamento / arquivos ignorados
+    Cada arquivo é lido em streaming; a memória fica limitada a `max_chars_per_doc` por tarefa.
     """
-    docs_text: List[str] = []
+    max_file_bytes = settings.upload_max_file_bytes if max_file_bytes is None else max_file_bytes
+    max_chars_per_doc = settings.upload_max_doc_chars if max_chars_per_doc is None else max_chars_per_doc
     warnings: List[str] = []
 
-    total = 0
-    for f in files or []:
-        data = await f.read()
-        size = len(data)
-        total += size
-
-        if total > max_total_bytes:
-            raise HTTPException(
-                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-                detail="Total de arquivos excede limite do PoC. Envie menos arquivos ou divida em lotes.",
-            )
-
-        if size > max_file_bytes:
-            warnings.append(f"{f.filename}: truncado para {max_file_bytes} bytes (PoC)")
-            data = data[:max_file_bytes]
-
-        text = extract_text_from_bytes(f.filename or "", data)
-
-        if len(text) > max_chars_per_doc:
-            warnings.append(f"{f.filename}: truncado para {max_chars_per_doc} chars (PoC)")
-            text = text[:max_chars_per_doc]
-
-        if text.strip():
-            docs_text.append(f"[FILE:{f.filename}]\n{text.strip()}")
+    accepted: List[Tuple[str, Path]] = []
+    for filename, path in files:
+        if path.stat().st_size > max_file_bytes:
+            if _get_ext(filename) not in _TEXT_EXT:
+                # pdf/docx/xlsx cortados no meio não abrem: melhor avisar do que ler lixo
+                warnings.append(f"{filename}: ignorado (excede {max_file_bytes} bytes)")
+                continue
+            warnings.append(f"{filename}: truncado para {max_file_bytes} bytes (PoC)")
+        accepted.append((filename, path))
+
+    # 0) cache por conteúdo: a extensão entra na chave porque decide o parser
+    keys = [
+        text_cache.key(_file_digest(path), _get_ext(filename), EXTRACT_VERSION, str(max_file_bytes), str(max_chars_per_doc))
+        for filename, path in accepted
+    ]
+    cached: dict[int, Tuple[str, bool]] = {}
+    for i, key in enumerate(keys):
+        hit = text_cache.get_text(key)
+        if hit is not None:
+            entry = json.loads(hit)
+            cached[i] = (entry["text"], entry["truncated"])
+    pending = [i for i in range(len(accepted)) if i not in cached]
+
+    # 1) contagem de páginas dos PDFs (também limitada: um PDF patológico pode travar já no xref)
+    pdfs = [i for i in pending if _get_ext(accepted[i][0]) == "pdf"]
+    counts = dict(zip(pdfs, _run_tasks([(_pdf_page_count, (accepted[i][1],)) for i in pdfs])))
+
+    # 2) uma tarefa por arquivo, ou por faixa de páginas
+    calls: List[Tuple[Callable[..., Any], tuple]] = []
+    owners: List[int] = []
+    errors: dict[int, Exception] = {}
+    step = max(1, settings.extract_pdf_pages_per_task)
+    for i in pending:
+        filename, path = accepted[i]
+        count = counts.get(i)
+        if isinstance(count, Exception):
+            errors[i] = count
+            continue
+        ranges = [range(a, min(a + step, count)) for a in range(0, count, step)] if count is not None else [None]
+        for pages in ranges:
+            calls.append((_extract_file, (filename, path, max_file_bytes, max_chars_per_doc, pages)))
+            owners.append(i)
+    results = _run_tasks(calls)
+
+    parts: dict[int, List[Tuple[str, bool]]] = {i: [] for i in pending}
+    for owner, result in zip(owners, results):
+        if isinstance(result, Exception):
+            errors.setdefault(owner, result)
+        else:
+            parts[owner].append(result)
+
+    for i in pending:
+        if i in errors:
+            continue  # falhas (timeout incluído) não vão para o cache: podem ser transitórias
+        text = "\n\n".join(t for t, _ in parts[i] if t)
+        truncated = any(tr for _, tr in parts[i]) or len(text) > max_chars_per_doc
+        if truncated:
+            text = text[:max_chars_per_doc].strip()
+        cached[i] = (text, truncated)
+        text_cache.set_text(keys[i], json.dumps({"text": text, "truncated": truncated}, ensure_ascii=False))
+
+    # 3) monta na ordem do upload
+    docs_text: List[str] = []
+    for i, (filename, _) in enumerate(accepted):
+        if i in errors:
+            # roda em background: um arquivo ilegível não derruba a ingestão inteira
+            warnings.append(f"{filename}: ignorado ({errors[i].__class__.__name__})")
+            continue
+
+        text, truncated = cached[i]
+        if truncated:
+            warnings.append(f"{filename}: truncado para {max_chars_per_doc} chars (PoC)")
+
+        if text:
+            docs_text.append(f"[FILE:{filename}]\n{text}")
 
     return docs_text, warnings
@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import asyncio
+import re
+import time
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Dict, Iterator, List
+
+from app.core.config import settings
+
+# Backend determinístico (LLM_BACKEND=fake) com a mesma interface usada do SDK
+# do Groq: client.chat.completions.create(..., stream=True|False). Simula a
+# latência do primeiro token e o intervalo entre tokens, para medir TTFB e
+# rodar a API sem chave nem rede.
+
+
+def _reply_for(messages: List[Dict[str, str]]) -> List[str]:
+    content = messages[-1]["content"] if messages else ""
+    # chat_service põe a pergunta no fim do payload
+    question = content.rsplit("[PERGUNTA_ATUAL]", 1)[-1].strip()
+    words = re.findall(r"\S+", question)[:40] or ["(vazio)"]
+    return ["Resposta", " simulada", " para:"] + [f" {w}" for w in words]
+
+
+def _response(model: str, tokens: List[str], max_tokens: int):
+    # como o provedor: passou de max_tokens, a resposta sai cortada com finish_reason "length"
+    finish = "length" if len(tokens) > max_tokens else "stop"
+    message = SimpleNamespace(role="assistant", content="".join(tokens[:max_tokens]))
+    return SimpleNamespace(model=model, choices=[SimpleNamespace(index=0, message=message, finish_reason=finish)])
+
+
+def _chunk(model: str, i: int, token: str | None):
+    delta = SimpleNamespace(role="assistant" if i == 0 else None, content=token)
+    finish = "stop" if token is None else None
+    return SimpleNamespace(model=model, choices=[SimpleNamespace(index=0, delta=delta, finish_reason=finish)])
+
+
+def _first_token_ms(messages: List[Dict[str, str]]) -> float:
+    # prefill proporcional ao tamanho do prompt (~4 caracteres por token)
+    prompt_tokens = sum(len(m.get("content") or "") // 4 + 1 for m in messages)
+    return settings.fake_llm_first_token_ms + prompt_tokens * settings.fake_llm_prompt_token_us / 1000
+
+
+def _total_ms(messages: List[Dict[str, str]], tokens: List[str]) -> float:
+    return _first_token_ms(messages) + settings.fake_llm_token_ms * (len(tokens) - 1)
+
+
+class _Completions:
+    def create(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.2,
+        max_tokens: int = 2048,
+        stream: bool = False,
+        **kwargs: Any,
+    ):
+        tokens = _reply_for(messages)
+        if stream:
+            return self._stream(model, tokens[:max_tokens], _first_token_ms(messages))
+        time.sleep(_total_ms(messages, tokens[:max_tokens]) / 1000)
+        return _response(model, tokens, max_tokens)
+
+    def _stream(self, model: str, tokens: List[str], first_ms: float) -> Iterator[Any]:
+        time.sleep(first_ms / 1000)
+        for i, tok in enumerate(tokens):
+            if i:
+                time.sleep(settings.fake_llm_token_ms / 1000)
+            yield _chunk(model, i, tok)
+        yield _chunk(model, len(tokens), None)
+
+
+class FakeGroq:
+    def __init__(self):
+        self.chat = SimpleNamespace(completions=_Completions())
+
+    def close(self):
+        pass
+
+
+class _AsyncStream:
+    # como o AsyncStream do SDK: iterável com `async for` e `await close()`
+    def __init__(self, model: str, tokens: List[str], first_ms: float):
+        self._gen = self._iter(model, tokens, first_ms)
+
+    async def _iter(self, model: str, tokens: List[str], first_ms: float) -> AsyncIterator[Any]:
+        await asyncio.sleep(first_ms / 1000)
+        for i, tok in enumerate(tokens):
+            if i:
+                await asyncio.sleep(settings.fake_llm_token_ms / 1000)
+            yield _chunk(model, i, tok)
+        yield _chunk(model, len(tokens), None)
+
+    def __aiter__(self):
+        return self._gen
+
+    async def close(self):
+        await self._gen.aclose()
+
+
+class _AsyncCompletions:
+    async def create(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.2,
+        max_tokens: int = 2048,
+        stream: bool = False,
+        **kwargs: Any,
+    ):
+        tokens = _reply_for(messages)
+        if stream:
+            return _AsyncStream(model, tokens[:max_tokens], _first_token_ms(messages))
+        await asyncio.sleep(_total_ms(messages, tokens[:max_tokens]) / 1000)
+        return _response(model, tokens, max_tokens)
+
+
+class AsyncFakeGroq:
+    def __init__(self):
+        self.chat = SimpleNamespace(completions=_AsyncCompletions())
+
+    async def close(self):
+        pass
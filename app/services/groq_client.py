@@ -1,15 +1,179 @@
 from __future__ import annotations
 
-from typing import List, Dict
-from groq import Groq
+import asyncio
+import random
+import threading
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+import httpx
+from groq import APIConnectionError, APIStatusError, AsyncGroq, Groq
 
 from app.core.config import settings
 
+T = TypeVar("T")
 
-def make_client() -> Groq:
+# ---------------------------------------------------------------------------
+# Registro de clientes (por processo)
+#
+# Um cliente síncrono e um assíncrono, criados no startup do app e
+# reaproveitados por todas as requisições: keep-alive, sessões TLS e pool de
+# conexões (LLM_POOL_SIZE) deixam de ser refeitos a cada chamada. Os retries
+# do SDK ficam desligados; o backoff com jitter abaixo é o único.
+# ---------------------------------------------------------------------------
+
+_RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class CompletionTruncated(RuntimeError):
+    """O modelo parou em max_tokens (finish_reason == "length"): a resposta está cortada."""
+
+_lock = threading.Lock()
+_client: Optional[Groq] = None
+_async_client: Optional[AsyncGroq] = None
+
+
+def _http_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=settings.llm_pool_size,
+        max_keepalive_connections=settings.llm_pool_size,
+        keepalive_expiry=30,
+    )
+
+
+def _http_timeout() -> httpx.Timeout:
+    return httpx.Timeout(settings.llm_timeout_s, connect=settings.llm_connect_timeout_s)
+
+
+def _require_key():
     if not settings.groq_api_key:
         raise RuntimeError("GROQ_API_KEY não definido no .env.")
-    return Groq(api_key=settings.groq_api_key)
+
+
+def make_client() -> Groq:
+    """Cria um cliente síncrono novo. Nas rotas, use `get_client()` (compartilhado)."""
+    if settings.llm_backend == "fake":
+        from app.services.fake_llm import FakeGroq
+
+        return FakeGroq()
+    _require_key()
+    return Groq(
+        api_key=settings.groq_api_key,
+        timeout=_http_timeout(),
+        max_retries=0,
+        http_client=httpx.Client(limits=_http_limits(), timeout=_http_timeout()),
+    )
+
+
+def make_async_client() -> AsyncGroq:
+    if settings.llm_backend == "fake":
+        from app.services.fake_llm import AsyncFakeGroq
+
+        return AsyncFakeGroq()
+    _require_key()
+    return AsyncGroq(
+        api_key=settings.groq_api_key,
+        timeout=_http_timeout(),
+        max_retries=0,
+        http_client=httpx.AsyncClient(limits=_http_limits(), timeout=_http_timeout()),
+    )
+
+
+def get_client() -> Groq:
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = make_client()
+    return _client
+
+
+def get_async_client() -> AsyncGroq:
+    global _async_client
+    if _async_client is None:
+        with _lock:
+            if _async_client is None:
+                _async_client = make_async_client()
+    return _async_client
+
+
+def init_clients() -> None:
+    """Chamado no startup. Sem GROQ_API_KEY, o erro aparece na primeira chamada (como antes)."""
+    if settings.llm_backend != "fake" and not settings.groq_api_key:
+        return
+    get_client()
+    get_async_client()
+
+
+async def close_clients() -> None:
+    global _client, _async_client
+    with _lock:
+        client, aclient = _client, _async_client
+        _client = _async_client = None
+    if client is not None and hasattr(client, "close"):
+        client.close()
+    if aclient is not None and hasattr(aclient, "close"):
+        await aclient.close()
+
+
+# ---------------------------------------------------------------------------
+# Retries com backoff exponencial e jitter
+# ---------------------------------------------------------------------------
+
+
+def _retry_delay(attempt: int, exc: Exception) -> Optional[float]:
+    """Espera antes da próxima tentativa, ou None se o erro não é transitório / acabaram as tentativas."""
+    if attempt >= settings.llm_max_retries:
+        return None
+    if isinstance(exc, APIStatusError):
+        if exc.status_code not in _RETRY_STATUS:
+            return None
+        retry_after = exc.response.headers.get("retry-after")
+        if retry_after:
+            try:
+                return min(float(retry_after), settings.llm_backoff_max_s)
+            except ValueError:
+                pass
+    elif not isinstance(exc, APIConnectionError):  # inclui APITimeoutError
+        return None
+    # full jitter: espalha os retries de muitos chamadores que falharam juntos
+    cap = min(settings.llm_backoff_max_s, settings.llm_backoff_base_s * (2**attempt))
+    return random.uniform(0, cap)
+
+
+def _with_retries(call: Callable[[], T]) -> T:
+    attempt = 0
+    while True:
+        try:
+            return call()
+        except Exception as e:
+            delay = _retry_delay(attempt, e)
+            if delay is None:
+                raise
+            time.sleep(delay)
+            attempt += 1
+
+
+async def _awith_retries(call: Callable[[], Awaitable[T]]) -> T:
+    attempt = 0
+    while True:
+        try:
+            return await call()
+        except Exception as e:
+            delay = _retry_delay(attempt, e)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+# ---------------------------------------------------------------------------
+# Completions
+# ---------------------------------------------------------------------------
+
+
+def _completion_kwargs(model: str, messages: List[Dict[str, str]], temperature: float, max_tokens: int) -> Dict[str, Any]:
+    return {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens}
 
 
 def chat_completion(
@@ -18,11 +182,42 @@ def chat_completion(
     messages: List[Dict[str, str]],
     temperature: float = 0.2,
     max_tokens: int = 2048,
+    require_complete: bool = False,
 ) -> str:
-    resp = client.chat.completions.create(
-        model=model,
-        messages=messages,
-        temperature=temperature,
-        max_tokens=max_tokens,
-    )
+    """`require_complete`: levanta CompletionTruncated em vez de devolver uma resposta cortada."""
+    kwargs = _completion_kwargs(model, messages, temperature, max_tokens)
+    resp = _with_retries(lambda: client.chat.completions.create(**kwargs))
+    if require_complete and resp.choices[0].finish_reason == "length":
+        raise CompletionTruncated(f"resposta cortada em max_tokens={max_tokens}")
     return (resp.choices[0].message.content or "").strip()
+
+
+async def achat_completion(
+    client: AsyncGroq,
+    model: str,
+    messages: List[Dict[str, str]],
+    temperature: float = 0.2,
+    max_tokens: int = 2048,
+) -> str:
+    kwargs = _completion_kwargs(model, messages, temperature, max_tokens)
+    resp = await _awith_retries(lambda: client.chat.completions.create(**kwargs))
+    return (resp.choices[0].message.content or "").strip()
+
+
+async def achat_completion_stream(
+    client: AsyncGroq,
+    model: str,
+    messages: List[Dict[str, str]],
+    temperature: float = 0.2,
+    max_tokens: int = 2048,
+) -> AsyncIterator[str]:
+    kwargs = _completion_kwargs(model, messages, temperature, max_tokens)
+    stream = await _awith_retries(lambda: client.chat.completions.create(**kwargs, stream=True))
+    try:
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        close = getattr(stream, "close", None)
+        if close is not None:
+            await close()
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+from typing import Any, Dict, List, Tuple
+
+from app.core.config import settings
+from app.core.governor import enforce_max_chars, estimate_tokens
+from app.services.groq_client import chat_completion, get_client
+
+# ---------------------------------------------------------------------------
+# Histórico do chat com orçamento de tokens
+#
+# Cada turno leva o resumo acumulado da conversa mais as mensagens ainda não
+# resumidas, da mais recente para a mais antiga, até HISTORY_TOKENS. A
+# contagem de tokens de cada mensagem é gravada junto com ela (estimativa
+# feita uma vez, no append). Quando as mensagens não resumidas passam do
+# orçamento, as mais antigas são dobradas no resumo (uma chamada ao LLM,
+# depois da resposta, fora do caminho crítico) até sobrar metade do
+# orçamento: o resumo é atualizado de tempos em tempos, não a cada turno.
+# Cada turno dobra no máximo HISTORY_FOLD_BATCHES lotes; o atraso de uma
+# conversa antiga ou importada é alcançado aos poucos, nos turnos seguintes.
+# ---------------------------------------------------------------------------
+
+_MESSAGE_OVERHEAD = 2  # "ROLE: " + quebra de linha
+_FOLDED_MESSAGE_CHARS = 4000  # mensagem enorme entra cortada no pedido de resumo
+
+
+def message_tokens(message: Dict[str, Any]) -> int:
+    tokens = message.get("tokens")
+    if tokens is None:  # mensagens gravadas antes da contagem
+        tokens = estimate_tokens(message.get("content") or "")
+    return int(tokens) + _MESSAGE_OVERHEAD
+
+
+def pack_history(messages: List[Dict[str, Any]], budget_tokens: int) -> List[Dict[str, Any]]:
+    """Sufixo mais recente de `messages` que cabe no orçamento (ordem cronológica).
+
+    A mensagem mais recente nunca fica de fora: se sozinha passar do orçamento, entra cortada.
+    """
+    packed: List[Dict[str, Any]] = []
+    used = 0
+    for m in reversed(messages):
+        cost = message_tokens(m)
+        if used + cost > budget_tokens:
+            if not packed and budget_tokens > _MESSAGE_OVERHEAD:
+                content = (m.get("content") or "")[: (budget_tokens - _MESSAGE_OVERHEAD) * 4]
+                packed.append({**m, "content": content + " […]", "tokens": None})
+            break
+        packed.append(m)
+        used += cost
+    packed.reverse()
+    return packed
+
+
+def _unsummarized(store, conversation_id: str) -> Tuple[Dict[str, Any], int]:
+    """(resumo, quantas mensagens ainda não entraram no resumo)."""
+    summary = store.get_conversation_summary(conversation_id) or {"summary": "", "covered": 0}
+    return summary, max(0, store.count_messages(conversation_id) - int(summary["covered"]))
+
+
+def load_history(store, conversation_id: str) -> Tuple[List[Dict[str, Any]], str]:
+    """(mensagens empacotadas, resumo) para o próximo turno."""
+    summary, pending = _unsummarized(store, conversation_id)
+    window = min(pending, max(1, settings.history_window_msgs))
+    messages = store.load_messages(conversation_id, offset=0, limit=window) if window else []
+    budget = max(0, settings.history_tokens - estimate_tokens(summary["summary"]))
+    return pack_history(messages, budget), summary["summary"]
+
+
+def _summarize(client, previous: str, messages: List[Dict[str, Any]]) -> str:
+    sys = "Você mantém o resumo de uma conversa. Seja fiel, conciso e não invente."
+    transcript = "\n".join(
+        f"{m.get('role', '').upper()}: {enforce_max_chars(m.get('content', ''), _FOLDED_MESSAGE_CHARS, 'message')}"
+        for m in messages
+    )
+    user = f"""
+Resumo atual da conversa:
+{previous or "(vazio)"}
+
+Mensagens novas a incorporar:
+{transcript}
+
+Devolva o resumo atualizado: fatos, decisões, pedidos do usuário e pendências, em tópicos curtos.
+""".strip()
+
+    return chat_completion(
+        client=client,
+        model=settings.chat_model,
+        messages=[{"role": "system", "content": sys}, {"role": "user", "content": user}],
+        temperature=0.1,
+        max_tokens=max(100, settings.history_summary_tokens),
+    )
+
+
+def _fold_batch(store, conversation_id: str) -> bool:
+    """Dobra no resumo um lote (até HISTORY_WINDOW_MSGS) das mensagens não resumidas mais antigas."""
+    summary, pending = _unsummarized(store, conversation_id)
+    if pending <= 0:
+        return False
+    window = max(1, settings.history_window_msgs)
+    # lote = as mais antigas ainda não resumidas (offset conta a partir da mais recente)
+    messages = store.load_messages(conversation_id, offset=max(0, pending - window), limit=min(pending, window))
+    if pending > window:
+        folded = messages  # atraso maior que a janela: o lote inteiro é anterior ao que o turno lê
+    else:
+        costs = [message_tokens(m) for m in messages]
+        if estimate_tokens(summary["summary"]) + sum(costs) <= settings.history_tokens:
+            return False
+        # mantém as mais recentes até metade do orçamento; o resto entra no resumo
+        keep, kept = len(messages), 0
+        while keep > 0 and kept + costs[keep - 1] <= settings.history_tokens // 2:
+            keep -= 1
+            kept += costs[keep]
+        folded = messages[:keep]
+    if not folded:
+        return False
+
+    text = _summarize(get_client(), summary["summary"], folded)
+    text = enforce_max_chars(text, settings.history_summary_tokens * 6, "summary")
+    covered = int(summary["covered"])
+    # `covered` só avança sobre mensagens que de fato foram resumidas
+    return store.save_conversation_summary(conversation_id, text, covered + len(folded), expected_covered=covered)
+
+
+def fold_history(store, conversation_id: str) -> bool:
+    """Dobra no resumo as mensagens mais antigas se as não resumidas passaram do orçamento.
+
+    Chamado depois de cada resposta; só chama o LLM quando há o que dobrar. Um atraso maior que
+    a janela (conversa antiga, resumo que falhou) é dobrado em lotes, no máximo
+    HISTORY_FOLD_BATCHES por turno.
+    """
+    folded = False
+    for _ in range(max(1, settings.history_fold_batches)):
+        if not _fold_batch(store, conversation_id):
+            break
+        folded = True
+    return folded
@@ -0,0 +1,274 @@
+from __future__ import annotations
+
+import hashlib
+import heapq
+import itertools
+import threading
+import time
+from contextlib import ExitStack
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from app.core.config import settings
+from app.infra.file_lock import file_lock
+from app.infra.job_store import TERMINAL, JobStore
+from app.services.document_loader import extract_texts_from_files
+from app.services.groq_client import get_client
+from app.services.ingestion_service import merge_into_matrix, synthesize_matrix
+from app.services.matrix_index import index_matrix
+from app.services.prompt_prefix import prefix_cache
+
+# ---------------------------------------------------------------------------
+# Fila de ingestão em background
+#
+# As rotas gravam a entrada do job e devolvem o id; um pool de INGEST_WORKERS
+# threads por processo executa os jobs, com no máximo
+# INGEST_TENANT_CONCURRENCY jobs simultâneos por tenant (slots por flock,
+# valem entre processos). O progresso é gravado a cada trecho sintetizado;
+# as parciais já prontas ficam no cache de sínteses, então um job retomado
+# após um restart só paga LLM pelos trechos que faltavam. Job sem slot livre
+# volta para a fila com atraso (fila única com prazo, sem thread por retry).
+# ---------------------------------------------------------------------------
+
+_RETRY_DELAY_S = 1.0
+_MERGE_ATTEMPTS = 3
+
+
+def preview(matrix: str) -> str:
+    return (matrix[:800] + "…") if len(matrix) > 800 else matrix
+
+
+class JobRunner:
+    def __init__(self, jobs: JobStore):
+        self.jobs = jobs
+        # heap de (pronto_em, seq, job_id): submit com atraso entra na mesma fila dos workers
+        self._queue: List[Tuple[float, int, str]] = []
+        self._queue_cond = threading.Condition()
+        self._seq = itertools.count()
+        self._store_factory: Optional[Callable[[], Any]] = None
+        self._queued: Set[str] = set()  # evita duplicatas na fila (sweeper + resubmissões)
+        self._threads: List[threading.Thread] = []
+        self._start_lock = threading.Lock()
+        self._queued_lock = threading.Lock()
+
+    def start(self, store_factory: Callable[[], Any]) -> None:
+        with self._start_lock:
+            if self._threads:
+                return
+            self._store_factory = store_factory
+            for i in range(max(1, settings.ingest_workers)):
+                t = threading.Thread(target=self._work, name=f"ingest-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+            t = threading.Thread(target=self._sweep, name="ingest-sweeper", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, job_id: str, delay_s: float = 0.0) -> None:
+        with self._queued_lock:
+            if job_id in self._queued:
+                return
+            self._queued.add(job_id)
+        with self._queue_cond:
+            heapq.heappush(self._queue, (time.monotonic() + delay_s, next(self._seq), job_id))
+            self._queue_cond.notify()
+
+    def _next(self) -> str:
+        with self._queue_cond:
+            while True:
+                now = time.monotonic()
+                if self._queue and self._queue[0][0] <= now:
+                    return heapq.heappop(self._queue)[2]
+                self._queue_cond.wait(self._queue[0][0] - now if self._queue else None)
+
+    # -- execução ----------------------------------------------------------
+
+    def _sweep(self):
+        # retoma jobs interrompidos (restart ou worker morto): o lock do job estará livre
+        while True:
+            for job in self.jobs.unfinished():
+                with file_lock(self.jobs.lock_path(job["id"]), blocking=False) as free:
+                    pass
+                if free:
+                    self.submit(job["id"])
+            try:
+                self.jobs.prune(settings.job_retention_days)
+            except Exception:
+                pass  # retenção é oportunista; tenta de novo na próxima varredura
+            time.sleep(max(1, settings.job_sweep_s))
+
+    def _work(self):
+        while True:
+            job_id = self._next()
+            with self._queued_lock:
+                self._queued.discard(job_id)
+            try:
+                self._try_run(job_id)
+            except Exception:
+                continue  # falhas do job já ficam registradas no próprio job
+
+    def _try_run(self, job_id: str):
+        job = self.jobs.get(job_id)
+        if job is None or job["status"] in TERMINAL:
+            return
+        with ExitStack() as stack:
+            if not stack.enter_context(file_lock(self.jobs.lock_path(job_id), blocking=False)):
+                return  # outro worker (talvez de outro processo) já está executando
+            if not self._enter_tenant_slot(stack, job["tenant_id"]):
+                self.submit(job_id, _RETRY_DELAY_S)
+                return
+            job = self.jobs.get(job_id)  # relê sob o lock
+            if job is None or job["status"] in TERMINAL:
+                return
+            try:
+                self._run(job)
+            finally:
+                job = self.jobs.get(job_id)
+                if job is not None and job["status"] in TERMINAL:
+                    self.jobs.drop_lock(job_id)
+
+    def _enter_tenant_slot(self, stack: ExitStack, tenant_id: str) -> bool:
+        for path in self.jobs.tenant_slot_paths(tenant_id, max(1, settings.ingest_tenant_concurrency)):
+            slot = ExitStack()
+            if slot.enter_context(file_lock(path, blocking=False)):
+                stack.enter_context(slot)
+                return True
+            slot.close()
+        return False
+
+    def _run(self, job: Dict[str, Any]):
+        job_id = job["id"]
+        store = self._store_factory()
+        try:
+            self.jobs.update(job_id, status="running", stage="extracting")
+            data = self.jobs.load_input(job_id)
+            agent = store.get_agent(job["tenant_id"], job["agent_id"])
+            if not agent:
+                raise KeyError("agent_not_found")
+
+            files = [(name, self.jobs.input_dir(job_id) / "files" / stored) for name, stored in data.get("files", [])]
+            file_docs, warnings = extract_texts_from_files(files)
+            texts = list(data.get("docs_text", []))
+            docs_text = texts + file_docs
+            urls = data.get("urls", [])
+            sources = _describe_sources(texts, file_docs, urls)
+
+            # delta sem matriz anterior é uma ingestão completa
+            current = store.get_agent_matrix(job["tenant_id"], job["agent_id"], int(agent["matrix_version"])) or ""
+            mode = "delta" if data.get("mode") == "delta" and current else "replace"
+            if mode == "delta":
+                # fonte com o mesmo conteúdo já incorporada desde a última ingestão completa: não entra de novo
+                known: Set[str] = set()
+                for rec in store.list_matrix_sources(job["tenant_id"], job["agent_id"]):
+                    if rec["mode"] == "replace":
+                        known.clear()
+                    known.update(src["sha256"] for src in rec["sources"] if src.get("sha256"))
+                doc_sources, url_sources = sources[: len(docs_text)], sources[len(docs_text) :]
+                keep = [i for i, src in enumerate(doc_sources) if src["sha256"] not in known]
+                warnings += [
+                    f"{src['name']}: já incorporado à matriz (ignorado)" for src in doc_sources if src["sha256"] in known
+                ]
+                docs_text = [docs_text[i] for i in keep]
+                sources = [doc_sources[i] for i in keep] + url_sources
+            if warnings:
+                self.jobs.update(job_id, warnings=warnings)
+
+            def progress(stage: str, done: int, total: int):
+                if stage == "mapping":
+                    self.jobs.update(job_id, stage=stage, chunks_done=done, chunks_total=total)
+                else:
+                    self.jobs.update(job_id, stage=stage)
+
+            stats: Dict[str, int] = {}
+            if mode == "delta" and not docs_text and not urls:
+                # nada novo: a matriz e a versão ficam como estão
+                version = int(agent["matrix_version"])
+                result = {
+                    "agent_id": job["agent_id"], "matrix_version": version, "matrix_preview": preview(current), "mode": mode
+                }
+                self.jobs.update(job_id, status="done", stage="done", matrix_version=version, result=result)
+                return
+
+            for attempt in range(_MERGE_ATTEMPTS):
+                if mode == "delta":
+                    matrix = merge_into_matrix(
+                        get_client(),
+                        specialty=agent["specialty"],
+                        matrix=current,
+                        docs_text=docs_text,
+                        urls=urls,
+                        stats=stats,
+                        progress=progress,
+                    )
+                else:
+                    matrix = synthesize_matrix(
+                        get_client(),
+                        specialty=agent["specialty"],
+                        docs_text=docs_text,
+                        urls=urls,
+                        stats=stats,
+                        progress=progress,
+                    )
+                    # cola avisos no começo da matriz (opcional)
+                    if warnings:
+                        matrix = "warnings:\n" + "\n".join([f"  - {w}" for w in warnings]) + "\n\n" + matrix
+
+                self.jobs.update(job_id, stage="saving")
+                try:
+                    updated = store.update_agent_matrix(
+                        job["tenant_id"],
+                        job["agent_id"],
+                        matrix,
+                        sources={"mode": mode, "job_id": job_id, "sources": sources},
+                        # delta foi calculado sobre esta versão: outra gravação no meio invalida o merge
+                        expected_version=int(agent["matrix_version"]) if mode == "delta" else None,
+                    )
+                    break
+                except KeyError as e:
+                    if e.args != ("matrix_version_conflict",) or attempt == _MERGE_ATTEMPTS - 1:
+                        raise
+                    # refaz o merge sobre a matriz nova; as parciais do delta vêm do cache
+                    agent = store.get_agent(job["tenant_id"], job["agent_id"])
+                    current = store.get_agent_matrix(job["tenant_id"], job["agent_id"], int(agent["matrix_version"])) or ""
+                    stats = {}
+
+            prefix_cache.drop_agent(job["agent_id"])  # prefixos da versão anterior não servem mais
+            try:
+                index_matrix(updated["matrix_sha"], matrix)  # índice de seções pronto para o chat
+            except Exception:
+                pass  # o chat monta o índice sob demanda
+            version = int(updated["matrix_version"])
+            result = {"agent_id": job["agent_id"], "matrix_version": version, "matrix_preview": preview(matrix), "mode": mode, **stats}
+            self.jobs.update(job_id, status="done", stage="done", matrix_version=version, result=result)
+        except Exception as e:
+            self.jobs.update(job_id, status="failed", stage="failed", error=str(e) or e.__class__.__name__)
+            raise
+        finally:
+            job = self.jobs.get(job_id)
+            if job is not None and job["status"] in TERMINAL:
+                self.jobs.drop_input(job_id)
+
+
+def _describe_sources(texts: List[str], file_docs: List[str], urls: List[str]) -> List[Dict[str, Any]]:
+    """Uma entrada por fonte (textos, arquivos, URLs), na ordem de docs_text + urls."""
+    sources: List[Dict[str, Any]] = []
+    for i, t in enumerate(texts):
+        sources.append({"kind": "text", "name": f"docs_text[{i}]", "sha256": _sha256(t), "chars": len(t)})
+    for d in file_docs:
+        # extract_texts_from_files devolve "[FILE:<nome>]\n<texto>"
+        head, _, body = d.partition("\n")
+        sources.append({"kind": "file", "name": head[len("[FILE:") : -1], "sha256": _sha256(body), "chars": len(body)})
+    for u in urls:
+        sources.append({"kind": "url", "name": u})  # conteúdo muda sem aviso: sempre rebuscada
+    return sources
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+job_store = JobStore()
+runner = JobRunner(job_store)
+
+
+def start_job_workers(store_factory: Callable[[], Any]) -> None:
+    runner.start(store_factory)
@@ -1,11 +1,27 @@
 from __future__ import annotations
 
-from typing import List
-import requests
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar
 
 from app.core.config import settings
 from app.core.governor import get_budgets, enforce_max_chars, guard_payload_size
+from app.infra.disk_cache import DiskCache
+from app.services.chunker import chunk_documents
 from app.services.groq_client import chat_completion
+from app.services.url_fetcher import fetch_urls_text
+
+T = TypeVar("T")
+R = TypeVar("R")
+# progress(etapa, feitos, total): chamado das threads do map/reduce
+Progress = Callable[[str, int, int], None]
+
+# Parciais do map endereçadas por (trecho, especialidade, modelo, versão do prompt):
+# reingestões só pagam LLM pelo conteúdo novo ou alterado.
+# Mudou o prompt de _map_summarize? Incremente a versão.
+MAP_PROMPT_VERSION = "1"
+partials_cache = DiskCache(Path("data") / "cache" / "partials", settings.synth_cache_bytes)
 
 
 def build_matrix_prompt(specialty: str) -> str:
@@ -27,22 +43,6 @@ Regras:
 """.strip()
 
 
-def fetch_url_text(url: str, timeout: int = 10, max_chars: int = 200000) -> str:
-    r = requests.get(url, timeout=timeout)
-    r.raise_for_status()
-    ct = (r.headers.get("content-type") or "").lower()
-    if "text" not in ct and "json" not in ct and "xml" not in ct and "html" not in ct:
-        return f"[conteúdo não-textual: {ct}]"
-    return r.text[:max_chars]
-
-
-def _chunk_text(text: str, max_chars: int) -> List[str]:
-    text = (text or "").strip()
-    if not text:
-        return []
-    return [text[i:i+max_chars] for i in range(0, len(text), max_chars)]
-
-
 def _map_summarize(client, specialty: str, chunk: str, temperature: float) -> str:
     sys = "Você é um motor de síntese fiel e metódico. Produza uma síntese curta e estruturada."
     user = f"""
@@ -68,6 +68,68 @@ Formato: YAML curto
     )
 
 
+def _parallel(fn: Callable[[T], R], items: List[T], name: str) -> List[R]:
+    # até SYNTH_MAP_CONCURRENCY chamadas em voo; resultados na ordem de `items`
+    workers = max(1, min(settings.synth_map_concurrency, len(items)))
+    if workers == 1:
+        return [fn(x) for x in items]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name) as pool:
+        return list(pool.map(fn, items))
+
+
+def _map_phase(
+    client,
+    specialty: str,
+    chunks: List[str],
+    temperature: float,
+    stats: Optional[Dict[str, int]] = None,
+    progress: Optional[Progress] = None,
+) -> List[str]:
+    """Map concorrente (até SYNTH_MAP_CONCURRENCY chamadas em voo), parciais na ordem dos trechos.
+
+    Trechos já sintetizados vêm do cache. Erros transitórios já são repetidos
+    pelo cliente (backoff); um trecho que ainda assim falhar vira `lacuna`
+    (não cacheada) em vez de abortar a ingestão inteira.
+    """
+    errors: List[Exception] = []
+    done = [0]
+    done_lock = threading.Lock()
+
+    def report():
+        if progress is not None:
+            with done_lock:
+                done[0] += 1
+                progress("mapping", done[0], len(chunks))
+
+    def summarize(item) -> Tuple[str, bool]:
+        result = _summarize(item)
+        report()
+        return result
+
+    def _summarize(item) -> Tuple[str, bool]:
+        i, chunk = item
+        key = DiskCache.key(chunk, specialty, settings.synth_model, MAP_PROMPT_VERSION, str(temperature))
+        cached = partials_cache.get_text(key)
+        if cached is not None:
+            return cached, True
+        try:
+            partial = _map_summarize(client, specialty, chunk, temperature)
+        except Exception as e:
+            errors.append(e)
+            return f"lacuna: trecho {i + 1}/{len(chunks)} não sintetizado ({e.__class__.__name__}).", False
+        partials_cache.set_text(key, partial)
+        return partial, False
+
+    results = _parallel(summarize, list(enumerate(chunks)), "synth-map")
+    if len(errors) == len(chunks):
+        raise errors[0]  # nada sintetizado: não sobrescreve a matriz com lacunas
+    if stats is not None:
+        hits = sum(1 for _, hit in results if hit)
+        stats["cache_hits"] = stats.get("cache_hits", 0) + hits
+        stats["cache_misses"] = stats.get("cache_misses", 0) + len(results) - hits
+    return [partial for partial, _ in results]
+
+
 def _reduce(client, specialty: str, partials: List[str], temperature: float) -> str:
     sys = "Você é um consolidado neuro-simbólico. Una sínteses sem duplicar e sem inventar."
     joined = "\n\n---\n\n".join(partials)
@@ -95,36 +157,193 @@ Sínteses parciais:
     )
 
 
-def synthesize_matrix(client, specialty: str, docs_text: List[str], urls: List[str], temperature: float = 0.2) -> str:
+def _approx_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+def _fan_in_groups(partials: List[str], token_budget: int, max_fan_in: int) -> List[List[str]]:
+    """Agrupa parciais contíguas até o orçamento de tokens (e no máximo `max_fan_in` por grupo)."""
+    groups: List[List[str]] = []
+    current: List[str] = []
+    used = 0
+    for p in partials:
+        cost = _approx_tokens(p)
+        if current and (used + cost > token_budget or len(current) >= max_fan_in):
+            groups.append(current)
+            current, used = [], 0
+        current.append(p)
+        used += cost
+    if current:
+        groups.append(current)
+    if len(groups) == len(partials) > 1:
+        # parciais maiores que meio orçamento: junta em pares para garantir progresso
+        groups = [partials[i:i + 2] for i in range(0, len(partials), 2)]
+    return groups
+
+
+def _tree_reduce(
+    client, specialty: str, partials: List[str], temperature: float, progress: Optional[Progress] = None
+) -> str:
+    """Reduce hierárquico: funde grupos em paralelo, nível a nível, até restar uma matriz.
+
+    O número de níveis cresce com log_{fan-in}(parciais), então a latência
+    cresce logaritmicamente com o corpus em vez de exigir truncamento.
+    """
     budgets = get_budgets()
+    level = partials
+    while True:
+        groups = _fan_in_groups(level, budgets.reduce_input_tokens, max(2, budgets.max_partials))
+        if progress is not None:
+            progress("reducing", len(level), len(groups))
+        if len(groups) == 1:
+            return _reduce(client, specialty, groups[0], temperature)
+        # grupo unitário sobe sem chamada ao LLM
+        level = _parallel(
+            lambda g: g[0] if len(g) == 1 else _reduce(client, specialty, g, temperature), groups, "synth-reduce"
+        )
 
-    urls_text: List[str] = []
-    for u in (urls or [])[:10]:
-        try:
-            urls_text.append(fetch_url_text(u))
-        except Exception as e:
-            urls_text.append(f"[falha ao baixar {u}] {e}")
 
-    parts: List[str] = [build_matrix_prompt(specialty)]
+def _prepare_chunks(
+    specialty: str,
+    docs_text: List[str],
+    urls: List[str],
+    stats: Optional[Dict[str, int]],
+    progress: Optional[Progress],
+) -> List[str]:
+    budgets = get_budgets()
+    if progress is not None:
+        progress("fetching", 0, len((urls or [])[:10]))
+
+    # em paralelo: a etapa leva o tempo da URL mais lenta, não a soma
+    urls_text = fetch_urls_text((urls or [])[:10])
+
+    parts: List[str] = []
 
     for t in docs_text or []:
-        t = enforce_max_chars(t, 120000, "doc_txt")
+        t = enforce_max_chars(t, budgets.max_corpus_chars, "doc_txt")
         if t.strip():
             parts.append("[DOC_TXT]\n" + t.strip())
 
     for t in urls_text:
-        t = enforce_max_chars(t, 120000, "url_txt")
+        t = enforce_max_chars(t, budgets.max_corpus_chars, "url_txt")
         if t.strip():
             parts.append("[URL_TXT]\n" + t.strip())
 
-    merged = "\n\n---\n\n".join(parts)
-    guard_payload_size(len(merged))
+    header = build_matrix_prompt(specialty)
+    guard_payload_size(len(header) + sum(len(p) for p in parts))
+
+    # trechos por documento, cortados em fronteiras estruturais e sem conteúdo repetido
+    chunks = chunk_documents(parts, budgets.chunk_chars, stats)
+    if chunks:
+        chunks[0] = header + "\n\n---\n\n" + chunks[0]
+    return chunks
 
-    merged = merged[:budgets.max_total_chars]
-    chunks = _chunk_text(merged, budgets.chunk_chars)[:budgets.max_partials]
 
+def synthesize_matrix(
+    client,
+    specialty: str,
+    docs_text: List[str],
+    urls: List[str],
+    temperature: float = 0.2,
+    stats: Optional[Dict[str, int]] = None,
+    progress: Optional[Progress] = None,
+) -> str:
+    """Map-reduce sobre os documentos.
+
+    `stats`, se informado, recebe cache_hits/cache_misses do map e os números do
+    chunker (trechos, linhas de boilerplate e parágrafos repetidos removidos); `progress`
+    é notificado a cada etapa e a cada trecho sintetizado.
+    """
+    chunks = _prepare_chunks(specialty, docs_text, urls, stats, progress)
     if not chunks:
         return "lacuna: nenhum texto válido para sintetizar."
 
-    partials = [_map_summarize(client, specialty, c, temperature) for c in chunks]
-    return _reduce(client, specialty, partials, temperature)
+    partials = _map_phase(client, specialty, chunks, temperature, stats, progress)
+    return _tree_reduce(client, specialty, partials, temperature, progress)
+
+
+# ---------------------------------------------------------------------------
+# Ingestão incremental (delta)
+#
+# Só as fontes novas passam pelo map; as parciais são reduzidas até caberem,
+# junto com a matriz atual, em uma chamada de merge. O custo cresce com o
+# tamanho do delta (mais a matriz, que já é compacta), não com o corpus.
+# ---------------------------------------------------------------------------
+
+
+MERGE_MAX_OUTPUT_TOKENS = 4096
+_MERGE_GROWTH_TOKENS = 900
+
+
+def _merge(client, specialty: str, matrix: str, partials: List[str], temperature: float) -> str:
+    sys = "Você é um consolidado neuro-simbólico. Atualize a matriz sem perder conteúdo e sem inventar."
+    joined = "\n\n---\n\n".join(partials)
+
+    user = f"""
+Core/Especialidade: {specialty}
+
+Incorpore as sínteses novas à Matriz atual e devolva a Matriz completa atualizada.
+Requisitos:
+- Manter tudo o que já existe na Matriz atual, salvo quando a síntese nova preencher uma 'lacuna'
+- Deduplicar termos e regras
+- Conflitos entre a Matriz atual e as sínteses novas: marcar como 'conflito' com as duas versões (não resolver inventando)
+- Conflitos e lacunas já marcados na Matriz atual: manter
+- Mesma estrutura (YAML ou JSON legível) da Matriz atual
+
+Matriz atual:
+{matrix}
+
+Sínteses novas:
+{joined}
+""".strip()
+
+    return chat_completion(
+        client=client,
+        model=settings.synth_model,
+        messages=[{"role": "system", "content": sys}, {"role": "user", "content": user}],
+        temperature=temperature,
+        # a matriz inteira volta na resposta: espaço para ela e para o que entrou
+        max_tokens=min(MERGE_MAX_OUTPUT_TOKENS, max(1800, _approx_tokens(matrix) + _MERGE_GROWTH_TOKENS)),
+        # matriz cortada perderia o final sem aviso: melhor falhar o job
+        require_complete=True,
+    )
+
+
+def merge_into_matrix(
+    client,
+    specialty: str,
+    matrix: str,
+    docs_text: List[str],
+    urls: List[str],
+    temperature: float = 0.2,
+    stats: Optional[Dict[str, int]] = None,
+    progress: Optional[Progress] = None,
+) -> str:
+    """Funde fontes novas em uma matriz existente (map só do delta + merge).
+
+    `stats` e `progress` como em `synthesize_matrix`, com a etapa extra "merging".
+    """
+    if _approx_tokens(matrix) + _MERGE_GROWTH_TOKENS > MERGE_MAX_OUTPUT_TOKENS:
+        # a resposta do merge não comportaria a matriz inteira
+        raise ValueError("matriz grande demais para ingestão delta; use uma ingestão completa (mode=replace)")
+    chunks = _prepare_chunks(specialty, docs_text, urls, stats, progress)
+    if not chunks:
+        raise ValueError("nenhum texto válido para incorporar")
+
+    partials = _map_phase(client, specialty, chunks, temperature, stats, progress)
+
+    # reduz o delta só até caber ao lado da matriz atual no orçamento do merge
+    budgets = get_budgets()
+    budget = max(budgets.reduce_input_tokens // 4, budgets.reduce_input_tokens - _approx_tokens(matrix))
+    level = partials
+    while len(level) > 1 and sum(_approx_tokens(p) for p in level) > budget:
+        groups = _fan_in_groups(level, budgets.reduce_input_tokens, max(2, budgets.max_partials))
+        if progress is not None:
+            progress("reducing", len(level), len(groups))
+        level = _parallel(
+            lambda g: g[0] if len(g) == 1 else _reduce(client, specialty, g, temperature), groups, "synth-reduce"
+        )
+
+    if progress is not None:
+        progress("merging", 0, 1)
+    return _merge(client, specialty, matrix, level, temperature)
@@ -0,0 +1,301 @@
+from __future__ import annotations
+
+import io
+import json
+import re
+import threading
+import unicodedata
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+from app.infra.disk_cache import DiskCache
+from app.infra.matrix_store import matrix_sha
+
+# ---------------------------------------------------------------------------
+# Índice de seções da matriz (contexto do chat)
+#
+# A matriz é cortada em seções pela estrutura (chaves YAML/JSON pela
+# indentação, títulos markdown), empacotadas até MATRIX_SECTION_CHARS; cada
+# seção guarda o caminho das chaves-pai para ser exibida fora de contexto.
+# Os pesos BM25 (termo x seção) ficam em arrays NumPy no formato CSC: a
+# pontuação de uma pergunta é uma soma vetorizada por termo da pergunta.
+# O índice é endereçado pelo sha da matriz (= uma versão): é montado quando
+# a ingestão grava a matriz, fica no cache em disco (entre processos) e num
+# LRU por processo.
+#
+# No modo "retrieval" (opt-in, por agente ou MATRIX_CONTEXT_MODE), cada
+# turno leva só as seções mais relevantes à pergunta até o orçamento de
+# tokens do agente; matriz que cabe inteira no orçamento vai inteira. O modo
+# "full", padrão, mantém o comportamento antigo.
+# ---------------------------------------------------------------------------
+
+INDEX_VERSION = "1"  # mudou o corte de seções, a tokenização ou os pesos? incremente
+BM25_K1 = 1.2
+BM25_B = 0.75
+_HEADER_LINE_CHARS = 200
+_LOADED_ENTRIES = 64
+
+_TERM = re.compile(r"\d+|\w{2,}")  # números de um dígito contam ("cláusula 7")
+_HEADING = re.compile(r"^(#{1,6})\s")
+_CLOSER = re.compile(r"^[\]\}\),]+$")  # "]," / "}" do JSON fecham o bloco anterior
+
+index_cache = DiskCache(Path("data") / "cache" / "matrix_index", settings.matrix_index_cache_bytes)
+
+_loaded: "OrderedDict[str, MatrixIndex]" = OrderedDict()
+_loaded_lock = threading.Lock()
+
+
+def _tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+def _terms(text: str) -> List[str]:
+    # sem acento e em minúsculas: "exceção" casa com "excecao"
+    text = unicodedata.normalize("NFKD", text.lower())
+    return _TERM.findall("".join(ch for ch in text if not unicodedata.combining(ch)))
+
+
+# -- seções ------------------------------------------------------------------
+
+
+def _indent(line: str) -> int:
+    return len(line) - len(line.lstrip(" \t"))
+
+
+def _heading_level(line: str) -> int:
+    m = _HEADING.match(line.lstrip())
+    return len(m.group(1)) if m else 0
+
+
+def _pieces(text: str, limit: int):
+    while len(text) > limit:
+        cut = text.rfind(" ", 0, limit)
+        cut = cut if cut > limit // 2 else limit
+        yield text[:cut]
+        text = text[cut:]
+    if text.strip():
+        yield text
+
+
+def _split(lines: List[str], header: str, limit: int, out: List[Tuple[str, str]]):
+    content = [l for l in lines if l.strip() and not _CLOSER.match(l.strip())]
+    if not content:
+        if any(l.strip() for l in lines):
+            out.append((header, "".join(lines)))
+        return
+    # um bloco começa em cada linha no menor nível de indentação do trecho;
+    # um título markdown leva junto tudo até o próximo título de nível igual ou maior
+    base = min(_indent(l) for l in content)
+    blocks: List[List[str]] = []
+    level = 0
+    for line in lines:
+        starts = bool(line.strip()) and _indent(line) <= base and not _CLOSER.match(line.strip())
+        h = _heading_level(line) if starts else 0
+        if not blocks or (starts and (not level or (h and h <= level))):
+            blocks.append([line])
+            level = h
+        else:
+            blocks[-1].append(line)
+
+    buf: List[str] = []
+    size = 0
+
+    def flush():
+        nonlocal buf, size
+        if buf:
+            out.append((header, "".join(buf)))
+            buf, size = [], 0
+
+    for block in blocks:
+        n = sum(len(l) for l in block)
+        if n > limit:
+            flush()
+            head, rest = block[0], block[1:]
+            if any(l.strip() for l in rest):
+                # desce um nível: a linha da chave vira parte do cabeçalho dos filhos
+                _split(rest, header + head[:_HEADER_LINE_CHARS].rstrip("\n") + "\n", limit, out)
+            else:
+                out.extend((header, p) for p in _pieces("".join(block), limit))
+            continue
+        if buf and (size + n > limit or block[0].lstrip().startswith("#")):
+            flush()
+        buf.extend(block)
+        size += n
+    flush()
+
+
+def split_sections(matrix: str, limit: int) -> List[Tuple[str, str]]:
+    """(cabeçalho, corpo) na ordem da matriz; cabeçalho = linhas das chaves-pai."""
+    out: List[Tuple[str, str]] = []
+    _split(matrix.splitlines(keepends=True), "", max(200, limit), out)
+    return [(h, b) for h, b in out if b.strip()]
+
+
+# -- índice ------------------------------------------------------------------
+
+
+@dataclass
+class MatrixIndex:
+    headers: List[str]
+    bodies: List[str]
+    vocab: Dict[str, int]
+    section_tokens: np.ndarray  # int32 (seções)
+    term_ptr: np.ndarray  # int64 (termos + 1): seções do termo j em rows[term_ptr[j]:term_ptr[j + 1]]
+    rows: np.ndarray  # int32
+    weights: np.ndarray  # float32, peso BM25 de (termo, seção)
+    total_tokens: int
+
+    @classmethod
+    def build(cls, matrix: str) -> "MatrixIndex":
+        sections = split_sections(matrix, settings.matrix_section_chars)
+        vocab: Dict[str, int] = {}
+        rows: List[int] = []
+        cols: List[int] = []
+        tf: List[int] = []
+        lengths: List[int] = []
+        for i, (header, body) in enumerate(sections):
+            counts = Counter(_terms(header + body))
+            for term, n in counts.items():
+                rows.append(i)
+                cols.append(vocab.setdefault(term, len(vocab)))
+                tf.append(n)
+            lengths.append(sum(counts.values()))
+
+        n_sections, n_terms = len(sections), len(vocab)
+        rows_a = np.asarray(rows, dtype=np.int32)
+        cols_a = np.asarray(cols, dtype=np.int64)
+        tf_a = np.asarray(tf, dtype=np.float32)
+        dl = np.asarray(lengths, dtype=np.float32)
+        df = np.bincount(cols_a, minlength=n_terms).astype(np.float32)
+        idf = np.log1p((n_sections - df + 0.5) / (df + 0.5))
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * dl / max(float(dl.mean()) if n_sections else 1.0, 1.0))
+        weights = idf[cols_a] * tf_a * (BM25_K1 + 1) / (tf_a + norm[rows_a]) if n_sections else tf_a
+
+        order = np.argsort(cols_a, kind="stable")
+        term_ptr = np.zeros(n_terms + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cols_a, minlength=n_terms), out=term_ptr[1:])
+        return cls(
+            headers=[h for h, _ in sections],
+            bodies=[b for _, b in sections],
+            vocab=vocab,
+            section_tokens=np.asarray([_tokens(h + b) for h, b in sections], dtype=np.int32),
+            term_ptr=term_ptr,
+            rows=rows_a[order],
+            weights=weights[order].astype(np.float32),
+            total_tokens=_tokens(matrix),
+        )
+
+    def scores(self, query: str) -> np.ndarray:
+        scores = np.zeros(len(self.bodies), dtype=np.float32)
+        for term in set(_terms(query)):
+            j = self.vocab.get(term)
+            if j is not None:
+                s, e = self.term_ptr[j], self.term_ptr[j + 1]
+                scores[self.rows[s:e]] += self.weights[s:e]  # uma seção aparece uma vez por termo
+        return scores
+
+    def select(self, query: str, budget_tokens: int) -> str:
+        """Seções mais relevantes à pergunta até o orçamento, na ordem original da matriz."""
+        scores = self.scores(query)
+        if scores.any():
+            ranked = [i for i in np.lexsort((np.arange(len(scores)), -scores)) if scores[i] > 0]
+        else:
+            ranked = list(range(len(scores)))  # nada casou: começo da matriz
+        chosen: List[int] = []
+        used = 0
+        for i in ranked:
+            cost = int(self.section_tokens[i])
+            if used + cost <= budget_tokens:
+                chosen.append(int(i))
+                used += cost
+
+        parts = ["[seções relevantes à pergunta; demais seções omitidas]\n"]
+        last, last_header = -2, None
+        for i in sorted(chosen):
+            if i != last + 1:
+                parts.append("…\n")
+            if self.headers[i] and (i != last + 1 or self.headers[i] != last_header):
+                parts.append(self.headers[i])
+            body = self.bodies[i]
+            parts.append(body if body.endswith("\n") else body + "\n")
+            last, last_header = i, self.headers[i]
+        return "".join(parts).rstrip("\n")
+
+    def to_bytes(self) -> bytes:
+        meta = {"headers": self.headers, "bodies": self.bodies, "vocab": list(self.vocab), "total_tokens": self.total_tokens}
+        buf = io.BytesIO()
+        np.savez(
+            buf,
+            meta=np.frombuffer(json.dumps(meta, ensure_ascii=False).encode("utf-8"), dtype=np.uint8),
+            section_tokens=self.section_tokens,
+            term_ptr=self.term_ptr,
+            rows=self.rows,
+            weights=self.weights,
+        )
+        return buf.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "MatrixIndex":
+        with np.load(io.BytesIO(data), allow_pickle=False) as z:
+            meta: Dict[str, Any] = json.loads(z["meta"].tobytes().decode("utf-8"))
+            return cls(
+                headers=meta["headers"],
+                bodies=meta["bodies"],
+                vocab={t: j for j, t in enumerate(meta["vocab"])},
+                section_tokens=z["section_tokens"],
+                term_ptr=z["term_ptr"],
+                rows=z["rows"],
+                weights=z["weights"],
+                total_tokens=int(meta["total_tokens"]),
+            )
+
+
+def get_index(sha: str, load_text: Callable[[], str]) -> MatrixIndex:
+    """Índice da matriz `sha`: LRU do processo, cache em disco ou montado a partir do texto."""
+    key = DiskCache.key(sha, INDEX_VERSION, str(settings.matrix_section_chars))
+    with _loaded_lock:
+        index = _loaded.get(key)
+        if index is not None:
+            _loaded.move_to_end(key)
+            return index
+
+    data = index_cache.get(key)
+    if data is not None:
+        index = MatrixIndex.from_bytes(data)
+    else:
+        index = MatrixIndex.build(load_text())
+        index_cache.set(key, index.to_bytes())
+
+    with _loaded_lock:
+        _loaded[key] = index
+        while len(_loaded) > _LOADED_ENTRIES:
+            _loaded.popitem(last=False)
+    return index
+
+
+def index_matrix(sha: str, matrix: str) -> MatrixIndex:
+    """Chamado quando a ingestão grava uma versão: o primeiro turno de chat já encontra o índice."""
+    return get_index(sha, lambda: matrix)
+
+
+def select_sections(agent: Dict[str, Any], load_text: Callable[[], str], query: str) -> Optional[str]:
+    """Seções da matriz para a pergunta, ou None quando o turno leva a matriz inteira."""
+    if (agent.get("context_mode") or settings.matrix_context_mode) != "retrieval":
+        return None
+    budget = agent.get("context_tokens") or settings.matrix_context_tokens
+    sha = agent.get("matrix_sha")
+    if not sha:
+        # agente sem ingestão ou de antes do histórico de matrizes
+        text = load_text()
+        if not text:
+            return None
+        sha, load_text = matrix_sha(text), (lambda: text)
+    index = get_index(sha, load_text)
+    if index.total_tokens <= budget:
+        return None
+    return index.select(query, budget)
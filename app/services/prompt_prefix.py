@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.services.chat_service import TEMPLATE_VERSION, PromptPrefix, compile_prefix
+from app.services.matrix_index import select_sections
+
+# ---------------------------------------------------------------------------
+# Prefixo compilado do prompt do chat
+#
+# Todo turno de um agente começa igual: a mensagem de sistema e, abrindo a
+# mensagem do usuário, o bloco da matriz. Esse prefixo (com a contagem de
+# tokens) é montado uma vez por (agente, versão da matriz, perfil, versão
+# do template) e fica num LRU por processo limitado em bytes; cada turno só
+# monta o sufixo (resumo, histórico, pergunta). Como o prefixo não muda
+# entre turnos, byte a byte, o cache de prompt do provedor também acerta.
+#
+# No modo "retrieval" com matriz maior que o orçamento o bloco depende da
+# pergunta e é montado a cada turno (não entra no cache). A versão está na
+# chave, então nova matriz nunca recebe prefixo velho; drop_agent, chamado
+# quando a matriz é gravada ou o agente é apagado, só libera a memória.
+# ---------------------------------------------------------------------------
+
+Key = Tuple[str, int, str, str]
+
+
+def _size(prefix: PromptPrefix) -> int:
+    return sys.getsizeof(prefix.system) + sys.getsizeof(prefix.matrix_block)
+
+
+class PrefixCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Key, PromptPrefix]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Key) -> Optional[PromptPrefix]:
+        with self._lock:
+            prefix = self._entries.get(key)
+            if prefix is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return prefix
+
+    def set(self, key: Key, prefix: PromptPrefix) -> None:
+        size = _size(prefix)
+        if size > self.max_bytes:
+            return  # matriz maior que o cache inteiro: monta a cada turno
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= _size(old)
+            self._entries[key] = prefix
+            self._size += size
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= _size(evicted)
+
+    def drop_agent(self, agent_id: str) -> None:
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == agent_id]:
+                self._size -= _size(self._entries.pop(key))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+            }
+
+
+prefix_cache = PrefixCache(settings.prompt_prefix_cache_bytes)
+
+
+def chat_prefix(agent: Dict[str, Any], profile: str, load_text: Callable[[], str], query: str) -> PromptPrefix:
+    """Prefixo do turno: do cache quando o turno leva a matriz inteira, senão com as seções da pergunta."""
+    selected = select_sections(agent, load_text, query)
+    if selected is not None:
+        return compile_prefix(agent, profile, selected)
+
+    key = (agent["id"], int(agent.get("matrix_version") or 0), profile, TEMPLATE_VERSION)
+    prefix = prefix_cache.get(key)
+    if prefix is None:
+        prefix = compile_prefix(agent, profile, load_text())
+        prefix_cache.set(key, prefix)
+    return prefix
@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import threading
+from pathlib import Path
+from typing import List, Optional
+
+import httpx
+
+from app.core.config import settings
+from app.infra.disk_cache import DiskCache
+
+# ---------------------------------------------------------------------------
+# Busca de URLs da ingestão
+#
+# As URLs de uma ingestão são baixadas em paralelo (URL_FETCH_CONCURRENCY)
+# por um httpx.AsyncClient compartilhado, que vive num event loop próprio em
+# background: a síntese roda em threads e só espera o lote. O corpo é lido em
+# streaming e a leitura para em URL_MAX_BYTES. Respostas com ETag ou
+# Last-Modified ficam no cache em disco e são revalidadas com GET
+# condicional: um 304 reaproveita o texto sem baixar a página de novo.
+# ---------------------------------------------------------------------------
+
+_TEXTUAL = ("text", "json", "xml", "html")
+
+url_cache = DiskCache(Path("data") / "cache" / "urls", settings.url_cache_bytes)
+
+_lock = threading.Lock()
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _ensure_loop() -> asyncio.AbstractEventLoop:
+    global _loop, _client
+    if _loop is None:
+        with _lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="url-fetcher", daemon=True).start()
+                _client = httpx.AsyncClient(
+                    follow_redirects=True,
+                    timeout=httpx.Timeout(settings.url_timeout_s),
+                    limits=httpx.Limits(max_connections=max(1, settings.url_fetch_concurrency) * 2),
+                )
+                _loop = loop
+    return _loop
+
+
+async def _fetch_one(sem: asyncio.Semaphore, url: str, max_chars: int) -> str:
+    key = url_cache.key("url", url)
+    hit = url_cache.get_text(key)
+    cached = json.loads(hit) if hit is not None else None
+    headers = {}
+    if cached:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+    async with sem:
+        async with _client.stream("GET", url, headers=headers) as r:
+            if r.status_code == 304 and cached:
+                return cached["text"][:max_chars]
+            r.raise_for_status()
+            ct = (r.headers.get("content-type") or "").lower()
+            if not any(t in ct for t in _TEXTUAL):
+                return f"[conteúdo não-textual: {ct}]"
+
+            body = bytearray()
+            async for block in r.aiter_bytes():
+                body += block[: settings.url_max_bytes - len(body)]
+                if len(body) >= settings.url_max_bytes:
+                    break  # fecha a conexão sem baixar o resto
+            text = body.decode(r.encoding or "utf-8", errors="replace")[:max_chars]
+            etag, last_modified = r.headers.get("etag"), r.headers.get("last-modified")
+            no_store = "no-store" in (r.headers.get("cache-control") or "").lower()
+
+    if (etag or last_modified) and not no_store:
+        url_cache.set_text(key, json.dumps({"etag": etag, "last_modified": last_modified, "text": text}, ensure_ascii=False))
+    return text
+
+
+async def _fetch_all(urls: List[str], max_chars: int) -> List[str]:
+    sem = asyncio.Semaphore(max(1, settings.url_fetch_concurrency))
+    results = await asyncio.gather(*(_fetch_one(sem, u, max_chars) for u in urls), return_exceptions=True)
+    return [
+        f"[falha ao baixar {u}] {r}" if isinstance(r, BaseException) else r
+        for u, r in zip(urls, results)
+    ]
+
+
+def fetch_urls_text(urls: List[str], max_chars: int = 200000) -> List[str]:
+    """Texto de cada URL, na ordem recebida; falhas viram um marcador no lugar do texto.
+
+    Bloqueia a thread chamadora (síntese); não chamar de dentro de um event loop.
+    """
+    if not urls:
+        return []
+    loop = _ensure_loop()
+    return asyncio.run_coroutine_threadsafe(_fetch_all(urls, max_chars), loop).result()
+
+
+def close_fetcher() -> None:
+    global _loop, _client
+    with _lock:
+        loop, client = _loop, _client
+        _loop = _client = None
+    if loop is None:
+        return
+    asyncio.run_coroutine_threadsafe(client.aclose(), loop).result(timeout=5)
+    loop.call_soon_threadsafe(loop.stop)
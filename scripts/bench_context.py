@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import socket
+import statistics
+import tempfile
+import threading
+import time
+
+import requests
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+_WORDS = (
+    "contrato prazo multa fornecedor pagamento fatura reembolso auditoria estoque entrega garantia cliente "
+    "aprovação orçamento cancelamento devolução imposto nota fiscal frete seguro licença renovação reajuste "
+    "desconto comissão inadimplência cobrança protesto rescisão aditivo vigência sigilo"
+).split()
+
+
+def _matrix(categories: int, rules: int, rng: random.Random) -> tuple[str, list[tuple[str, str]]]:
+    """Matriz YAML sintética e (pergunta, linha esperada) para uma regra de cada categoria."""
+    lines = ["glossario:"]
+    for i in range(categories):
+        lines.append(f"  - termo: termo_{i}\n    definicao: {' '.join(rng.choices(_WORDS, k=12))}")
+    lines.append("regras:")
+    probes = []
+    for c in range(categories):
+        lines.append(f"  categoria_{c}:")
+        for r in range(rules):
+            rule = f"regra_{c}_{r}: {' '.join(rng.choices(_WORDS, k=14))} em {rng.randint(1, 90)} dias"
+            lines.append(f"    - {rule}")
+            if r == rules // 2:
+                probes.append((f"Qual é a regra_{c}_{r} da categoria_{c}? Explique o prazo.", rule))
+    lines.append("processos:")
+    for p in range(categories // 4):
+        lines.append(f"  processo_{p}:\n" + "\n".join(f"    - passo {s}: {' '.join(rng.choices(_WORDS, k=8))}" for s in range(5)))
+    return "\n".join(lines) + "\n", probes
+
+
+def _pct(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Contexto do chat: matriz inteira x seções relevantes (tamanho do prompt e latência).")
+    parser.add_argument("--categories", type=int, default=120, help="categorias de regras na matriz sintética")
+    parser.add_argument("--rules", type=int, default=8, help="regras por categoria")
+    parser.add_argument("--questions", type=int, default=20)
+    parser.add_argument("--budget", type=int, default=2000, help="MATRIX_CONTEXT_TOKENS do agente")
+    parser.add_argument("--first-token-ms", type=int, default=200)
+    parser.add_argument("--prompt-token-us", type=int, default=100, help="prefill simulado por token de entrada")
+    args = parser.parse_args()
+
+    # antes de importar o app: as settings são lidas no import
+    os.environ["LLM_BACKEND"] = "fake"
+    os.environ["FAKE_LLM_FIRST_TOKEN_MS"] = str(args.first_token_ms)
+    os.environ["FAKE_LLM_TOKEN_MS"] = "1"
+    os.environ["FAKE_LLM_PROMPT_TOKEN_US"] = str(args.prompt_token_us)
+    os.environ.setdefault("JWT_SECRET", "bench-context-secret-" + "x" * 32)
+    os.chdir(tempfile.mkdtemp(prefix="bench_context_"))  # DATA_DIR é relativo ao cwd
+
+    import uvicorn
+    from app.api.deps import get_store
+    from app.core.security import create_access_token
+    from app.main import app
+    from app.services.chat_service import _completion_args
+    from app.services.matrix_index import get_index, index_matrix
+    from app.services.prompt_prefix import chat_prefix
+
+    rng = random.Random(7)
+    matrix, probes = _matrix(args.categories, args.rules, rng)
+    probes = rng.sample(probes, min(args.questions, len(probes)))
+
+    store = get_store()
+    admin = store.upsert_user("bench", "admin@bench", "pw", "admin")
+    agent = store.create_agent("bench", admin["id"], "bench", "Corporativo", "bench", "retrieval", args.budget)
+    agent = store.update_agent_matrix("bench", agent["id"], matrix)
+
+    t0 = time.perf_counter()
+    index = index_matrix(agent["matrix_sha"], matrix)
+    print(f"matriz       {len(matrix):>8} chars  {len(index.bodies)} seções  índice em {(time.perf_counter() - t0) * 1000:.1f} ms")
+
+    # tamanho do prompt e recall da seção certa, por modo
+    load = lambda: matrix
+    for mode in ("full", "retrieval"):
+        sizes, select_ms, found = [], [], 0
+        for question, expected in probes:
+            t0 = time.perf_counter()
+            prefix = chat_prefix({**agent, "context_mode": mode}, "ADMIN", load, question)
+            select_ms.append((time.perf_counter() - t0) * 1000)
+            found += expected in prefix.matrix_block
+            msgs = _completion_args(agent, [], question, "ADMIN", prefix=prefix)["messages"]
+            sizes.append(sum(len(m["content"]) for m in msgs))
+        print(
+            f"{mode:<10} prompt p50={statistics.median(sizes):>8.0f} chars (~{statistics.median(sizes) / 4:>6.0f} tokens)"
+            f"  seleção p50={statistics.median(select_ms):.2f} ms  regra certa no contexto {found}/{len(probes)}"
+        )
+    get_index(agent["matrix_sha"], load)  # já no LRU do processo
+
+    token = create_access_token({"tenant_id": "bench", "user_id": admin["id"], "email": admin["email"], "role": "admin"})
+    headers = {"Authorization": f"Bearer {token}"}
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    base = f"http://127.0.0.1:{port}"
+
+    with requests.Session() as s:
+        for mode in ("full", "retrieval"):
+            s.patch(f"{base}/agents/{agent['id']}", json={"context_mode": mode}, headers=headers).raise_for_status()
+            latencies = []
+            for question, _ in probes:
+                t0 = time.perf_counter()
+                s.post(f"{base}/chat", json={"agent_id": agent["id"], "message": question}, headers=headers).raise_for_status()
+                latencies.append((time.perf_counter() - t0) * 1000)
+            print(f"{mode:<10} /chat p50={statistics.median(latencies):>7.1f}ms  p95={_pct(latencies, 0.95):>7.1f}ms")
+    server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import tempfile
+import time
+from pathlib import Path
+
+_WORDS = "governança identidade selagem evento estado contrato auditoria risco política acesso dados registro".split()
+
+
+def _lines(rng: random.Random, n: int) -> list[str]:
+    return [" ".join(rng.choice(_WORDS) for _ in range(12)) for _ in range(n)]
+
+
+def _write_pdf(path: Path, rng: random.Random, pages: int, lines_per_page: int = 45):
+    # PDF mínimo escrito à mão (texto em Helvetica), sem dependências extras
+    objs: list[bytes] = [b"<< /Type /Catalog /Pages 2 0 R >>", b"", b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for _ in range(pages):
+        text = "".join(f"({line}) Tj T* " for line in _lines(rng, lines_per_page))
+        stream = f"BT /F1 10 Tf 12 TL 40 800 Td {text}ET".encode("latin-1", "replace")
+        objs.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objs)
+        objs.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>"
+            % content_id
+        )
+        kids.append(len(objs))
+    objs[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % k for k in kids), len(kids))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, obj in enumerate(objs, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % i + obj + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objs) + 1)
+    out += b"".join(b"%010d 00000 n \n" % o for o in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objs) + 1, xref)
+    path.write_bytes(bytes(out))
+
+
+def _write_docx(path: Path, rng: random.Random, paragraphs: int):
+    from docx import Document
+
+    doc = Document()
+    for line in _lines(rng, paragraphs):
+        doc.add_paragraph(line)
+    doc.save(str(path))
+
+
+def _write_xlsx(path: Path, rng: random.Random, rows: int):
+    from openpyxl import Workbook
+
+    wb = Workbook()
+    ws = wb.active
+    for i in range(rows):
+        ws.append([i] + rng.choice(_lines(rng, 1)).split()[:8])
+    wb.save(str(path))
+
+
+def build_corpus(root: Path, files: int, pdf_pages: int, seed: int = 7) -> list[tuple[str, Path]]:
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(files):
+        kind = ("pdf", "docx", "xlsx", "txt")[i % 4]
+        path = root / f"doc{i:03d}.{kind}"
+        if kind == "pdf":
+            _write_pdf(path, rng, pdf_pages)
+        elif kind == "docx":
+            _write_docx(path, rng, 1500)
+        elif kind == "xlsx":
+            _write_xlsx(path, rng, 500)
+        else:
+            path.write_text("\n".join(_lines(rng, 5000)), encoding="utf-8")
+        corpus.append((path.name, path))
+    return corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extração serial x pool de processos sobre um corpus misto.")
+    parser.add_argument("--files", type=int, default=16, help="arquivos no corpus (pdf/docx/xlsx/txt alternados)")
+    parser.add_argument("--pdf-pages", type=int, default=60, help="páginas por PDF")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="processos no pool")
+    parser.add_argument("--rounds", type=int, default=3, help="repetições (vale a melhor)")
+    args = parser.parse_args()
+
+    import app.services.document_loader as document_loader
+    from app.core.concurrency import shutdown_executors
+    from app.core.config import settings
+    from app.infra.disk_cache import DiskCache
+    from app.services.document_loader import extract_texts_from_files
+
+    root = Path(tempfile.mkdtemp(prefix="bench_extract_"))
+    corpus = build_corpus(root, args.files, args.pdf_pages)
+    size = sum(p.stat().st_size for _, p in corpus)
+    print(f"corpus: {len(corpus)} arquivos, {size / 1e6:.1f} MB, cpus={os.cpu_count()}")
+
+    limits = {"max_file_bytes": 1 << 30, "max_chars_per_doc": 1 << 30}
+    results = {}
+    for label, workers in (("serial", 0), (f"pool x{args.workers}", args.workers)):
+        settings.extract_workers = workers
+        if workers:
+            extract_texts_from_files(corpus[:1], **limits)  # sobe os workers fora da medição
+        best = float("inf")
+        for r in range(args.rounds):
+            # cache de texto vazio a cada rodada: mede o parsing, não o cache
+            document_loader.text_cache = DiskCache(root / f"cache-{workers}-{r}", 1 << 30)
+            t0 = time.perf_counter()
+            docs, warnings = extract_texts_from_files(corpus, **limits)
+            best = min(best, time.perf_counter() - t0)
+        assert not warnings, warnings
+        results[label] = (best, docs)
+        print(f"{label:<12} {best * 1000:>8.0f} ms  ({sum(len(d) for d in docs) / 1e6:.1f}M chars)")
+
+    # mesmo corpus de novo, com o cache da última rodada: nenhum parser roda
+    t0 = time.perf_counter()
+    cached_docs, _ = extract_texts_from_files(corpus, **limits)
+    print(f"{'cache hit':<12} {(time.perf_counter() - t0) * 1000:>8.0f} ms  {document_loader.text_cache.stats()}")
+    assert cached_docs == docs
+    shutdown_executors()
+
+    (serial, serial_docs), (pooled, pooled_docs) = results.values()
+    assert serial_docs == pooled_docs, "saída do pool difere da serial"
+    print(f"speedup: {serial / pooled:.2f}x (mesma saída, mesma ordem)")
+
+
+if __name__ == "__main__":
+    main()
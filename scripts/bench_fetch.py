@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import argparse
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+
+class _Server(ThreadingHTTPServer):
+    request_queue_size = 64  # o padrão (5) enfileira conexões simultâneas no accept
+
+
+class _Handler(BaseHTTPRequestHandler):
+    delay_s = 0.5
+    big_bytes = 50 * 1024 * 1024
+    counts = {"200": 0, "304": 0, "big_sent": 0}
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def _count(self, key: str, n: int = 1):
+        with self.lock:
+            self.counts[key] += n
+
+    def do_GET(self):
+        time.sleep(self.delay_s)
+        if self.path == "/big":
+            # corpo enorme em blocos: o fetcher deve parar no limite de bytes
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; charset=utf-8")
+            self.send_header("Content-Length", str(self.big_bytes))
+            self.end_headers()
+            block = b"x" * 65536
+            try:
+                for _ in range(self.big_bytes // len(block)):
+                    self.wfile.write(block)
+                    self._count("big_sent", len(block))
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            return
+
+        body = f"<html><body>página {self.path}: conteúdo estável</body></html>".encode("utf-8")
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self._count("304")
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self._count("200")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Busca de URLs: sequencial x concorrente, limite de bytes e GET condicional.")
+    parser.add_argument("--urls", type=int, default=10, help="URLs por ingestão")
+    parser.add_argument("--delay-ms", type=int, default=500, help="latência simulada de cada página")
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix="bench_fetch_"))  # cache em data/ relativo ao cwd
+    from app.core.config import settings
+    from app.services.url_fetcher import close_fetcher, fetch_urls_text, url_cache
+
+    _Handler.delay_s = args.delay_ms / 1000
+    server = _Server(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    urls = [f"{base}/p{i}" for i in range(args.urls)]
+
+    t0 = time.perf_counter()
+    for u in urls:  # caminho antigo: uma por vez, corpo inteiro
+        requests.get(u, timeout=10).text
+    print(f"sequencial   {(time.perf_counter() - t0) * 1000:>7.0f} ms")
+
+    t0 = time.perf_counter()
+    cold = fetch_urls_text(urls)
+    print(f"concorrente  {(time.perf_counter() - t0) * 1000:>7.0f} ms  (concorrência {settings.url_fetch_concurrency})")
+
+    t0 = time.perf_counter()
+    warm = fetch_urls_text(urls)
+    print(f"revalidação  {(time.perf_counter() - t0) * 1000:>7.0f} ms  respostas 304={_Handler.counts['304']}")
+    assert warm == cold and _Handler.counts["304"] == len(urls)
+
+    (big,) = fetch_urls_text([f"{base}/big"], max_chars=10**9)
+    time.sleep(0.2)
+    print(f"limite bytes lidos={len(big)} (URL_MAX_BYTES={settings.url_max_bytes}), servidor enviou ~{_Handler.counts['big_sent'] / 1e6:.1f} MB de {_Handler.big_bytes / 1e6:.0f} MB")
+    assert len(big) == settings.url_max_bytes
+    print("cache", url_cache.stats())
+
+    close_fetcher()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
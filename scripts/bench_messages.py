@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+
+from app.infra.message_log import MessageLog
+
+
+def _fill(log: MessageLog, n: int, batch: int = 10_000):
+    done = 0
+    while done < n:
+        size = min(batch, n - done)
+        log.append_many(
+            {"role": "user" if (done + i) % 2 == 0 else "assistant", "content": f"mensagem {done + i} " + "x" * 60,
+             "created_at": "2026-01-01T00:00:00"}
+            for i in range(size)
+        )
+        done += size
+
+
+def _timeit(fn, rounds: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - t0) / rounds * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark conversation tail reads (full read vs offset sidecar).")
+    parser.add_argument("--sizes", default="10,1000,100000,1000000", help="message counts, comma separated")
+    parser.add_argument("--limit", type=int, default=20, help="messages per read")
+    parser.add_argument("--rounds", type=int, default=200, help="reads per measurement")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{'messages':>9} {'full_read_us':>13} {'tail_us':>9} {'page_us':>9}")
+        for n in [int(x) for x in args.sizes.split(",") if x.strip()]:
+            log = MessageLog(Path(tmp), f"bench{n}")
+            _fill(log, n)
+
+            def full_read():
+                lines = log.path.read_text(encoding="utf-8").splitlines()
+                [json.loads(x) for x in lines[-args.limit:] if x.strip()]
+
+            full_us = _timeit(full_read, max(1, min(args.rounds, 2_000_000 // max(n, 1))))
+            tail_us = _timeit(lambda: log.read(0, args.limit), args.rounds)
+            page_us = _timeit(lambda: log.read(n // 2, args.limit), args.rounds)
+            print(f"{n:>9} {full_us:>13.1f} {tail_us:>9.1f} {page_us:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+
+def _seed_agents(n: int, tenants: int = 10) -> list[tuple[str, str]]:
+    keys: list[tuple[str, str]] = []
+    agents = []
+    for i in range(n):
+        tenant_id = f"t{i % tenants}"
+        agent_id = str(uuid.uuid4())
+        keys.append((tenant_id, agent_id))
+        agents.append(
+            {
+                "id": agent_id,
+                "tenant_id": tenant_id,
+                "owner_user_id": f"u{i % 97}",
+                "name": f"agent-{i}",
+                "type": "Corporativo",
+                "specialty": "bench",
+                "matrix": "x" * 256,
+                "matrix_version": 1,
+                "created_at": "2026-01-01T00:00:00",
+            }
+        )
+    Path("data").mkdir(exist_ok=True)
+    Path("data/agents.json").write_text(json.dumps({"agents": agents}), encoding="utf-8")
+    return keys
+
+
+def _timeit(fn, rounds: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - t0) / rounds * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark JsonStore lookups (parse+scan vs cached index).")
+    parser.add_argument("--sizes", default="1000,10000,50000", help="agent counts, comma separated")
+    parser.add_argument("--rounds", type=int, default=200, help="lookups per measurement")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)  # DATA_DIR é relativo ao cwd
+        from app.infra.collection import _load
+        from app.infra.json_store import JsonStore, AGENTS_PATH, _AGENTS
+
+        store = JsonStore()
+        print(f"{'agents':>8} {'scan_us':>12} {'cold_us':>12} {'cached_us':>10}")
+        for n in [int(x) for x in args.sizes.split(",") if x.strip()]:
+            keys = _seed_agents(n)
+            tenant_id, agent_id = keys[n // 2]
+
+            def scan():
+                agents = _load(AGENTS_PATH, {"agents": []})["agents"]
+                next(a for a in agents if a["tenant_id"] == tenant_id and a["id"] == agent_id)
+
+            scan_us = _timeit(scan, max(1, args.rounds // 20))
+            _AGENTS.invalidate()
+            cold_us = _timeit(lambda: store.get_agent(tenant_id, agent_id), 1)
+            cached_us = _timeit(lambda: store.get_agent(tenant_id, agent_id), args.rounds)
+            print(f"{n:>8} {scan_us:>12.1f} {cold_us:>12.1f} {cached_us:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import argparse
+import os
+import socket
+import statistics
+import tempfile
+import threading
+import time
+
+import requests
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tempo até o primeiro delta vs resposta completa em /chat/stream (LLM fake).")
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--first-token-ms", type=int, default=300)
+    parser.add_argument("--token-ms", type=int, default=20)
+    args = parser.parse_args()
+
+    # antes de importar o app: as settings são lidas no import
+    os.environ["LLM_BACKEND"] = "fake"
+    os.environ["FAKE_LLM_FIRST_TOKEN_MS"] = str(args.first_token_ms)
+    os.environ["FAKE_LLM_TOKEN_MS"] = str(args.token_ms)
+    os.environ.setdefault("JWT_SECRET", "bench-stream-secret-" + "x" * 32)
+    os.chdir(tempfile.mkdtemp(prefix="bench_stream_"))  # DATA_DIR é relativo ao cwd
+
+    import uvicorn
+    from app.api.deps import get_store
+    from app.core.security import create_access_token
+    from app.main import app
+
+    store = get_store()
+    admin = store.upsert_user("bench", "admin@bench", "pw", "admin")
+    agent = store.create_agent("bench", admin["id"], "bench", "Corporativo", "bench")
+    token = create_access_token({"tenant_id": "bench", "user_id": admin["id"], "email": admin["email"], "role": "admin"})
+    headers = {"Authorization": f"Bearer {token}"}
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    base = f"http://127.0.0.1:{port}"
+    prompt = " ".join(f"palavra{i}" for i in range(30))
+
+    first, total, deltas = [], [], 0
+    with requests.Session() as s:
+        for _ in range(args.rounds):
+            t0 = time.perf_counter()
+            with s.post(
+                f"{base}/chat/stream", json={"agent_id": agent["id"], "message": prompt}, headers=headers, stream=True
+            ) as r:
+                r.raise_for_status()
+                got_first = False
+                for line in r.iter_lines():
+                    if line == b"event: delta":
+                        deltas += 1
+                        if not got_first:
+                            first.append((time.perf_counter() - t0) * 1000)
+                            got_first = True
+            total.append((time.perf_counter() - t0) * 1000)
+
+        # desconexão no meio do stream: a resposta parcial deve ser gravada
+        with s.post(
+            f"{base}/chat/stream", json={"agent_id": agent["id"], "message": prompt}, headers=headers, stream=True
+        ) as r:
+            for line in r.iter_lines():
+                if line == b"event: delta":
+                    break
+        time.sleep((args.first_token_ms + 40 * args.token_ms) / 1000 + 0.5)
+
+    print(f"first delta  p50={statistics.median(first):>7.1f}ms  max={max(first):>7.1f}ms")
+    print(f"full reply   p50={statistics.median(total):>7.1f}ms  max={max(total):>7.1f}ms")
+    print(f"deltas/reply {deltas / args.rounds:.1f}")
+    convs = store.list_conversations("bench", agent_id=agent["id"], limit=args.rounds + 1)
+    last = store.load_last_messages(convs[0]["id"], limit=2)
+    print(f"after disconnect: {[m['role'] for m in last]} (assistant parcial: {len(last[-1]['content'])} chars)")
+    server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
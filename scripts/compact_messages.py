@@ -0,0 +1,15 @@
+from __future__ import annotations
+
+import argparse
+
+from app.infra.json_store import JsonStore
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seal, merge, expire and recycle message segments (JSON store).")
+    parser.parse_args()
+    print("OK:", JsonStore().compact_messages())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import argparse
+import os
+import socket
+import statistics
+import tempfile
+import threading
+import time
+
+import requests
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _probe(base: str, seconds: float) -> list[float]:
+    latencies: list[float] = []
+    deadline = time.perf_counter() + seconds
+    with requests.Session() as s:
+        while time.perf_counter() < deadline:
+            t0 = time.perf_counter()
+            s.get(f"{base}/health", timeout=30).raise_for_status()
+            latencies.append((time.perf_counter() - t0) * 1000)
+            time.sleep(0.01)
+    return latencies
+
+
+def _report(label: str, lat: list[float]):
+    lat = sorted(lat)
+    p95 = lat[int(len(lat) * 0.95) - 1] if len(lat) >= 20 else lat[-1]
+    print(f"{label:<14} n={len(lat):>5}  p50={statistics.median(lat):>7.1f}ms  p95={p95:>7.1f}ms  max={lat[-1]:>7.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latência do /health com e sem ingestões em andamento.")
+    parser.add_argument("--ingests", type=int, default=8, help="ingestões concorrentes")
+    parser.add_argument("--llm-ms", type=int, default=1500, help="duração simulada da síntese (chamada bloqueante)")
+    parser.add_argument("--seconds", type=float, default=5.0, help="duração de cada fase de medição")
+    args = parser.parse_args()
+
+    os.environ.setdefault("JWT_SECRET", "load-test-secret-" + "x" * 32)
+    os.chdir(tempfile.mkdtemp(prefix="load_health_"))  # DATA_DIR é relativo ao cwd
+
+    import uvicorn
+    import app.services.ingest_jobs as ingest_jobs
+    from app.api.deps import get_store
+    from app.core.security import create_access_token
+    from app.main import app
+
+    # síntese simulada: bloqueia a thread como o SDK síncrono do Groq faria
+    def fake_synthesize(client, specialty, docs_text, urls, **kwargs):
+        time.sleep(args.llm_ms / 1000)
+        return "MATRIX\n" + "\n".join(docs_text)
+
+    ingest_jobs.get_client = lambda: None
+    ingest_jobs.synthesize_matrix = fake_synthesize
+
+    store = get_store()
+    admin = store.upsert_user("load", "admin@load", "pw", "admin")
+    agent = store.create_agent("load", admin["id"], "load", "Corporativo", "load")
+    token = create_access_token({"tenant_id": "load", "user_id": admin["id"], "email": admin["email"], "role": "admin"})
+    headers = {"Authorization": f"Bearer {token}"}
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    base = f"http://127.0.0.1:{port}"
+
+    _report("idle", _probe(base, args.seconds))
+
+    stop = threading.Event()
+    done = [0]
+
+    def ingest_loop():
+        with requests.Session() as s:
+            while not stop.is_set():
+                r = s.post(
+                    f"{base}/agents/{agent['id']}/ingest",
+                    json={"docs_text": ["doc " * 100], "urls": []},
+                    headers=headers,
+                    timeout=120,
+                )
+                r.raise_for_status()
+                # a ingestão vira job: espera terminar antes de submeter a próxima
+                while s.get(f"{base}/jobs/{r.json()['id']}", headers=headers, timeout=30).json()["status"] not in ("done", "failed"):
+                    time.sleep(0.05)
+                done[0] += 1
+
+    workers = [threading.Thread(target=ingest_loop, daemon=True) for _ in range(args.ingests)]
+    for w in workers:
+        w.start()
+    time.sleep(0.2)
+    _report(f"{args.ingests} ingests", _probe(base, args.seconds))
+    stop.set()
+    for w in workers:
+        w.join()
+    print(f"ingests concluídas: {done[0]}")
+    server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+
+from app.core.config import settings
+from app.infra.json_store import JsonStore
+from app.infra.sqlite_store import SqliteStore
+
+
+def main():
+    parser = argparse.ArgumentParser(description="One-shot migration of the data/ JSON layout into SQLite.")
+    parser.add_argument("--db", default=settings.sqlite_path, help="target SQLite file")
+    args = parser.parse_args()
+
+    source = JsonStore()
+    target = SqliteStore(args.db)
+    data = source.dump()
+
+    with target.conn as c:
+        c.executemany(
+            """
+            INSERT OR REPLACE INTO users (id, tenant_id, email, password_hash, role, created_at, updated_at)
+            VALUES (:id, :tenant_id, :email, :password_hash, :role, :created_at, :updated_at)
+            """,
+            [{"role": "user", "updated_at": None, **u} for u in data["users"]],
+        )
+        c.executemany(
+            """
+            INSERT OR REPLACE INTO agents
+                (id, tenant_id, owner_user_id, name, type, specialty, matrix_version, matrix_sha,
+                 context_mode, context_tokens, created_at, updated_at)
+            VALUES
+                (:id, :tenant_id, :owner_user_id, :name, :type, :specialty, :matrix_version, :matrix_sha,
+                 :context_mode, :context_tokens, :created_at, :updated_at)
+            """,
+            [
+                {"matrix_version": 0, "matrix_sha": None, "context_mode": None, "context_tokens": None, "updated_at": None, **a}
+                for a in data["agents"]
+            ],
+        )
+        c.executemany(
+            """
+            INSERT OR REPLACE INTO conversations (id, tenant_id, user_id, agent_id, created_at)
+            VALUES (:id, :tenant_id, :user_id, :agent_id, :created_at)
+            """,
+            data["conversations"],
+        )
+        c.executemany(
+            """
+            INSERT OR REPLACE INTO matrix_sources (id, tenant_id, agent_id, version, mode, job_id, sources, created_at)
+            VALUES (:id, :tenant_id, :agent_id, :version, :mode, :job_id, :sources, :created_at)
+            """,
+            [{"job_id": None, **r, "sources": json.dumps(r.get("sources", []), ensure_ascii=False)} for r in data["matrix_sources"]],
+        )
+        c.executemany(
+            """
+            INSERT OR REPLACE INTO matrix_versions (tenant_id, agent_id, version, sha256, chars, created_at)
+            VALUES (:tenant_id, :agent_id, :version, :sha256, :chars, :created_at)
+            """,
+            data["matrix_versions"],
+        )
+        c.executemany(
+            """
+            INSERT OR REPLACE INTO conversation_summaries (conversation_id, summary, covered, updated_at)
+            VALUES (:id, :summary, :covered, :updated_at)
+            """,
+            data["conversation_summaries"],
+        )
+
+    # blobs das matrizes: deltas refeitos no banco, na ordem das versões (o sha não muda)
+    for a in data["agents"]:
+        base = None
+        for rec in source.list_matrix_versions(a["tenant_id"], a["id"]):
+            base = target.matrices.put(source.get_agent_matrix(a["tenant_id"], a["id"], rec["version"]), base_sha=base)
+        current = source.get_agent_matrix(a["tenant_id"], a["id"])
+        if current and not a.get("matrix_sha"):
+            # agente de antes do histórico: o texto ainda estava no registro
+            sha = target.matrices.put(current, base_sha=base)
+            with target.conn as c:
+                c.execute("UPDATE agents SET matrix_sha = ? WHERE id = ?", (sha, a["id"]))
+                c.execute(
+                    """
+                    INSERT OR IGNORE INTO matrix_versions (tenant_id, agent_id, version, sha256, chars, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    """,
+                    (a["tenant_id"], a["id"], a["matrix_version"], sha, len(current), a.get("updated_at") or a["created_at"]),
+                )
+
+    # mensagens (cauda quente + segmentos selados); conversas já migradas são puladas (re-execução idempotente)
+    migrated = skipped = messages = 0
+    for conv_id in source.conversation_ids_with_messages():
+        with target.conn as c:
+            if c.execute("SELECT 1 FROM messages WHERE conversation_id = ? LIMIT 1", (conv_id,)).fetchone():
+                skipped += 1
+                continue
+            rows = source.load_last_messages(conv_id, limit=sys.maxsize)
+            c.executemany(
+                "INSERT INTO messages (conversation_id, role, content, tokens, created_at) VALUES (?, ?, ?, ?, ?)",
+                [(conv_id, m.get("role", ""), m.get("content", ""), m.get("tokens"), m.get("created_at", "")) for m in rows],
+            )
+        migrated += 1
+        messages += len(rows)
+
+    print(
+        "OK:",
+        {
+            "db": args.db,
+            "users": len(data["users"]),
+            "agents": len(data["agents"]),
+            "conversations": len(data["conversations"]),
+            "matrix_sources": len(data["matrix_sources"]),
+            "matrix_versions": len(data["matrix_versions"]),
+            "conversation_summaries": len(data["conversation_summaries"]),
+            "message_conversations": migrated,
+            "messages": messages,
+            "skipped_conversations": skipped,
+        },
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import argparse
+import multiprocessing as mp
+import os
+import tempfile
+import time
+from pathlib import Path
+
+
+def _worker(root: str, n_ops: int, agent: tuple[str, str], shared_cid: str, start, results):
+    os.chdir(root)  # DATA_DIR é relativo ao cwd
+    from app.infra.json_store import JsonStore
+
+    store = JsonStore()
+    tenant_id, agent_id = agent
+    start.wait()
+    t0 = time.perf_counter()
+    for i in range(n_ops):
+        store.create_conversation(tenant_id, f"u{os.getpid()}", agent_id)
+        store.append_message(shared_cid, "user", f"{os.getpid()}:{i}")
+        store.update_agent_matrix(tenant_id, agent_id, f"{os.getpid()}:{i}")
+    results.put(time.perf_counter() - t0)
+
+
+def _verify(root: str, agent: tuple[str, str], shared_cid: str, results):
+    os.chdir(root)
+    from app.infra.json_store import JsonStore
+
+    store = JsonStore()
+    tenant_id, agent_id = agent
+    results.put(
+        {
+            "conversations": len(store.list_conversations(tenant_id, agent_id=agent_id, limit=10**9)),
+            "messages": store.count_messages(shared_cid),
+            "matrix_version": store.get_agent(tenant_id, agent_id)["matrix_version"],
+        }
+    )
+
+
+def _run(ctx, workers: int, n_ops: int) -> tuple[float, dict]:
+    with tempfile.TemporaryDirectory() as root:
+        os.chdir(root)
+        from app.infra.json_store import JsonStore
+
+        store = JsonStore()
+        agent = store.create_agent("t0", "u0", "stress", "Corporativo", "stress")
+        shared = store.create_conversation("t0", "u0", agent["id"])
+        key = ("t0", agent["id"])
+
+        start, results = ctx.Event(), ctx.Queue()
+        procs = [
+            ctx.Process(target=_worker, args=(root, n_ops, key, shared["id"], start, results)) for _ in range(workers)
+        ]
+        for p in procs:
+            p.start()
+        time.sleep(0.5)  # deixa os processos importarem o app antes de liberar
+        t0 = time.perf_counter()
+        start.set()
+        for _ in procs:
+            results.get()
+        elapsed = time.perf_counter() - t0
+        for p in procs:
+            p.join()
+            if p.exitcode:
+                raise SystemExit(f"worker saiu com código {p.exitcode}")
+
+        verifier = ctx.Process(target=_verify, args=(root, key, shared["id"], results))
+        verifier.start()
+        found = results.get()
+        verifier.join()
+        os.chdir(Path(__file__).resolve().parent.parent)
+        return elapsed, found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stress multi-processo do JsonStore: zero escritas perdidas e writes/s.")
+    parser.add_argument("--workers", default="1,4,16", help="processos concorrentes, separados por vírgula")
+    parser.add_argument("--ops", type=int, default=200, help="iterações por processo (3 escritas cada)")
+    parser.add_argument("--mode", default="log", choices=["log", "snapshot"], help="JSON_STORE_MODE")
+    parser.add_argument("--fsync", type=int, default=1, help="STORE_FSYNC")
+    parser.add_argument("--segment", type=int, default=100, help="MSG_SEGMENT_MESSAGES (exercita a selagem)")
+    args = parser.parse_args()
+
+    # herdado pelos processos filhos (spawn reimporta as settings)
+    os.environ["JSON_STORE_MODE"] = args.mode
+    os.environ["STORE_FSYNC"] = str(args.fsync)
+    os.environ["MSG_SEGMENT_MESSAGES"] = str(args.segment)
+    os.environ["MSG_COMPACT_INTERVAL_S"] = "0"
+    ctx = mp.get_context("spawn")
+
+    print(f"{'workers':>8} {'writes':>8} {'secs':>8} {'writes/s':>10}  result")
+    failed = False
+    for workers in [int(x) for x in args.workers.split(",") if x.strip()]:
+        elapsed, found = _run(ctx, workers, args.ops)
+        expected = workers * args.ops
+        # +1: a conversa compartilhada criada antes dos workers
+        ok = found == {"conversations": expected + 1, "messages": expected, "matrix_version": expected}
+        failed |= not ok
+        writes = 3 * expected
+        status = "ok" if ok else f"LOST {found} (esperado {expected})"
+        print(f"{workers:>8} {writes:>8} {elapsed:>8.2f} {writes / elapsed:>10.0f}  {status}")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
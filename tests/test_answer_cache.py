@@ -0,0 +1,29 @@
+import pytest
+
+from app.core.config import settings
+from app.services.answer_cache import answer_key
+from app.services.chat_service import compile_prefix
+
+AGENT = {"id": "a", "name": "ag", "specialty": "sp", "type": "Corporativo", "matrix_version": 1}
+
+
+@pytest.fixture(autouse=True)
+def enabled(monkeypatch):
+    monkeypatch.setattr(settings, "answer_cache", True)
+
+
+def _key(matrix="regras:\n  - a", prompt="Qual o prazo?", tenant="t"):
+    return answer_key(tenant, AGENT, compile_prefix(AGENT, "ADMIN", matrix), [], "", prompt)
+
+
+def test_question_is_normalized():
+    assert _key(prompt="Qual o prazo?") == _key(prompt="  qual  o PRAZO? ")
+
+
+def test_matrix_is_hashed_verbatim():
+    assert _key(matrix="regras:\n  - a") != _key(matrix="regras:\n    - a")
+    assert _key(matrix="sigla: CPF") != _key(matrix="sigla: cpf")
+
+
+def test_tenants_never_share_keys():
+    assert _key(tenant="t1") != _key(tenant="t2")
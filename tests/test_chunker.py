@@ -0,0 +1,50 @@
+from app.services.chunker import chunk_documents
+
+_CLAUSE = (
+    "O fornecedor deve entregar os itens do pedido de compra no almoxarifado central dentro do "
+    "prazo de {prazo} dias corridos contados da assinatura do contrato, {neg}sob pena de multa diária "
+    "de meio por cento sobre o valor total do pedido em atraso."
+)
+
+
+def _paragraphs(*texts):
+    stats = {}
+    out = "\n\n".join(chunk_documents(["[DOC_TXT]\n" + "\n\n".join(texts)], 12000, stats))
+    return out, stats
+
+
+def test_clauses_differing_only_in_a_value_both_survive():
+    a, b = _CLAUSE.format(prazo=30, neg=""), _CLAUSE.format(prazo=60, neg="")
+    out, _ = _paragraphs(a, b)
+    assert a in out and b in out
+
+
+def test_clauses_differing_only_in_a_negation_both_survive():
+    a, b = _CLAUSE.format(prazo=30, neg=""), _CLAUSE.format(prazo=30, neg="não ")
+    out, _ = _paragraphs(a, b)
+    assert a in out and b in out
+
+
+def test_repeated_clause_is_still_removed():
+    a = _CLAUSE.format(prazo=30, neg="")
+    out, _ = _paragraphs(a, a.upper().replace(" ", "  "))
+    assert out.count("almoxarifado") + out.count("ALMOXARIFADO") == 1
+
+
+def _pdf(*pages):
+    doc = "[FILE:contrato.pdf]\n" + "\n".join(f"[PDF:page={i}]\n{body}" for i, body in enumerate(pages, 1))
+    stats = {}
+    return "\n\n".join(chunk_documents([doc], 12000, stats)), stats
+
+
+def test_short_lines_differing_in_a_number_on_different_pages_all_survive():
+    pages = [
+        f"ACME Ltda — Contrato\nMulta por atraso: {multa}\nPrazo de entrega: {prazo} dias\nPágina {i} de 3"
+        for i, (multa, prazo) in enumerate([("2%", 30), ("5%", 60), ("10%", 90)], 1)
+    ]
+    out, stats = _pdf(*pages)
+    for value in ("2%", "5%", "10%", "30 dias", "60 dias", "90 dias"):
+        assert value in out
+    # cabeçalho idêntico e numeração de página continuam saindo
+    assert out.count("ACME Ltda") == 1 and out.count("Página") == 1
+    assert stats["boilerplate_lines_removed"] == 4
@@ -0,0 +1,30 @@
+from app.core.config import settings
+from app.infra.collection import Collection
+
+
+def _collection(path):
+    return Collection("items", path, {"id": lambda r: r["id"]}, {}, mode="log")
+
+
+def test_reload_racing_compaction_sees_every_record(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "store_fsync", False)
+    path = tmp_path / "items.json"
+    writer = _collection(path)
+    for i in range(5):
+        writer.put({"id": f"r{i}"})
+
+    reader = _collection(path)
+    replay = reader._replay
+    raced = []
+
+    def replay_racing_compaction(p, offset):
+        # snapshot velho já lido; a compactação dobra o log e apaga o congelado
+        if p == reader.sealed_path and not raced:
+            raced.append(p)
+            writer._compact()
+        return replay(p, offset)
+
+    monkeypatch.setattr(reader, "_replay", replay_racing_compaction)
+    reader.refresh()
+    assert raced
+    assert sorted(reader.records) == [f"r{i}" for i in range(5)]
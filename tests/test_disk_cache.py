@@ -0,0 +1,12 @@
+from app.infra.disk_cache import DiskCache
+
+
+def test_overwriting_a_key_does_not_inflate_the_size(tmp_path):
+    cache = DiskCache(tmp_path, 1 << 20)
+    cache.set("k" * 64, b"x" * 1000)
+    cache.set("o" * 64, b"y")
+    size = cache.stats()["bytes"]
+    for _ in range(50):
+        cache.set("k" * 64, b"x" * 1000)
+    assert cache.stats()["bytes"] == size == cache._scan_size()
+    assert cache.get("o" * 64) == b"y"  # nada despejado antes da hora
@@ -0,0 +1,67 @@
+import pytest
+
+from app.core.config import settings
+from app.services import history
+
+
+class _Store:
+    """Só o que history.py usa do store: mensagens (load_messages conta a partir da mais recente) e resumo."""
+
+    def __init__(self, n: int):
+        self.messages = [{"role": "user", "content": f"mensagem {i} " + "palavra " * 20} for i in range(n)]
+        self.summary = None
+
+    def count_messages(self, conversation_id):
+        return len(self.messages)
+
+    def load_messages(self, conversation_id, offset=0, limit=20):
+        end = len(self.messages) - offset
+        return self.messages[max(0, end - limit) : end]
+
+    def get_conversation_summary(self, conversation_id):
+        return self.summary
+
+    def save_conversation_summary(self, conversation_id, summary, covered, expected_covered):
+        if (self.summary or {"covered": 0})["covered"] != expected_covered:
+            return False
+        self.summary = {"id": conversation_id, "summary": summary, "covered": covered}
+        return True
+
+
+@pytest.fixture
+def summarized(monkeypatch):
+    seen = []
+
+    def fake_summarize(client, previous, messages):
+        seen.extend(m["content"] for m in messages)
+        return f"resumo de {len(seen)}"
+
+    monkeypatch.setattr(history, "_summarize", fake_summarize)
+    monkeypatch.setattr(history, "get_client", lambda: None)
+    monkeypatch.setattr(settings, "history_tokens", 300)
+    monkeypatch.setattr(settings, "history_window_msgs", 10)
+    monkeypatch.setattr(settings, "history_fold_batches", 2)
+    return seen
+
+
+def test_fold_catches_up_backlog_beyond_window(summarized):
+    store = _Store(55)
+    assert history.fold_history(store, "c")
+    # um turno faz no máximo HISTORY_FOLD_BATCHES chamadas de resumo
+    assert store.summary["covered"] == 2 * 10
+    while history.fold_history(store, "c"):
+        pass
+    covered = store.summary["covered"]
+    # toda mensagem contada como resumida passou de fato pelo resumo, na ordem
+    assert summarized == [m["content"] for m in store.messages[:covered]]
+    assert covered > 55 - 10
+    packed, summary = history.load_history(store, "c")
+    assert summary == store.summary["summary"]
+    assert packed and packed[-1] == store.messages[-1]
+    assert sum(history.message_tokens(m) for m in packed) <= 300
+
+
+def test_no_fold_under_budget(summarized):
+    store = _Store(3)
+    assert not history.fold_history(store, "c")
+    assert store.summary is None and summarized == []
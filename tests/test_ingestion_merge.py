@@ -0,0 +1,29 @@
+import pytest
+
+from app.core.config import settings
+from app.services import fake_llm
+from app.services.fake_llm import FakeGroq
+from app.services.groq_client import CompletionTruncated
+from app.services.ingestion_service import _merge, merge_into_matrix
+
+
+@pytest.fixture(autouse=True)
+def no_latency(monkeypatch):
+    monkeypatch.setattr(settings, "fake_llm_first_token_ms", 0)
+    monkeypatch.setattr(settings, "fake_llm_token_ms", 0)
+
+
+def test_merge_fails_when_reply_is_truncated(monkeypatch):
+    # resposta maior que max_tokens: o fake corta e devolve finish_reason "length"
+    monkeypatch.setattr(fake_llm, "_reply_for", lambda messages: [" regra"] * 5000)
+    with pytest.raises(CompletionTruncated):
+        _merge(FakeGroq(), "sp", "regras:\n  - a\n", ["- b"], 0.2)
+
+
+def test_merge_returns_complete_reply():
+    assert _merge(FakeGroq(), "sp", "regras:\n  - a\n", ["- b"], 0.2)
+
+
+def test_delta_rejects_matrix_above_merge_output_cap():
+    with pytest.raises(ValueError, match="mode=replace"):
+        merge_into_matrix(FakeGroq(), "sp", "x" * 20000, ["doc novo"], [])
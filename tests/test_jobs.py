@@ -0,0 +1,39 @@
+import time
+
+import pytest
+
+from app.core.config import settings
+from app.infra.file_lock import file_lock
+from app.infra.job_store import JobStore
+from app.services.ingest_jobs import JobRunner
+
+
+@pytest.fixture
+def jobs(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "store_fsync", False)
+    return JobStore(tmp_path / "jobs")
+
+
+def test_delayed_submit_waits_on_the_worker_queue(jobs):
+    runner = JobRunner(jobs)
+    runner.submit("depois", delay_s=0.2)
+    runner.submit("agora")
+    t0 = time.monotonic()
+    assert runner._next() == "agora"
+    assert runner._next() == "depois"
+    assert time.monotonic() - t0 >= 0.19
+
+
+def test_prune_removes_old_finished_jobs_and_their_locks(jobs):
+    for job_id in ("velho", "novo", "rodando"):
+        jobs.create(job_id, "t", "u", "a", {})
+        with file_lock(jobs.lock_path(job_id)):
+            pass
+    jobs.jobs.put({**jobs.get("velho"), "status": "done", "updated_at": "2000-01-01T00:00:00"})
+    jobs.jobs.put({**jobs.get("rodando"), "status": "running", "updated_at": "2000-01-01T00:00:00"})
+    jobs.update("novo", status="failed")
+
+    assert jobs.prune(7) == 1
+    assert jobs.get("velho") is None and not jobs.lock_path("velho").exists()
+    assert not jobs.input_dir("velho").exists()
+    assert jobs.get("novo") and jobs.get("rodando")